@@ -0,0 +1,130 @@
+"""Partition chat_message by month on created_at
+
+Revision ID: 3c6f1b2a9d4e
+Revises:
+Create Date: 2026-10-19 10:12:41.503218
+
+"""
+from time import time
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from ora_backend.config.db import CHAT_MESSAGE_PARTITIONS_AHEAD
+from ora_backend.utils.partitions import (
+    DEFAULT_PARTITION,
+    add_months,
+    get_month_start,
+    get_partition_bounds,
+    get_partition_name,
+)
+
+# revision identifiers, used by Alembic.
+revision = "3c6f1b2a9d4e"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+COLUMNS = (
+    "id",
+    "sequence_num",
+    "chat_id",
+    "type_id",
+    "sender",
+    "content",
+    "created_at",
+    "updated_at",
+)
+
+
+def create_chat_message_table(table_name, primary_key, **kwargs):
+    op.create_table(
+        table_name,
+        sa.Column("id", sa.String(length=32), nullable=False),
+        sa.Column("sequence_num", sa.BigInteger(), nullable=False),
+        sa.Column("chat_id", sa.String(length=32), nullable=False),
+        sa.Column("type_id", sa.SmallInteger(), nullable=False),
+        sa.Column("sender", sa.String(length=32), nullable=True),
+        sa.Column("content", postgresql.JSON(), server_default="{}", nullable=False),
+        sa.Column("created_at", sa.BigInteger(), nullable=False),
+        sa.Column("updated_at", sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint(*primary_key, name="chat_message_pkey"),
+        **kwargs
+    )
+
+
+def create_chat_message_indexes():
+    op.create_index("idx_chat_msg_id", "chat_message", ["id"])
+    op.create_index("idx_chat_msg_chat_id", "chat_message", ["chat_id"])
+    op.create_index("idx_chat_msg_sender", "chat_message", ["sender"])
+
+
+def move_chat_message_table(old_table_name):
+    """Rename the table, and its constraint and indexes to free up their names."""
+    op.drop_index("idx_chat_msg_id", table_name="chat_message")
+    op.drop_index("idx_chat_msg_chat_id", table_name="chat_message")
+    op.drop_index("idx_chat_msg_sender", table_name="chat_message")
+    op.execute(
+        "ALTER TABLE chat_message RENAME CONSTRAINT chat_message_pkey TO {}_pkey".format(
+            old_table_name
+        )
+    )
+    op.rename_table("chat_message", old_table_name)
+
+
+def copy_chat_messages(from_table_name):
+    columns = ", ".join(COLUMNS)
+    op.execute(
+        "INSERT INTO chat_message ({}) SELECT {} FROM {}".format(
+            columns, columns, from_table_name
+        )
+    )
+    op.drop_table(from_table_name)
+
+
+def upgrade():
+    move_chat_message_table("chat_message_legacy")
+    create_chat_message_table(
+        "chat_message",
+        ("id", "created_at"),
+        postgresql_partition_by="RANGE (created_at)",
+    )
+
+    # Create the partitions of all the existing messages, and of the next months
+    current_month = get_month_start(int(time() * 1000))
+    oldest_created_at = (
+        op.get_bind()
+        .execute(sa.text("SELECT MIN(created_at) FROM chat_message_legacy"))
+        .scalar()
+    )
+    month_start = (
+        get_month_start(oldest_created_at)
+        if oldest_created_at is not None
+        else current_month
+    )
+    last_month = add_months(current_month, CHAT_MESSAGE_PARTITIONS_AHEAD)
+    while month_start <= last_month:
+        op.execute(
+            "CREATE TABLE {} PARTITION OF chat_message FOR VALUES FROM ({}) TO ({})".format(
+                get_partition_name(month_start), *get_partition_bounds(month_start)
+            )
+        )
+        month_start = add_months(month_start, 1)
+    op.execute(
+        "CREATE TABLE {} PARTITION OF chat_message DEFAULT".format(DEFAULT_PARTITION)
+    )
+
+    copy_chat_messages("chat_message_legacy")
+    create_chat_message_indexes()
+    op.execute("ANALYZE chat_message")
+
+
+def downgrade():
+    move_chat_message_table("chat_message_partitioned")
+    create_chat_message_table("chat_message", ("id",))
+
+    # Drop the partitions along with the partitioned table
+    copy_chat_messages("chat_message_partitioned")
+    create_chat_message_indexes()
+    op.execute("ANALYZE chat_message")
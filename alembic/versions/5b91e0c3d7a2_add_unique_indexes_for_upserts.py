@@ -0,0 +1,54 @@
+"""Add the unique indexes for the upserts
+
+Revision ID: 5b91e0c3d7a2
+Revises: 8e2d4a7c1f90
+Create Date: 2026-10-19 16:41:09.572613
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b91e0c3d7a2"
+down_revision = "8e2d4a7c1f90"
+branch_labels = None
+depends_on = None
+
+# The indexes used by `ON CONFLICT` of `upsert_one()` in `ora_backend/utils/query.py`
+INDEXES = (
+    (
+        "bookmark_visitor",
+        "idx_bookmark_visitor_staff_visitor",
+        ["staff_id", "visitor_id"],
+    ),
+    ("chat_message_seen", "idx_chat_msg_seen_staff_chat", ["staff_id", "chat_id"]),
+)
+
+
+def upgrade():
+    for table_name, index_name, columns in INDEXES:
+        # Only keep the latest row of the duplicates created by concurrent requests
+        op.execute(
+            """
+            DELETE FROM {table} AS duplicate
+            USING {table} AS latest
+            WHERE
+                {conditions}
+                AND duplicate.internal_id < latest.internal_id
+            """.format(
+                table=table_name,
+                conditions=" AND ".join(
+                    "duplicate.{column} = latest.{column}".format(column=column)
+                    for column in columns
+                ),
+            )
+        )
+        op.drop_index(index_name, table_name=table_name)
+        op.create_index(index_name, table_name, columns, unique=True)
+
+
+def downgrade():
+    for table_name, index_name, columns in INDEXES:
+        op.drop_index(index_name, table_name=table_name)
+        op.create_index(index_name, table_name, columns)
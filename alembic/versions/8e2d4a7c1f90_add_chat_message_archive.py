@@ -0,0 +1,44 @@
+"""Add chat_message_archive
+
+Revision ID: 8e2d4a7c1f90
+Revises: 3c6f1b2a9d4e
+Create Date: 2026-10-19 14:03:27.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8e2d4a7c1f90"
+down_revision = "3c6f1b2a9d4e"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "chat_message_archive",
+        sa.Column("id", sa.String(length=32), nullable=False),
+        sa.Column("chat_id", sa.String(length=32), nullable=False),
+        sa.Column("first_sequence_num", sa.BigInteger(), nullable=False),
+        sa.Column("last_sequence_num", sa.BigInteger(), nullable=False),
+        sa.Column("first_created_at", sa.BigInteger(), nullable=False),
+        sa.Column("last_created_at", sa.BigInteger(), nullable=False),
+        sa.Column("message_count", sa.Integer(), nullable=False),
+        sa.Column("messages", sa.LargeBinary(), nullable=False),
+        sa.Column("created_at", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "idx_chat_msg_archive_chat_sequence_num",
+        "chat_message_archive",
+        ["chat_id", "first_sequence_num"],
+    )
+
+
+def downgrade():
+    op.drop_index(
+        "idx_chat_msg_archive_chat_sequence_num", table_name="chat_message_archive"
+    )
+    op.drop_table("chat_message_archive")
@@ -0,0 +1,24 @@
+"""Add an index on chat_unhandled.created_at
+
+Revision ID: a7c3e9d15b42
+Revises: d4a8f2b61e37
+Create Date: 2026-10-19 20:41:08.317254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a7c3e9d15b42"
+down_revision = "d4a8f2b61e37"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("idx_chat_unhandled_created_at", "chat_unhandled", ["created_at"])
+
+
+def downgrade():
+    op.drop_index("idx_chat_unhandled_created_at", table_name="chat_unhandled")
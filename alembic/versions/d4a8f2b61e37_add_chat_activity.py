@@ -0,0 +1,57 @@
+"""Add chat_activity
+
+Revision ID: d4a8f2b61e37
+Revises: 5b91e0c3d7a2
+Create Date: 2026-10-19 18:22:54.906137
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "d4a8f2b61e37"
+down_revision = "5b91e0c3d7a2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "chat_activity",
+        sa.Column("internal_id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("organisation_id", sa.String(length=32), nullable=False),
+        sa.Column("visitor_id", sa.String(length=32), nullable=False),
+        sa.Column("last_staff_msg_at", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("internal_id"),
+    )
+
+    # The last message of each organisation's staffs to each visitor
+    op.execute(
+        """
+        INSERT INTO chat_activity (organisation_id, visitor_id, last_staff_msg_at)
+        SELECT "user".organisation_id, chat.visitor_id, MAX(chat_message.created_at)
+        FROM chat_message
+        JOIN "user" ON "user".id = chat_message.sender
+        JOIN chat ON chat.id = chat_message.chat_id
+        GROUP BY "user".organisation_id, chat.visitor_id
+        """
+    )
+
+    op.create_index(
+        "idx_chat_activity_org_visitor",
+        "chat_activity",
+        ["organisation_id", "visitor_id"],
+        unique=True,
+    )
+    op.create_index(
+        "idx_chat_activity_org_last_staff_msg",
+        "chat_activity",
+        ["organisation_id", "last_staff_msg_at", "visitor_id"],
+    )
+
+
+def downgrade():
+    op.drop_index("idx_chat_activity_org_last_staff_msg", table_name="chat_activity")
+    op.drop_index("idx_chat_activity_org_visitor", table_name="chat_activity")
+    op.drop_table("chat_activity")
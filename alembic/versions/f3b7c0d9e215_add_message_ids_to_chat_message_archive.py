@@ -0,0 +1,62 @@
+"""Add the ids of the messages to chat_message_archive
+
+Revision ID: f3b7c0d9e215
+Revises: a7c3e9d15b42
+Create Date: 2026-10-19 22:17:45.603918
+
+"""
+import json
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = "f3b7c0d9e215"
+down_revision = "a7c3e9d15b42"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        "chat_message_archive",
+        sa.Column(
+            "message_ids",
+            postgresql.ARRAY(sa.String(length=32)),
+            server_default="{}",
+            nullable=False,
+        ),
+    )
+
+    # Fill the ids of the existing segments
+    connection = op.get_bind()
+    segments = connection.execute(
+        sa.text("SELECT id, messages FROM chat_message_archive")
+    ).fetchall()
+    for segment_id, data in segments:
+        messages = json.loads(zlib.decompress(data).decode("utf-8"))
+        connection.execute(
+            sa.text(
+                "UPDATE chat_message_archive SET message_ids = :message_ids "
+                "WHERE id = :id"
+            ).bindparams(
+                sa.bindparam("message_ids", type_=postgresql.ARRAY(sa.String))
+            ),
+            message_ids=[message["id"] for message in messages],
+            id=segment_id,
+        )
+
+    op.create_index(
+        "idx_chat_msg_archive_message_ids",
+        "chat_message_archive",
+        ["message_ids"],
+        postgresql_using="gin",
+    )
+
+
+def downgrade():
+    op.drop_index("idx_chat_msg_archive_message_ids", table_name="chat_message_archive")
+    op.drop_column("chat_message_archive", "message_ids")
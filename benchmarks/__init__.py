@@ -0,0 +1,7 @@
+"""
+Benchmark tools to measure the back-end under load.
+
+The tools are meant to be run against a local stack
+(refer to `scripts/dev.sh`), and every tool reports its results as JSON,
+so that a run could be compared against a stored baseline.
+"""
@@ -0,0 +1,24 @@
+from sanic_jwt_extended import create_access_token
+
+from ora_backend import app
+from ora_backend.utils.crypto import sign_str
+
+# The fields to put in the access token, similar to BaseUser.login()
+IDENTITY_FIELDS = {
+    "id",
+    "full_name",
+    "display_name",
+    "name",
+    "email",
+    "role_id",
+    "organisation_id",
+    "is_anonymous",
+    "disabled",
+}
+
+
+async def get_access_token(identity: dict):
+    """Return a signed access token, as the one returned on login."""
+    identity = {key: val for key, val in identity.items() if key in IDENTITY_FIELDS}
+    token = await create_access_token(identity=identity, app=app)
+    return sign_str(token)
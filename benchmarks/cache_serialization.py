@@ -0,0 +1,99 @@
+"""
+A benchmark of the serialization of the values stored in the cache.
+
+It generates values in the shapes of the cached ones:
+- "visitor_info": the info of a visitor, cached on its first message.
+- "online_visitors": the online visitors, with their chats and staffs.
+- "online_users": the online staffs, by id.
+
+For each value, it compares the size and the encoding/decoding times
+of the JSON and binary (msgpack) formats of `ora_backend.utils.cache_serializers`.
+
+Usage:
+    PYTHONPATH=. python -m benchmarks.cache_serialization --size 100
+
+Refer to `python -m benchmarks.cache_serialization --help` for all the options.
+"""
+import argparse
+
+from ora_backend.models import generate_uuid
+from ora_backend.utils.cache_serializers import CacheSerializer, msgpack
+from ora_backend.utils.query import chat_fields, user_fields, visitor_fields
+from benchmarks.json_encoding import generate_row, measure
+from benchmarks.stats import dump_report
+
+SERIALIZERS = {"json": CacheSerializer(), "msgpack": CacheSerializer(binary=True)}
+
+
+def _encode(serializer, value):
+    encoded = serializer.dumps(value)
+    return encoded.encode("utf-8") if isinstance(encoded, str) else encoded
+
+
+def generate_values(size: int):
+    staffs = {
+        staff["id"]: {**staff, "sid": generate_uuid()}
+        for staff in (generate_row(user_fields, index) for index in range(size // 5))
+    }
+    online_visitors = {}
+    for index in range(size):
+        visitor = generate_row(visitor_fields, index)
+        online_visitors[visitor["id"]] = {
+            **visitor,
+            "room": generate_row(chat_fields, index),
+            "staffs": dict(list(staffs.items())[:2]),
+        }
+    return {
+        "visitor_info": generate_row(visitor_fields, 0),
+        "online_visitors": online_visitors,
+        "online_users": staffs,
+    }
+
+
+def run_benchmark(args):
+    results = {}
+    for name, value in generate_values(args.size).items():
+        results[name] = {}
+        for format_name, serializer in SERIALIZERS.items():
+            encoded = _encode(serializer, value)
+            assert serializer.loads(encoded) == value
+            results[name][format_name] = {
+                "bytes": len(encoded),
+                "encode": measure(lambda: serializer.dumps(value), args.repeat),
+                "decode": measure(lambda: serializer.loads(encoded), args.repeat),
+            }
+    return {
+        "size": args.size,
+        "repeat": args.repeat,
+        "msgpack": msgpack is not None,
+        "values": results,
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Compare the JSON and binary formats of the cached values."
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=100,
+        help="The number of online visitors (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1000,
+        help="The number of encodings per format and value (default: %(default)s)",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    dump_report(run_benchmark(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Generate a large synthetic dataset in a local PostgreSQL,
+to benchmark the endpoints once the tables have grown.
+
+The rows are loaded with COPY in batches, as inserting millions of rows
+one by one through the models would take hours.
+
+Usage:
+    PYTHONPATH=. python -m benchmarks.dataset --visitors 100000 --messages 5000000 --staffs 500
+
+Refer to `python -m benchmarks.dataset --help` for all the options.
+"""
+import argparse
+import asyncio
+import json
+from os import environ
+from random import choice, randint, random, sample
+from time import perf_counter
+
+from ora_backend import db
+from ora_backend.config.db import get_db_url
+from ora_backend.constants import ROLES
+from ora_backend.models import Organisation, generate_uuid, unix_time
+from ora_backend.tests import fake
+from ora_backend.tests.setup_dev_db import setup_db
+from ora_backend.utils.crypto import hash_password
+from ora_backend.utils.partitions import create_chat_message_partitions
+from ora_backend.utils.query import rebuild_chat_activity
+
+BATCH_SIZE = 50000
+
+# Generating a fake name for each row is slow,
+# so the names are picked from a smaller pool
+NAME_POOL_SIZE = 2000
+
+# The password of all the generated staffs
+STAFF_PASSWORD = "benchmark1234"
+
+# 90 days, in miliseconds
+TIME_SPAN = 90 * 24 * 60 * 60 * 1000
+
+
+def batched(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def copy_rows(table_name: str, columns: list, rows):
+    """COPY the rows (an iterable of tuples) to the table, batch by batch."""
+    count = 0
+    async with db.acquire() as conn:
+        raw_conn = await conn.get_raw_connection()
+        for batch in batched(rows):
+            await raw_conn.copy_records_to_table(
+                table_name, records=batch, columns=columns
+            )
+            count += len(batch)
+    return count
+
+
+class DatasetGenerator:
+    def __init__(self, args):
+        self.args = args
+        self.now = unix_time()
+        self.names = [fake.name() for _ in range(NAME_POOL_SIZE)]
+        self.visitor_ids = []
+        self.chat_ids = []
+        self.staffs = []
+        self.subscriptions = {}
+
+    def random_timestamp(self):
+        return self.now - randint(0, TIME_SPAN)
+
+    async def get_organisation_id(self):
+        orgs = await Organisation.query.gino.all()
+        if not orgs:
+            # An empty DB, create the org, roles and settings first
+            await setup_db()
+            orgs = await Organisation.query.gino.all()
+        return orgs[0].id
+
+    async def generate_staffs(self):
+        org_id = await self.get_organisation_id()
+        password = hash_password(STAFF_PASSWORD)
+
+        rows = []
+        for index in range(self.args.staffs):
+            # 1% are admins, 5% are supervisors and the rest are agents
+            if index < max(self.args.staffs // 100, 1):
+                role_id = ROLES.inverse["admin"]
+            elif index < max(self.args.staffs // 20, 2):
+                role_id = ROLES.inverse["supervisor"]
+            else:
+                role_id = ROLES.inverse["agent"]
+
+            staff_id = generate_uuid()
+            self.staffs.append({"id": staff_id, "role_id": role_id})
+            rows.append(
+                (
+                    staff_id,
+                    choice(self.names),
+                    role_id,
+                    "bench_staff_{}@example.com".format(staff_id),
+                    password,
+                    False,
+                    org_id,
+                    self.random_timestamp(),
+                )
+            )
+
+        return await copy_rows(
+            "user",
+            [
+                "id",
+                "full_name",
+                "role_id",
+                "email",
+                "password",
+                "disabled",
+                "organisation_id",
+                "created_at",
+            ],
+            rows,
+        )
+
+    async def generate_visitors_and_chats(self):
+        visitor_rows = []
+        chat_rows = []
+        for _ in range(self.args.visitors):
+            visitor_id = generate_uuid()
+            chat_id = generate_uuid()
+            created_at = self.random_timestamp()
+            self.visitor_ids.append(visitor_id)
+            self.chat_ids.append(chat_id)
+
+            visitor_rows.append(
+                (visitor_id, choice(self.names), True, False, created_at)
+            )
+
+            # Some chats are flagged
+            severity_level = 1 if random() < self.args.flagged_ratio else 0
+            chat_rows.append((chat_id, visitor_id, severity_level, created_at))
+
+        count = await copy_rows(
+            "visitor",
+            ["id", "name", "is_anonymous", "disabled", "created_at"],
+            visitor_rows,
+        )
+        await copy_rows(
+            "chat", ["id", "visitor_id", "severity_level", "created_at"], chat_rows
+        )
+        return count
+
+    async def generate_subscriptions(self):
+        rows = []
+        for visitor_id in self.visitor_ids:
+            staffs = sample(self.staffs, min(randint(1, 3), len(self.staffs)))
+            self.subscriptions[visitor_id] = [staff["id"] for staff in staffs]
+            for staff in staffs:
+                rows.append(
+                    (generate_uuid(), visitor_id, staff["id"], self.random_timestamp())
+                )
+
+        return await copy_rows(
+            "staff_subscription_chat",
+            ["id", "visitor_id", "staff_id", "created_at"],
+            rows,
+        )
+
+    def message_rows(self):
+        messages_per_chat = max(self.args.messages // max(len(self.chat_ids), 1), 1)
+        content = json.dumps({"content": "Hello, this is a benchmark message."})
+        for visitor_id, chat_id in zip(self.visitor_ids, self.chat_ids):
+            staff_ids = self.subscriptions.get(visitor_id) or [None]
+            gaps = [randint(1000, 5 * 60 * 1000) for _ in range(messages_per_chat)]
+            # Start early enough for the last message not to be in the future
+            created_at = min(self.random_timestamp(), self.now - sum(gaps))
+            for sequence_num, gap in enumerate(gaps, 1):
+                # Visitors and staffs take turn to send messages
+                sender = choice(staff_ids) if sequence_num % 2 == 0 else None
+                created_at += gap
+                yield (
+                    generate_uuid(),
+                    sequence_num,
+                    chat_id,
+                    1,
+                    sender,
+                    content,
+                    created_at,
+                )
+
+    async def generate_messages(self):
+        return await copy_rows(
+            "chat_message",
+            [
+                "id",
+                "sequence_num",
+                "chat_id",
+                "type_id",
+                "sender",
+                "content",
+                "created_at",
+            ],
+            self.message_rows(),
+        )
+
+    async def generate_queues(self):
+        unhandled_rows = []
+        flagged_rows = []
+        flag_message = json.dumps({"content": "Please have a look"})
+        for visitor_id in self.visitor_ids:
+            if random() < self.args.unhandled_ratio:
+                unhandled_rows.append(
+                    (generate_uuid(), visitor_id, self.random_timestamp())
+                )
+            if random() < self.args.flagged_ratio:
+                flagged_rows.append(
+                    (generate_uuid(), visitor_id, flag_message, self.random_timestamp())
+                )
+
+        count = await copy_rows(
+            "chat_unhandled", ["id", "visitor_id", "created_at"], unhandled_rows
+        )
+        count += await copy_rows(
+            "chat_flagged",
+            ["id", "visitor_id", "flag_message", "created_at"],
+            flagged_rows,
+        )
+        return count
+
+    async def generate_notifications(self):
+        content = json.dumps({"content": "You have been assigned to a chat"})
+        rows = (
+            (generate_uuid(), staff["id"], content, self.random_timestamp())
+            for staff in self.staffs
+            for _ in range(self.args.notifications_per_staff)
+        )
+        return await copy_rows(
+            "notification_staff", ["id", "staff_id", "content", "created_at"], rows
+        )
+
+    async def generate(self):
+        steps = [
+            ("staffs", self.generate_staffs),
+            ("visitors and chats", self.generate_visitors_and_chats),
+            ("subscriptions", self.generate_subscriptions),
+            ("messages", self.generate_messages),
+            ("chat activities", rebuild_chat_activity),
+            ("unhandled and flagged chats", self.generate_queues),
+            ("notifications", self.generate_notifications),
+        ]
+        for name, step in steps:
+            start = perf_counter()
+            count = await step()
+            print(
+                "INFO: Added {} rows of {} in {:.1f}s".format(
+                    count, name, perf_counter() - start
+                )
+            )
+
+        # Refresh the statistics for the query planner
+        await db.status(db.text("ANALYZE;"))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Load a large synthetic dataset into the local PostgreSQL."
+    )
+    parser.add_argument("--visitors", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=5000000)
+    parser.add_argument("--staffs", type=int, default=500)
+    parser.add_argument("--notifications-per-staff", type=int, default=50)
+    parser.add_argument("--unhandled-ratio", type=float, default=0.1)
+    parser.add_argument("--flagged-ratio", type=float, default=0.02)
+    return parser
+
+
+async def main(args):
+    await db.set_bind(get_db_url())
+    await db.gino.create_all()
+    # Create the monthly partitions of the generated messages
+    await create_chat_message_partitions(since=unix_time() - TIME_SPAN)
+    await DatasetGenerator(args).generate()
+    await db.pop_bind().close()
+
+
+if __name__ == "__main__":
+    if environ.get("MODE", "development").lower() == "production":
+        raise SystemExit("The dataset must not be generated in production.")
+
+    asyncio.get_event_loop().run_until_complete(main(get_parser().parse_args()))
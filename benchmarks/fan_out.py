@@ -0,0 +1,163 @@
+"""
+A latency benchmark of the staff fan-out of a chat (`update_staffs_in_chat_if_possible`).
+
+For every staff count, it repeatedly replaces all the staffs of a chat
+with as many other staffs, against a local stack (PostgreSQL and Redis),
+and reports the latency of every replacement as JSON.
+
+All the staffs are marked as online for the run, so that no emails are sent.
+The subscriptions and notifications created by the benchmark are deleted afterwards.
+
+Usage:
+    PYTHONPATH=. python -m benchmarks.fan_out --staff-counts 1 5 10 25 50
+
+Refer to `python -m benchmarks.fan_out --help` for all the options.
+"""
+import argparse
+import asyncio
+from time import perf_counter
+
+from ora_backend import cache, db
+from ora_backend.config.db import get_db_url
+from ora_backend.constants import CACHE_SETTINGS, ONLINE_USERS_PREFIX, ROLES
+from ora_backend.models import (
+    NotificationStaff,
+    Organisation,
+    StaffSubscriptionChat,
+    User,
+    Visitor,
+    generate_uuid,
+)
+from ora_backend.utils.settings import get_settings_from_cache
+from ora_backend.views.chat_socketio import update_staffs_in_chat_if_possible
+from benchmarks.stats import dump_report, summarize
+
+
+async def prepare_staffs(number_of_staffs: int):
+    """Use the existing agents in the DB, and create more if there are not enough."""
+    staffs = await User.get(
+        many=True,
+        limit=number_of_staffs,
+        disabled=False,
+        role_id=ROLES.inverse["agent"],
+    )
+    if len(staffs) < number_of_staffs:
+        org = (await Organisation.query.gino.all())[0]
+        for index in range(len(staffs), number_of_staffs):
+            staff = await User.add(
+                full_name="Fan-out Agent {}".format(index),
+                email="fan_out_agent_{}@example.com".format(generate_uuid()),
+                password="loadtest1234",
+                role_id=ROLES.inverse["agent"],
+                organisation_id=org.id,
+            )
+            staffs.append(staff)
+    return staffs
+
+
+async def run_staff_count(requester, staffs, visitor, count: int, repeat: int):
+    """Alternate the staffs of the chat between 2 disjoint groups of `count` staffs."""
+    staff_ids = [staff["id"] for staff in staffs]
+    groups = (staff_ids[:count], staff_ids[count : count * 2])
+    visitor_info = {"room": {"id": generate_uuid(), "staffs": {}}, "user": visitor}
+
+    # Subscribe the first group, outside of the measures
+    await update_staffs_in_chat_if_possible(
+        requester, groups[0], visitor["id"], visitor_info
+    )
+
+    latencies = []
+    started_at = perf_counter()
+    for index in range(repeat):
+        staff_ids = groups[(index + 1) % 2]
+        call_started_at = perf_counter()
+        await update_staffs_in_chat_if_possible(
+            requester, staff_ids, visitor["id"], visitor_info
+        )
+        latencies.append(perf_counter() - call_started_at)
+    duration = perf_counter() - started_at
+
+    # Unsubscribe the last group, so the next count starts from an empty chat
+    await update_staffs_in_chat_if_possible(requester, [], visitor["id"], visitor_info)
+    return summarize(latencies, 0, duration)
+
+
+async def run_benchmark(args):
+    await db.set_bind(get_db_url())
+    max_count = max(args.staff_counts)
+    staffs = await prepare_staffs(max_count * 2)
+    requester = (
+        await User.get(many=True, limit=1, role_id=ROLES.inverse["admin"]) or staffs[:1]
+    )[0]
+    visitor = await Visitor.add(name="Fan-out Visitor", is_anonymous=True)
+
+    # Allow all the staffs in the chat, and mark them as online
+    settings = await get_settings_from_cache()
+    onl_users = await cache.get(ONLINE_USERS_PREFIX, {})
+    await cache.set(
+        CACHE_SETTINGS,
+        {**settings, "max_staffs_in_chat": max_count},
+        namespace="settings",
+    )
+    await cache.set(
+        ONLINE_USERS_PREFIX,
+        {
+            **{staff["id"]: {**staff, "sid": generate_uuid()} for staff in staffs},
+            **onl_users,
+        },
+    )
+
+    results = {}
+    try:
+        for count in sorted(set(args.staff_counts)):
+            results[str(count)] = await run_staff_count(
+                requester, staffs, visitor, count, args.repeat
+            )
+    finally:
+        await cache.set(CACHE_SETTINGS, settings, namespace="settings")
+        await cache.set(ONLINE_USERS_PREFIX, onl_users)
+
+        staff_ids = [staff["id"] for staff in staffs]
+        await StaffSubscriptionChat.delete.where(
+            StaffSubscriptionChat.visitor_id == visitor["id"]
+        ).gino.status()
+        await NotificationStaff.delete.where(
+            NotificationStaff.staff_id.in_(staff_ids)
+            & NotificationStaff.content["content"].astext.contains(visitor["name"])
+        ).gino.status()
+        await Visitor.delete.where(Visitor.id == visitor["id"]).gino.status()
+        await db.pop_bind().close()
+
+    return {"repeat": args.repeat, "staff_counts": results}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure the latency of replacing the staffs of a chat."
+    )
+    parser.add_argument(
+        "--staff-counts",
+        nargs="+",
+        type=int,
+        default=[1, 5, 10, 25, 50],
+        help="The numbers of staffs replaced at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=50,
+        help="The number of replacements per staff count (default: %(default)s)",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(run_benchmark(args))
+    dump_report(report, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+A latency benchmark for the heaviest HTTP endpoints (app.py).
+
+It sends concurrent requests to each endpoint as a single staff,
+and reports the latency distribution of every endpoint as JSON.
+The endpoints should be benchmarked against a large dataset,
+refer to `benchmarks/dataset.py`.
+
+Usage:
+    PYTHONPATH=. python -m benchmarks.http_endpoints --requests 200 --concurrency 10
+
+Refer to `python -m benchmarks.http_endpoints --help` for all the options.
+"""
+import argparse
+import asyncio
+from os import makedirs
+from os.path import abspath, dirname, exists, join
+from random import choice
+from time import perf_counter
+
+import aiohttp
+
+from ora_backend import db
+from ora_backend.config.db import get_db_url
+from ora_backend.constants import ROLES
+from ora_backend.models import User, Visitor
+from benchmarks.auth import get_access_token
+from benchmarks.stats import (
+    compare_to_baseline,
+    dump_report,
+    load_report,
+    summarize,
+)
+
+DEFAULT_BASELINE = join(dirname(abspath(__file__)), "baselines", "http_endpoints.json")
+
+# {name: path}, `{visitor_id}` is replaced by a random visitor on each request
+ENDPOINTS = {
+    "visitors_unread": "/visitors/unread",
+    "visitors_most_recent": "/visitors/most_recent",
+    "visitors_unhandled": "/visitors/unhandled",
+    "visitors_subscribed": "/visitors/subscribed",
+    "visitors_flagged": "/visitors/flagged",
+    "visitor_messages": "/visitors/{visitor_id}/messages",
+    "users_notifications": "/users/notifications",
+}
+
+# The number of visitors to pick the `{visitor_id}` from
+VISITOR_SAMPLE_SIZE = 1000
+
+
+async def get_staff(email: str = None):
+    """Return the staff with the given email, or the first active supervisor."""
+    if email:
+        return await User.get(email=email)
+
+    staffs = await User.get(
+        many=True, limit=1, role_id=ROLES.inverse["supervisor"], disabled=False
+    )
+    if not staffs:
+        raise SystemExit("No supervisors found, please generate the dataset first.")
+    return staffs[0]
+
+
+async def benchmark_endpoint(session, url, path, visitor_ids, args):
+    latencies = []
+    errors = 0
+    status_codes = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def send_request():
+        nonlocal errors
+        endpoint_url = url + path.format(visitor_id=choice(visitor_ids))
+        async with semaphore:
+            start = perf_counter()
+            try:
+                async with session.get(endpoint_url) as resp:
+                    await resp.read()
+                    status = resp.status
+            except aiohttp.ClientError as exc:
+                status = type(exc).__name__
+            latencies.append(perf_counter() - start)
+
+        status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+        if status != 200:
+            errors += 1
+
+    # Warm up the caches and the DB connections, without recording them
+    for _ in range(args.warmup):
+        async with session.get(url + path.format(visitor_id=choice(visitor_ids))):
+            pass
+
+    start = perf_counter()
+    await asyncio.gather(*(send_request() for _ in range(args.requests)))
+    summary = summarize(latencies, errors, perf_counter() - start)
+    summary["status_codes"] = status_codes
+    return summary
+
+
+async def run_benchmark(args):
+    await db.set_bind(get_db_url())
+    staff = await get_staff(args.email)
+    visitors = await Visitor.get(many=True, limit=VISITOR_SAMPLE_SIZE)
+    token = await get_access_token(staff)
+    await db.pop_bind().close()
+
+    if not visitors:
+        raise SystemExit("No visitors found, please generate the dataset first.")
+    visitor_ids = [visitor["id"] for visitor in visitors]
+
+    endpoints = args.endpoints or list(ENDPOINTS)
+    results = {}
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    async with aiohttp.ClientSession(
+        cookies={"access_token": token}, timeout=timeout
+    ) as session:
+        for name in endpoints:
+            results[name] = await benchmark_endpoint(
+                session, args.url, ENDPOINTS[name], visitor_ids, args
+            )
+
+    return {
+        "endpoints": results,
+        "config": {
+            "url": args.url,
+            "staff_role": ROLES[staff["role_id"]],
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+        },
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Measure the latencies of the heaviest HTTP endpoints."
+    )
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument(
+        "--email", help="Email of the requesting staff (default: a supervisor)"
+    )
+    parser.add_argument(
+        "--endpoints",
+        nargs="+",
+        choices=sorted(ENDPOINTS),
+        help="The endpoints to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--requests", type=int, default=200, help="Requests sent to each endpoint"
+    )
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--warmup", type=int, default=5, help="Unrecorded requests per endpoint"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="Seconds to wait for a response"
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument(
+        "--baseline",
+        default=DEFAULT_BASELINE,
+        help="A previous JSON report to compare with (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the report as the new baseline, instead of comparing with it",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative increase of latencies against the baseline",
+    )
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(run_benchmark(args))
+    dump_report(report, args.output)
+
+    if args.update_baseline:
+        makedirs(dirname(args.baseline), exist_ok=True)
+        dump_report(report, args.baseline)
+        print("INFO: Stored the baseline at", args.baseline)
+        return
+
+    if not exists(args.baseline):
+        print("INFO: No baseline found at", args.baseline)
+        return
+
+    baseline = load_report(args.baseline)
+    regressions = compare_to_baseline(
+        report["endpoints"], baseline["endpoints"], tolerance=args.tolerance
+    )
+    for regression in regressions:
+        print("REGRESSION:", regression)
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
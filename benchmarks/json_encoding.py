@@ -0,0 +1,173 @@
+"""
+A benchmark of the JSON encoding of the payloads sent by the backend.
+
+It generates payloads in the shapes of the real ones:
+- "messages": a page of the messages of a chat, with their senders.
+- "visitors": a page of the visitors with their chats.
+- "staff_init": the payload sent to a staff on connection,
+  with the unclaimed chats, the online staffs and the online visitors.
+
+For each payload, it compares the encoding to bytes (as sent in an HTTP response
+or a Socket.IO packet) and the decoding (as read from the cache) of every
+installed JSON library, and of `ora_backend.utils.fast_json`.
+
+Usage:
+    PYTHONPATH=. python -m benchmarks.json_encoding --size 100
+
+Refer to `python -m benchmarks.json_encoding --help` for all the options.
+"""
+import argparse
+import json
+from time import perf_counter
+
+from ora_backend.models import generate_uuid, unix_time
+from ora_backend.utils import fast_json
+from ora_backend.utils.query import (
+    chat_fields,
+    message_fields,
+    user_fields,
+    visitor_fields,
+)
+from benchmarks.stats import dump_report, summarize
+
+
+def get_libraries():
+    """Return the {name: (dumps, loads)} of the installed JSON libraries."""
+    libraries = {
+        "json": (
+            lambda obj: json.dumps(obj, separators=(",", ":")).encode("utf-8"),
+            json.loads,
+        )
+    }
+    try:
+        import ujson
+    except ImportError:
+        pass
+    else:
+        libraries["ujson"] = (lambda obj: ujson.dumps(obj).encode("utf-8"), ujson.loads)
+    try:
+        import orjson
+    except ImportError:
+        pass
+    else:
+        libraries["orjson"] = (orjson.dumps, orjson.loads)
+
+    libraries["fast_json ({})".format(fast_json.JSON_LIBRARY)] = (
+        lambda obj: fast_json.dumps(obj).encode("utf-8"),
+        fast_json.loads,
+    )
+    return libraries
+
+
+def generate_row(fields, index):
+    """Generate a row of the `fields`, with values of realistic types."""
+    row = {}
+    for field in fields:
+        if field == "id" or field.endswith("_id") or field == "sender":
+            row[field] = generate_uuid()
+        elif field.endswith("_at"):
+            row[field] = unix_time()
+        elif field in {"disabled", "is_anonymous", "is_bookmarked"}:
+            row[field] = bool(index % 2)
+        elif field in {"sequence_num", "severity_level", "type_id", "internal_id"}:
+            row[field] = index
+        elif field == "content":
+            row[field] = {
+                "content": "Xin chào, this is the message number {}".format(index)
+            }
+        elif field == "tags":
+            row[field] = [{"name": "tag {}".format(index)}]
+        else:
+            row[field] = "{} {}".format(field, index)
+    return row
+
+
+def generate_payloads(size: int):
+    messages = [
+        {
+            **generate_row(message_fields, index),
+            "sender": generate_row(user_fields, index),
+        }
+        for index in range(size)
+    ]
+    visitors = [
+        {**generate_row(chat_fields, index), **generate_row(visitor_fields, index)}
+        for index in range(size)
+    ]
+    staffs = {
+        staff["id"]: {**staff, "sid": generate_uuid()}
+        for staff in (generate_row(user_fields, index) for index in range(size // 5))
+    }
+    online_visitors = [
+        {
+            **generate_row(visitor_fields, index),
+            "room": generate_row(chat_fields, index),
+            "staffs": dict(list(staffs.items())[:2]),
+        }
+        for index in range(size)
+    ]
+    return {
+        "messages": {"data": messages, "links": {}},
+        "visitors": {"data": visitors, "links": {}},
+        "staff_init": {
+            "unclaimed_chats": visitors[: size // 2],
+            "offline_unclaimed_chats": visitors[size // 2 :],
+            "online_users": staffs,
+            "online_visitors": online_visitors,
+        },
+    }
+
+
+def measure(func, repeat: int):
+    latencies = []
+    started_at = perf_counter()
+    for _ in range(repeat):
+        call_started_at = perf_counter()
+        func()
+        latencies.append(perf_counter() - call_started_at)
+    return summarize(latencies, 0, perf_counter() - started_at)
+
+
+def run_benchmark(args):
+    libraries = get_libraries()
+    results = {}
+    for name, payload in generate_payloads(args.size).items():
+        results[name] = {}
+        for library, (dumps, loads) in libraries.items():
+            encoded = dumps(payload)
+            assert loads(encoded) == payload
+            results[name][library] = {
+                "bytes": len(encoded),
+                "encode": measure(lambda: dumps(payload), args.repeat),
+                "decode": measure(lambda: loads(encoded), args.repeat),
+            }
+    return {"size": args.size, "repeat": args.repeat, "payloads": results}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Compare the JSON libraries on the payloads of the backend."
+    )
+    parser.add_argument(
+        "--size",
+        type=int,
+        default=100,
+        help="The number of messages/visitors per payload (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=500,
+        help="The number of encodings per library and payload (default: %(default)s)",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    dump_report(run_benchmark(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,456 @@
+"""
+A query plan regression check for `ora_backend/utils/query.py`.
+
+It calls every query function against a seeded local database
+(refer to `benchmarks/dataset.py`), inside a transaction which is rolled back,
+records the SQL statements sent to PostgreSQL, and runs `EXPLAIN (FORMAT JSON)` on them.
+
+A query fails the check if its plan has a sequential scan on a large table,
+or if its total cost is above the threshold of its case.
+The shape of every plan is stored as a snapshot, to review how the plans change.
+
+Usage:
+    PYTHONPATH=. python -m benchmarks.query_plans --update-snapshots
+
+Refer to `python -m benchmarks.query_plans --help` for all the options.
+"""
+import argparse
+import asyncio
+import json
+import re
+from os import makedirs
+from os.path import abspath, dirname, exists, join
+
+from gino.dialects.asyncpg import DBAPICursor
+
+from ora_backend import db
+from ora_backend.config.db import get_db_url
+from ora_backend.constants import ROLES
+from ora_backend.models import (
+    BookmarkVisitor,
+    Chat,
+    ChatActivity,
+    ChatFlagged,
+    ChatMessage,
+    ChatUnhandled,
+    NotificationStaff,
+    NotificationStaffRead,
+    StaffSubscriptionChat,
+    User,
+    Visitor,
+)
+from ora_backend.utils import high_ups, query
+from ora_backend.utils.partitions import DEFAULT_PARTITION, PARTITIONED_TABLE
+from benchmarks.stats import dump_report
+
+DEFAULT_SNAPSHOT_DIR = join(dirname(abspath(__file__)), "baselines", "query_plans")
+
+# The tables which grow with the number of visitors and messages
+LARGE_TABLES = {
+    "visitor",
+    "chat",
+    "chat_message",
+    "chat_message_seen",
+    "chat_unhandled",
+    "chat_flagged",
+    "staff_subscription_chat",
+    "bookmark_visitor",
+    "notification_staff",
+    "chat_activity",
+}
+
+# The planner prefers sequential scans on small tables,
+# so the plans are only meaningful on a seeded database
+MIN_SEEDED_MESSAGES = 100000
+
+DEFAULT_MAX_COST = 10000
+
+# The plan's fields kept in the snapshots
+# Costs and estimated rows are left out, as they change with every ANALYZE
+SHAPE_FIELDS = ("Relation Name", "Index Name", "Join Type", "Strategy")
+
+
+class QueryCase:
+    """
+    A call of a query function, with the limits of its plans.
+
+    Args:
+        name (str):
+            The name of the case, also used as the snapshot's filename.
+
+        call (function):
+            An async function, taking the samples from `get_samples()`,
+            which calls the query function.
+
+        allowed_seq_scans (set):
+            The large tables this case is allowed to fully scan.
+
+        max_cost (float):
+            The maximum total cost of every plan, or None for no limit.
+    """
+
+    def __init__(
+        self, name, call, *, allowed_seq_scans=None, max_cost=DEFAULT_MAX_COST
+    ):
+        self.name = name
+        self.call = call
+        self.allowed_seq_scans = set(allowed_seq_scans or [])
+        self.max_cost = max_cost
+
+
+# Queries which inherently aggregate or scan whole tables are allowed to do so,
+# until they are rewritten
+CASES = [
+    QueryCase("get_one", lambda s: query.get_one(Visitor, id=s["visitor_id"])),
+    QueryCase("get_many", lambda s: query.get_many(Visitor, limit=15)),
+    QueryCase(
+        "get_many_after_id",
+        lambda s: query.get_many(
+            StaffSubscriptionChat,
+            after_id=s["subscription_id"],
+            staff_id=s["staff_id"],
+            limit=15,
+        ),
+    ),
+    QueryCase(
+        "get_flagged_chats_of_online_visitors",
+        lambda s: query.get_flagged_chats_of_online_visitors(
+            Visitor, Chat, in_values=s["visitor_ids"]
+        ),
+    ),
+    QueryCase(
+        "get_messages",
+        lambda s: query.get_messages(ChatMessage, User, chat_id=s["chat_id"]),
+    ),
+    QueryCase(
+        "get_messages_before_id",
+        lambda s: query.get_messages(
+            ChatMessage, User, chat_id=s["chat_id"], before_id=s["message_id"]
+        ),
+    ),
+    QueryCase(
+        "high_ups_query",
+        lambda s: db.status(
+            high_ups.high_ups_query, {"agent_role_id": ROLES.inverse["agent"]}
+        ),
+    ),
+    QueryCase(
+        "get_bookmarked_visitors",
+        lambda s: query.get_bookmarked_visitors(
+            Visitor, BookmarkVisitor, s["staff_id"]
+        ),
+    ),
+    QueryCase(
+        "get_self_subscribed_visitors",
+        lambda s: query.get_self_subscribed_visitors(
+            Visitor, Chat, StaffSubscriptionChat, s["staff_id"]
+        ),
+    ),
+    QueryCase(
+        "get_self_subscribed_visitors_exclude_unhandled",
+        lambda s: query.get_self_subscribed_visitors(
+            Visitor, Chat, StaffSubscriptionChat, s["staff_id"], exclude_unhandled=True
+        ),
+    ),
+    QueryCase(
+        "get_one_latest",
+        lambda s: query.get_one_latest(
+            ChatMessage, chat_id=s["chat_id"], order_by="sequence_num"
+        ),
+    ),
+    QueryCase(
+        "get_many_with_count_and_group_by",
+        lambda s: query.get_many_with_count_and_group_by(
+            StaffSubscriptionChat,
+            columns=["visitor_id"],
+            in_column="visitor_id",
+            in_values=s["visitor_ids"],
+        ),
+    ),
+    QueryCase(
+        "get_subscribed_staffs_for_visitor",
+        lambda s: query.get_subscribed_staffs_for_visitor(s["visitor_id"]),
+    ),
+    QueryCase("get_handled_chats", lambda s: query.get_handled_chats(Visitor)),
+    QueryCase(
+        "get_staff_unhandled_visitors",
+        lambda s: query.get_staff_unhandled_visitors(ChatUnhandled, s["staff_id"]),
+    ),
+    QueryCase(
+        "get_staff_unhandled_visitors_all",
+        lambda s: query.get_staff_unhandled_visitors(ChatUnhandled),
+    ),
+    QueryCase(
+        "get_non_normal_visitors",
+        lambda s: query.get_non_normal_visitors(
+            ChatFlagged,
+            extra_fields=[
+                "chat_flagged.flag_message AS flag_message",
+                "chat_flagged.created_at AS flagged_timestamp",
+            ],
+        ),
+    ),
+    QueryCase(
+        "get_visitors_with_no_assigned_staffs",
+        lambda s: query.get_visitors_with_no_assigned_staffs(),
+        # Every visitor is checked for an assigned staff
+        allowed_seq_scans={"visitor", "staff_subscription_chat"},
+        max_cost=None,
+    ),
+    QueryCase(
+        "get_top_unread_visitors",
+        lambda s: query.get_top_unread_visitors(Visitor, Chat, s["staff_id"]),
+        # The most recent message of every chat is aggregated
+        allowed_seq_scans={"visitor", "chat", "chat_message", "chat_message_seen"},
+        max_cost=None,
+    ),
+    QueryCase(
+        "get_visitors_with_most_recent_chats",
+        lambda s: query.get_visitors_with_most_recent_chats(
+            ChatActivity, Visitor, s["supervisor"]
+        ),
+    ),
+    QueryCase(
+        "get_number_of_unread_notifications_for_staff",
+        lambda s: query.get_number_of_unread_notifications_for_staff(
+            s["staff_id"], NotificationStaffRead, NotificationStaff
+        ),
+    ),
+]
+
+
+class QueryRecorder:
+    """Record all the SQL statements (and their args) sent by Gino."""
+
+    def __init__(self):
+        self.queries = []
+        self._original = None
+
+    def __enter__(self):
+        recorder = self
+        original = self._original = DBAPICursor.async_execute
+
+        async def async_execute(cursor, sql, timeout, args, limit=0, many=False):
+            recorder.queries.append((sql, args))
+            return await original(cursor, sql, timeout, args, limit=limit, many=many)
+
+        DBAPICursor.async_execute = async_execute
+        return self
+
+    def __exit__(self, *exc_info):
+        DBAPICursor.async_execute = self._original
+
+    @property
+    def select_queries(self):
+        return [
+            (sql, args)
+            for sql, args in self.queries
+            if sql.lstrip().upper().startswith(("SELECT", "WITH"))
+        ]
+
+
+def walk_plan(plan: dict):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk_plan(child)
+
+
+def plan_shape(plan: dict):
+    """Return the node types and the used relations/indexes of a plan."""
+    shape = {"node": plan["Node Type"]}
+    for field in SHAPE_FIELDS:
+        if field in plan:
+            shape[field.lower().replace(" ", "_")] = plan[field]
+
+    children = [plan_shape(child) for child in plan.get("Plans", [])]
+    if children:
+        shape["plans"] = children
+    return shape
+
+
+# The monthly partitions of `chat_message` are checked as the table itself
+PARTITION_NAME_REGEX = re.compile(
+    r"^({}_y\d{{4}}m\d{{2}}|{})$".format(PARTITIONED_TABLE, DEFAULT_PARTITION)
+)
+
+
+def get_table_name(relation_name: str):
+    if PARTITION_NAME_REGEX.match(relation_name):
+        return PARTITIONED_TABLE
+    return relation_name
+
+
+def find_seq_scans(plan: dict):
+    return sorted(
+        {
+            get_table_name(node["Relation Name"])
+            for node in walk_plan(plan)
+            if node["Node Type"] == "Seq Scan" and node.get("Relation Name")
+        }
+    )
+
+
+async def explain(raw_conn, sql: str, args: list):
+    result = await raw_conn.fetchval("EXPLAIN (FORMAT JSON) " + sql, *args)
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]["Plan"]
+
+
+async def get_samples():
+    """Pick the rows used as the arguments of the query functions."""
+    subscription = await StaffSubscriptionChat.query.gino.first()
+    message = await ChatMessage.query.where(ChatMessage.sequence_num > 1).gino.first()
+    supervisors = await User.get(
+        many=True, limit=1, role_id=ROLES.inverse["supervisor"], disabled=False
+    )
+    if not subscription or not message or not supervisors:
+        raise SystemExit("The database is empty, please generate the dataset first.")
+
+    chat = await Chat.get(id=message.chat_id)
+    visitors = await Visitor.get(many=True, limit=15)
+    return {
+        "staff_id": subscription.staff_id,
+        "subscription_id": subscription.id,
+        "supervisor": supervisors[0],
+        "chat_id": chat["id"],
+        "message_id": message.id,
+        "visitor_id": chat["visitor_id"],
+        "visitor_ids": [visitor["id"] for visitor in visitors],
+    }
+
+
+async def check_case(case: QueryCase, samples: dict):
+    """Run the case in a rolled back transaction, and explain its queries."""
+    plans = []
+    async with db.transaction() as tx:
+        with QueryRecorder() as recorder:
+            await case.call(samples)
+
+        raw_conn = await tx.connection.get_raw_connection()
+        for sql, args in recorder.select_queries:
+            plans.append((sql, await explain(raw_conn, sql, args)))
+
+        # Some query functions create the missing rows
+        tx.raise_rollback()
+
+    violations = []
+    snapshots = []
+    for sql, plan in plans:
+        seq_scans = [
+            table
+            for table in find_seq_scans(plan)
+            if table in LARGE_TABLES and table not in case.allowed_seq_scans
+        ]
+        for table in seq_scans:
+            violations.append("sequential scan on table '{}'".format(table))
+
+        cost = plan["Total Cost"]
+        if case.max_cost is not None and cost > case.max_cost:
+            violations.append("total cost {} is above {}".format(cost, case.max_cost))
+
+        snapshots.append(
+            {
+                "sql": " ".join(sql.split()),
+                "total_cost": cost,
+                "plan": plan_shape(plan),
+            }
+        )
+
+    return violations, snapshots
+
+
+def compare_snapshots(snapshots: list, path: str):
+    """Return whether the plans' shapes are different from the stored snapshot."""
+    if not exists(path):
+        return None
+
+    with open(path) as file:
+        stored = json.load(file)
+    return [item["plan"] for item in stored] != [item["plan"] for item in snapshots]
+
+
+async def warn_if_not_seeded():
+    estimated_rows = await db.scalar(
+        db.text("SELECT reltuples FROM pg_class WHERE relname = 'chat_message';")
+    )
+    if (estimated_rows or 0) < MIN_SEEDED_MESSAGES:
+        print(
+            "WARNING: Table 'chat_message' has about {} rows, "
+            "the plans might not be the ones used in production.".format(
+                int(estimated_rows or 0)
+            )
+        )
+
+
+async def run_checks(args):
+    await db.set_bind(get_db_url())
+    await warn_if_not_seeded()
+    samples = await get_samples()
+
+    cases = [case for case in CASES if not args.cases or case.name in args.cases]
+    results = {}
+    for case in cases:
+        violations, snapshots = await check_case(case, samples)
+        path = join(args.snapshot_dir, "{}.json".format(case.name))
+        results[case.name] = {
+            "queries": len(snapshots),
+            "max_total_cost": max(
+                (item["total_cost"] for item in snapshots), default=None
+            ),
+            "violations": violations,
+            "plan_changed": compare_snapshots(snapshots, path),
+        }
+
+        if args.update_snapshots:
+            makedirs(args.snapshot_dir, exist_ok=True)
+            dump_report(snapshots, path)
+
+    await db.pop_bind().close()
+    return {"cases": results}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Check the query plans of the functions in utils/query.py."
+    )
+    parser.add_argument(
+        "--cases",
+        nargs="+",
+        choices=[case.name for case in CASES],
+        help="The cases to check (default: all)",
+    )
+    parser.add_argument(
+        "--snapshot-dir",
+        default=DEFAULT_SNAPSHOT_DIR,
+        help="The folder of the plan snapshots (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--update-snapshots",
+        action="store_true",
+        help="Store the current plans as the new snapshots",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(run_checks(args))
+    dump_report(report, args.output)
+
+    failed = False
+    for name, result in report["cases"].items():
+        for violation in result["violations"]:
+            print("VIOLATION: {}: {}".format(name, violation))
+            failed = True
+        if result["plan_changed"]:
+            print("CHANGED: {}: the plans differ from the snapshot".format(name))
+
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
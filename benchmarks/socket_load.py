@@ -0,0 +1,315 @@
+"""
+A load generator for the SocketIO server (app_socketio.py).
+
+It spins up N simulated visitors and M simulated staffs as python-socketio clients,
+replays a weighted mix of chat events against a running local stack,
+and reports the latency of the events' acknowledgements as JSON.
+
+Usage:
+    PYTHONPATH=. python -m benchmarks.socket_load --visitors 50 --staffs 10
+
+Refer to `python -m benchmarks.socket_load --help` for all the options.
+"""
+import argparse
+import asyncio
+from random import choice, choices, expovariate
+from time import perf_counter
+
+import socketio
+from socketio.exceptions import TimeoutError as AckTimeoutError
+
+from ora_backend import db
+from ora_backend.config.db import get_db_url
+from ora_backend.constants import ROLES
+from ora_backend.models import Organisation, User, Visitor, generate_uuid
+from benchmarks.auth import get_access_token
+from benchmarks.stats import (
+    compare_to_baseline,
+    dump_report,
+    load_report,
+    summarize,
+)
+
+# The events each type of clients is able to send
+VISITOR_EVENTS = {"visitor_msg", "typing"}
+STAFF_EVENTS = {"staff_msg", "typing", "staff_join", "take_over_chat"}
+
+DEFAULT_MIX = "visitor_msg=40,staff_msg=30,typing=20,staff_join=5,take_over_chat=5"
+
+
+def parse_mix(mix: str):
+    """Parse a mix like 'visitor_msg=40,typing=10' into {event: weight}."""
+    weights = {}
+    for item in mix.split(","):
+        event, _, weight = item.partition("=")
+        event = event.strip()
+        if event not in VISITOR_EVENTS | STAFF_EVENTS:
+            raise ValueError("Unknown event in mix: {}".format(event))
+        weights[event] = float(weight or 1)
+    return weights
+
+
+class Recorder:
+    """Collect the ack latencies and errors of every sent event."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.error_messages = {}
+
+    def record(self, event, latency, ok, error_message=None):
+        self.latencies.setdefault(event, []).append(latency)
+        self.errors.setdefault(event, 0)
+        if not ok:
+            self.errors[event] += 1
+            if error_message:
+                messages = self.error_messages.setdefault(event, {})
+                messages[error_message] = messages.get(error_message, 0) + 1
+
+    def report(self, duration):
+        events = {
+            event: summarize(latencies, self.errors[event], duration)
+            for event, latencies in self.latencies.items()
+        }
+        all_latencies = [
+            value for values in self.latencies.values() for value in values
+        ]
+        return {
+            "totals": summarize(all_latencies, sum(self.errors.values()), duration),
+            "events": events,
+            "error_messages": self.error_messages,
+        }
+
+
+def is_acknowledged(result):
+    """
+    Events return (result, error_message, ...) as their acknowledgement.
+    """
+    if isinstance(result, (list, tuple)):
+        if not result:
+            return False, None
+        error_message = result[1] if len(result) > 1 else None
+        return bool(result[0]), error_message
+    return bool(result), None
+
+
+async def prepare_users(number_of_visitors: int, number_of_staffs: int):
+    """
+    Create the anonymous visitors, and use the existing staffs in the DB.
+
+    If there are not enough staffs, create new agents for the benchmark.
+    """
+    visitors = [
+        await Visitor.add(name="Load Visitor {}".format(index), is_anonymous=True)
+        for index in range(number_of_visitors)
+    ]
+
+    staffs = await User.get(many=True, limit=number_of_staffs, disabled=False)
+    if len(staffs) < number_of_staffs:
+        org = (await Organisation.query.gino.all())[0]
+        for index in range(len(staffs), number_of_staffs):
+            staff = await User.add(
+                full_name="Load Agent {}".format(index),
+                email="load_agent_{}@example.com".format(generate_uuid()),
+                password="loadtest1234",
+                role_id=ROLES.inverse["agent"],
+                organisation_id=org.id,
+            )
+            staffs.append(staff)
+
+    return visitors, staffs
+
+
+class SimulatedClient:
+    def __init__(self, user, token, events, weights, visitor_ids, recorder, args):
+        self.user = user
+        self.token = token
+        self.events = events
+        self.weights = weights
+        self.visitor_ids = visitor_ids
+        self.recorder = recorder
+        self.args = args
+        self.sio = socketio.AsyncClient(reconnection=False)
+
+    @property
+    def is_staff(self):
+        return "role_id" in self.user
+
+    def build_payload(self, event):
+        if event == "visitor_msg":
+            return "visitor_msg", {
+                "content": "load test message",
+                "sent": perf_counter(),
+            }
+
+        if event == "typing":
+            visitor_id = (
+                self.user["id"] if not self.is_staff else choice(self.visitor_ids)
+            )
+            return "user_typing_send", {"visitor": visitor_id}
+
+        if event == "staff_msg":
+            return (
+                "staff_msg",
+                {
+                    "visitor": choice(self.visitor_ids),
+                    "content": {"content": "load test reply", "sent": perf_counter()},
+                },
+            )
+
+        # staff_join and take_over_chat
+        return event, {"visitor": choice(self.visitor_ids)}
+
+    async def connect(self):
+        await self.sio.connect(self.args.url, headers={"Authorization": self.token})
+
+    async def run(self, deadline):
+        loop = asyncio.get_event_loop()
+        while loop.time() < deadline:
+            event = choices(self.events, weights=self.weights)[0]
+            sio_event, payload = self.build_payload(event)
+
+            start = perf_counter()
+            try:
+                result = await self.sio.call(
+                    sio_event, payload, timeout=self.args.timeout
+                )
+                ok, error_message = is_acknowledged(result)
+            except AckTimeoutError:
+                ok, error_message = False, "timeout"
+            except Exception as exc:
+                ok, error_message = False, type(exc).__name__
+            self.recorder.record(event, perf_counter() - start, ok, error_message)
+
+            # Simulate a real user, who needs time to type
+            await asyncio.sleep(expovariate(1 / self.args.think_time))
+
+    async def disconnect(self):
+        try:
+            await self.sio.disconnect()
+        except Exception:
+            pass
+
+
+def create_clients(visitors, staffs, tokens, mix, recorder, args):
+    visitor_ids = [visitor["id"] for visitor in visitors]
+    clients = []
+    for user, token in zip(visitors + staffs, tokens):
+        allowed = STAFF_EVENTS if "role_id" in user else VISITOR_EVENTS
+        events = [event for event in mix if event in allowed]
+        if not events:
+            continue
+        weights = [mix[event] for event in events]
+        clients.append(
+            SimulatedClient(user, token, events, weights, visitor_ids, recorder, args)
+        )
+    return clients
+
+
+async def run_benchmark(args):
+    mix = parse_mix(args.mix)
+    await db.set_bind(get_db_url())
+
+    visitors, staffs = await prepare_users(args.visitors, args.staffs)
+    tokens = [await get_access_token(user) for user in visitors + staffs]
+
+    recorder = Recorder()
+    clients = create_clients(visitors, staffs, tokens, mix, recorder, args)
+
+    # Visitors connect first, so that their chat rooms exist for the staffs
+    # Spread the connections over the ramp-up period
+    connected = []
+    failed_connections = 0
+    delay = args.ramp_up / len(clients) if clients else 0
+    for client in clients:
+        try:
+            await client.connect()
+            connected.append(client)
+        except Exception:
+            failed_connections += 1
+        await asyncio.sleep(delay)
+
+    loop = asyncio.get_event_loop()
+    start = perf_counter()
+    deadline = loop.time() + args.duration
+    await asyncio.gather(*(client.run(deadline) for client in connected))
+    duration = perf_counter() - start
+
+    await asyncio.gather(*(client.disconnect() for client in connected))
+    await db.pop_bind().close()
+
+    report = recorder.report(duration)
+    report["config"] = {
+        "url": args.url,
+        "visitors": args.visitors,
+        "staffs": args.staffs,
+        "duration_s": args.duration,
+        "think_time_s": args.think_time,
+        "mix": mix,
+    }
+    report["connections"] = {
+        "connected": len(connected),
+        "failed": failed_connections,
+    }
+    report["duration_s"] = round(duration, 3)
+    return report
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Replay a mix of chat events against the SocketIO server."
+    )
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--visitors", type=int, default=20)
+    parser.add_argument("--staffs", type=int, default=5)
+    parser.add_argument(
+        "--duration", type=float, default=60, help="Seconds to replay the events"
+    )
+    parser.add_argument(
+        "--ramp-up", type=float, default=5, help="Seconds to connect all the clients"
+    )
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=1,
+        help="Mean seconds between 2 events of a client",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=10, help="Seconds to wait for an ack"
+    )
+    parser.add_argument(
+        "--mix",
+        default=DEFAULT_MIX,
+        help="Weights of the events, as comma-separated <event>=<weight>. "
+        "Events: {}".format(", ".join(sorted(VISITOR_EVENTS | STAFF_EVENTS))),
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--baseline", help="A previous JSON report to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative increase of latencies against the baseline",
+    )
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    loop = asyncio.get_event_loop()
+    report = loop.run_until_complete(run_benchmark(args))
+    dump_report(report, args.output)
+
+    if args.baseline:
+        baseline = load_report(args.baseline)
+        regressions = compare_to_baseline(
+            report["events"], baseline["events"], tolerance=args.tolerance
+        )
+        for regression in regressions:
+            print("REGRESSION:", regression)
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import json
+from math import ceil
+
+# The latency fields to compare against a baseline
+COMPARED_LATENCY_FIELDS = ("p50", "p95", "p99")
+
+
+def percentile(sorted_values: list, pct: float):
+    """
+    Return the `pct`-th percentile of an ascending list, using nearest-rank.
+
+    Return None if the list is empty.
+    """
+    if not sorted_values:
+        return None
+
+    rank = max(ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize_latencies(latencies: list):
+    """Summarize a list of latencies (in seconds) into miliseconds."""
+    values = sorted(latencies)
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+
+    to_ms = lambda value: round(value * 1000, 3)
+    return {
+        "p50": to_ms(percentile(values, 50)),
+        "p95": to_ms(percentile(values, 95)),
+        "p99": to_ms(percentile(values, 99)),
+        "mean": to_ms(sum(values) / len(values)),
+        "max": to_ms(values[-1]),
+    }
+
+
+def summarize(latencies: list, errors: int, duration: float):
+    """
+    Summarize the result of a single event/endpoint.
+
+    Args:
+        latencies (list):
+            The latencies (in seconds) of all the calls, including failed ones.
+
+        errors (int):
+            The number of failed calls.
+
+        duration (float):
+            The wall time (in seconds) of the whole run.
+    """
+    count = len(latencies)
+    return {
+        "count": count,
+        "errors": errors,
+        "error_rate": round(errors / count, 4) if count else 0,
+        "throughput_per_s": round(count / duration, 3) if duration else 0,
+        "latency_ms": summarize_latencies(latencies),
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance=0.1):
+    """
+    Compare the summarized results with a baseline of the same format.
+
+    Both `results` and `baseline` are dicts of {<name>: <summary>},
+    with <summary> returned by `summarize()`.
+
+    Return a list of human-readable regressions,
+    which is empty if no latency or error rate got worse than the `tolerance`.
+    """
+    regressions = []
+    for name, expected in baseline.items():
+        actual = results.get(name)
+        if not actual:
+            continue
+
+        for field in COMPARED_LATENCY_FIELDS:
+            expected_value = expected["latency_ms"].get(field)
+            actual_value = actual["latency_ms"].get(field)
+            if expected_value is None or actual_value is None:
+                continue
+
+            if actual_value > expected_value * (1 + tolerance):
+                regressions.append(
+                    "{}: {} went from {}ms to {}ms".format(
+                        name, field, expected_value, actual_value
+                    )
+                )
+
+        if actual["error_rate"] > expected["error_rate"] + tolerance / 10:
+            regressions.append(
+                "{}: error_rate went from {} to {}".format(
+                    name, expected["error_rate"], actual["error_rate"]
+                )
+            )
+
+    return regressions
+
+
+def load_report(path: str):
+    with open(path) as file:
+        return json.load(file)
+
+
+def dump_report(report: dict, path: str = None):
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if not path:
+        print(output)
+        return
+
+    with open(path, "w") as file:
+        file.write(output + "\n")
@@ -0,0 +1,136 @@
+"""
+A microbenchmark of the per-request validation in `ora_backend/utils/validation.py`.
+
+A request validated by `validate_request` has its body and args validated.
+For every case, it compares the cost of these 2 validations:
+- "new_validator": a new Cerberus validator per call, as before.
+- "cached_validator": the validator of the schema, built once.
+- "fast_validator": the plain Python checks of the simple schemas,
+  falling back to the cached validator.
+
+Usage:
+    PYTHONPATH=. python -m benchmarks.validation --repeat 10000
+
+Refer to `python -m benchmarks.validation --help` for all the options.
+"""
+import argparse
+from time import perf_counter
+
+from cerberus import Validator
+
+from ora_backend.schemas import schemas
+from ora_backend.utils.validators import get_fast_validator, get_validator
+from benchmarks.stats import dump_report, summarize
+
+# The (schema of the body, body, update, schema of the args, args) of the requests
+CASES = {
+    "create_user": (
+        "user_write",
+        {
+            "full_name": "Benchmark Agent",
+            "email": "Benchmark.Agent@example.com",
+            "password": "a-long-password",
+            "role_id": "3",
+        },
+        False,
+        "user_read",
+        {},
+    ),
+    "update_user": ("user_write", {"disabled": "true"}, True, "user_read", {}),
+    "get_visitors": (
+        "visitor_read",
+        {},
+        False,
+        "visitor_read",
+        {"after_id": "a4d1f0c2b3e54f6a8b7c9d0e1f2a3b4c", "limit": "15"},
+    ),
+    "create_chat": (
+        "chat_write",
+        {"visitor_id": "a4d1f0c2b3e54f6a8b7c9d0e1f2a3b4c", "tags": [{"name": "a"}]},
+        False,
+        "chat_read",
+        {},
+    ),
+}
+
+
+def validate_with_new_validator(document, schema_name, update=False):
+    validator = Validator()
+    assert validator.validate(document, schemas[schema_name], update=update)
+    return validator.document
+
+
+def validate_with_cached_validator(document, schema_name, update=False):
+    validator = get_validator(schema_name)
+    assert validator.validate(document, update=update)
+    return validator.document
+
+
+def validate_with_fast_validator(document, schema_name, update=False):
+    fast_validator = get_fast_validator(schema_name)
+    if fast_validator is not None:
+        validated_document = fast_validator(document, update=update)
+        if validated_document is not None:
+            return validated_document
+    return validate_with_cached_validator(document, schema_name, update=update)
+
+
+PATHS = {
+    "new_validator": validate_with_new_validator,
+    "cached_validator": validate_with_cached_validator,
+    "fast_validator": validate_with_fast_validator,
+}
+
+
+def measure(validate, case, repeat: int):
+    body_schema, body, update, args_schema, args = case
+    latencies = []
+    started_at = perf_counter()
+    for _ in range(repeat):
+        call_started_at = perf_counter()
+        validate(body, body_schema, update=update)
+        validate(args, args_schema)
+        latencies.append(perf_counter() - call_started_at)
+    return summarize(latencies, 0, perf_counter() - started_at)
+
+
+def run_benchmark(args):
+    results = {}
+    for name in args.cases:
+        case = CASES[name]
+        results[name] = {
+            path: measure(validate, case, args.repeat)
+            for path, validate in PATHS.items()
+        }
+        results[name]["fast_path"] = get_fast_validator(case[0]) is not None
+    return {"repeat": args.repeat, "cases": results}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Compare the cost of validating the body and args of a request."
+    )
+    parser.add_argument(
+        "--cases",
+        nargs="+",
+        choices=list(CASES),
+        default=list(CASES),
+        help="The requests to validate (default: all)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=10000,
+        help="The number of validated requests per path (default: %(default)s)",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    dump_report(run_benchmark(args), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,6 @@
 from datetime import timedelta
 import logging
 
-from aiocache import RedisCache
-from aiocache.serializers import JsonSerializer
 from asyncpg.exceptions import UniqueViolationError
 from gino.ext.sanic import Gino
 from sanic import Blueprint, Sanic
@@ -26,7 +24,8 @@ from ora_backend.config import (
     MODE,
     CELERY_BROKER_PASSWORD,
 )
-from ora_backend.constants import UNCLAIMED_CHATS_PREFIX
+from ora_backend.constants import CACHE_BINARY_NAMESPACES, UNCLAIMED_CHATS_PREFIX
+from ora_backend.utils.cache_serializers import NamespacedRedisCache
 
 # Init Sentry before app creation
 if SENTRY_DSN:
@@ -63,8 +62,8 @@ if MODE == "testing":
     redis_port = 63791
 elif MODE == "development":
     redis_port = 63790
-cache = RedisCache(
-    serializer=JsonSerializer(),
+cache = NamespacedRedisCache(
+    binary_namespaces=CACHE_BINARY_NAMESPACES,
     password=CELERY_BROKER_PASSWORD,
     pool_min_size=3,
     port=redis_port,
@@ -94,18 +93,54 @@ app.error_handler.add(SanicException, sanic_error_handler)
 app.error_handler.add(UniqueViolationError, unique_violation_error_handler)
 
 
+from ora_backend.config.db import DB_REPLICA_URL
+from ora_backend.utils.partitions import create_chat_message_partitions
+from ora_backend.utils.replica import replica
+from ora_backend.utils.statements import enable_compiled_cache
+
+
 async def init_plugins(app, loop):
     await db.gino.create_all()
+    await create_chat_message_partitions()
+    enable_compiled_cache(db.bind)
     # await cache.clear()
 
+    # Connect to the read replica, with the same settings as the primary
+    if DB_REPLICA_URL:
+        await replica.connect(
+            DB_REPLICA_URL,
+            min_size=app.config.get("DB_POOL_MIN_SIZE", 5),
+            max_size=app.config.get("DB_POOL_MAX_SIZE", 10),
+            ssl=app.config.get("DB_SSL"),
+            **app.config.get("DB_KWARGS", {}),
+        )
+        enable_compiled_cache(replica.engine)
+
+
+async def close_plugins(app, loop):
+    await replica.close()
+
 
 # Register the listeners
 app.register_listener(init_plugins, "after_server_start")
+app.register_listener(close_plugins, "before_server_stop")
 
 # Register background tasks
-from ora_backend.tasks.assign import check_for_reassign_chats_every_half_hour
+from ora_backend.tasks.archive import archive_old_chat_messages_every_day
+from ora_backend.tasks.assign import (
+    keep_volunteers_online_every_minute,
+    reassign_due_chats_every_minute,
+)
+from ora_backend.tasks.notifications import (
+    reconcile_unread_notification_counts_every_hour,
+)
+from ora_backend.tasks.partitions import create_chat_message_partitions_every_day
 
-app.add_task(check_for_reassign_chats_every_half_hour())
+app.add_task(reassign_due_chats_every_minute())
+app.add_task(keep_volunteers_online_every_minute())
+app.add_task(create_chat_message_partitions_every_day())
+app.add_task(archive_old_chat_messages_every_day())
+app.add_task(reconcile_unread_notification_counts_every_hour())
 
 
 # Register Prometheus
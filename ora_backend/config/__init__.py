@@ -3,7 +3,7 @@ import ssl
 
 from sanic.websocket import WebSocketProtocol
 
-from ora_backend.config.db import DB_CONFIG
+from ora_backend.config.db import DB_CONFIG, DB_STATEMENT_CACHE_KWARGS
 
 MODE = environ.get("MODE", "development").lower()
 
@@ -29,7 +29,11 @@ SENTRY_DSN = environ.get("SENTRY_DSN")
 
 DB_URL = environ.get("DB_URL")
 if DB_URL:
-    SANIC_CONFIG = {"DB_DSN": DB_URL, **SANIC_BASE_CONFIG}
+    SANIC_CONFIG = {
+        "DB_DSN": DB_URL,
+        "DB_KWARGS": DB_STATEMENT_CACHE_KWARGS,
+        **SANIC_BASE_CONFIG,
+    }
 else:
     SANIC_CONFIG = {**DB_CONFIG, **SANIC_BASE_CONFIG}
 
@@ -2,6 +2,40 @@ from os import environ
 
 mode = environ.get("MODE", "development").lower()
 
+# asyncpg prepares every statement, and caches the prepared statements
+# per connection (keyed by the SQL string), evicting the least recently used ones
+DB_STATEMENT_CACHE_KWARGS = {
+    "statement_cache_size": 200,
+    # Keep the statements until they are evicted
+    "max_cached_statement_lifetime": 0,
+}
+
+# The number of compiled SQLAlchemy statements cached by the engine
+COMPILED_CACHE_SIZE = 500
+
+# An optional read replica, for the heavy read-only queries
+DB_REPLICA_URL = environ.get("DB_REPLICA_URL")
+
+# Fall back to the primary if the replica lags behind more than this (in seconds)
+DB_REPLICA_MAX_LAG = float(environ.get("DB_REPLICA_MAX_LAG", 5))
+
+# The replica's lag is re-checked at most once per interval (in seconds)
+DB_REPLICA_LAG_CHECK_INTERVAL = 5
+
+# `chat_message` is partitioned by month,
+# with the partitions created this number of months in advance
+CHAT_MESSAGE_PARTITIONS_AHEAD = 3
+
+# The messages older than `CHAT_MESSAGE_ARCHIVE_AFTER_DAYS` days of the chats
+# without new messages for `CHAT_INACTIVE_DAYS` days are moved to `chat_message_archive`
+CHAT_MESSAGE_ARCHIVE_AFTER_DAYS = int(
+    environ.get("CHAT_MESSAGE_ARCHIVE_AFTER_DAYS", 180)
+)
+CHAT_INACTIVE_DAYS = int(environ.get("CHAT_INACTIVE_DAYS", 30))
+
+# The number of chats looked up per batch by the archival job
+CHAT_ARCHIVE_BATCH_SIZE = 500
+
 if mode == "production":
     DB_CONFIG = {
         "DB_HOST": environ.get("DB_HOSTNAME", "localhost"),
@@ -9,7 +43,7 @@ if mode == "production":
         "DB_USER": environ.get("DB_USERNAME", "postgres"),
         "DB_PASSWORD": environ.get("DB_PASSWORD"),
         "DB_DATABASE": environ.get("DB_NAME", "postgres"),
-        "DB_KWARGS": {"command_timeout": 60 * 2},
+        "DB_KWARGS": {"command_timeout": 60 * 2, **DB_STATEMENT_CACHE_KWARGS},
         "DB_POOL_MIN_SIZE": 5,
         "DB_POOL_MAX_SIZE": 10,
     }
@@ -19,7 +53,7 @@ elif mode == "development":
         "DB_PORT": "54320",
         "DB_USER": "postgres",
         "DB_DATABASE": "postgres",
-        "DB_KWARGS": {"command_timeout": 60 * 2},
+        "DB_KWARGS": {"command_timeout": 60 * 2, **DB_STATEMENT_CACHE_KWARGS},
         "DB_POOL_MIN_SIZE": 5,
         "DB_POOL_MAX_SIZE": 10,
     }
@@ -29,6 +63,7 @@ elif mode == "testing":
         "DB_PORT": "54321",
         "DB_USER": "postgres",
         "DB_DATABASE": "postgres",
+        "DB_KWARGS": DB_STATEMENT_CACHE_KWARGS,
         "DB_POOL_MIN_SIZE": 5,
         "DB_POOL_MAX_SIZE": 10,
     }
@@ -15,6 +15,16 @@ MONITOR_ROOM_PREFIX = "cache_monitor_room_"
 CACHE_SETTINGS = "cache_global_settings"
 CACHE_PERMISSIONS = "cache_permissions"
 CACHE_SEND_EMAIL_ON_VISITOR_NEW_MSG = "cache_send_email_on_visitor_new_msg"
+CACHE_UNREAD_NOTIFICATIONS = "cache_unread_notifications_"
+CACHE_HIGH_UPS = "cache_high_ups"
+CACHE_HIGH_UPS_NAMESPACE = "high_ups"
+CACHE_VERSIONS = "cache_versions"
+
+# The namespaces of the cache whose values are stored as msgpack,
+# i.e. the large dicts of the chats, settings and high ups, whose keys are strings.
+# The values changed by Lua scripts must stay in the other namespaces, stored as JSON,
+# as well as the values of the default namespace, whose keys may be integers.
+CACHE_BINARY_NAMESPACES = ("visitor_info", "settings", CACHE_HIGH_UPS_NAMESPACE)
 
 # Note: 0 is off
 DEFAULT_GLOBAL_SETTINGS = {
@@ -1,9 +1,10 @@
 """
 A collection of custom exceptions to return to client.
 """
-from sanic.response import json
 from sanic.exceptions import SanicException
 
+from ora_backend.utils.fast_json import json
+
 # from ora_backend.config import CORS_ORIGINS
 
 
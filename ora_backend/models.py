@@ -19,10 +19,25 @@ from ora_backend.utils.query import (
     execute,
     get_messages,
     get_one_oldest,
+    get_python_defaults,
+    insert_if_not_exists,
+    update_chat_activity,
+    upsert_one,
 )
+from ora_backend.utils.archive import get_archived_messages
 from ora_backend.utils.crypto import hash_password, validate_password_strength
 from ora_backend.utils.exceptions import raise_not_found_exception
-from ora_backend.utils.serialization import serialize_to_dict
+from ora_backend.utils.high_ups import invalidate_high_ups
+from ora_backend.utils.notification_counters import increment_unread_counts
+from ora_backend.utils.reassign_timers import start_reassign_timer, stop_reassign_timer
+from ora_backend.utils.serialization import (
+    get_projection,
+    serialize_records,
+    serialize_to_dict,
+)
+from ora_backend.utils.staff_loads import change_volunteer_loads
+from ora_backend.utils.transaction import after_commit
+from ora_backend.utils.versions import bump_table_version
 
 
 ROLES = set(_ROLES.values())
@@ -71,11 +86,19 @@ class BaseModel(db.Model):
                 with id == after_id (exclusive).
 
                 Ignored if many=False.
+
+            fields (Iterable[str]):
+                The fields to return, with the `id`. Only their columns are selected.
+                If empty, all the fields are returned.
         """
+        # Only select the columns of the requested fields
+        columns = get_projection(cls, fields, allow_readonly)
+
         # Using an param `many` to optimize Select queries for single row
         if many:
             data = await get_many(
                 cls,
+                columns=columns,
                 after_id=after_id,
                 limit=limit,
                 offset=offset,
@@ -84,14 +107,26 @@ class BaseModel(db.Model):
                 not_in_column=not_in_column,
                 not_in_values=not_in_values,
                 order_by=order_by,
+                return_model=False,
                 **kwargs,
             )
+            serialized_data = serialize_records(
+                cls, data, fields=columns, allow_readonly=allow_readonly
+            )
+        elif columns:
+            data = await get_one(cls, columns=columns, **kwargs)
+            serialized_data = (
+                serialize_records(
+                    cls, [data], fields=columns, allow_readonly=allow_readonly
+                )[0]
+                if data
+                else {}
+            )
         else:
             data = await get_one(cls, **kwargs)
-
-        serialized_data = serialize_to_dict(
-            data, fields=fields, allow_readonly=allow_readonly
-        )
+            serialized_data = serialize_to_dict(
+                data, fields=fields, allow_readonly=allow_readonly
+            )
 
         # Raise NotFound if no single resource is found
         # Ignore if many=True, as returning an empty List is expected
@@ -107,11 +142,8 @@ class BaseModel(db.Model):
 
     @classmethod
     async def add_if_not_exists(cls, **kwargs):
-        try:
-            data = await create_one(cls, **kwargs)
-        except (UniqueViolationError, DuplicatedError):
-            return None
-        return serialize_to_dict(data)
+        data = await insert_if_not_exists(cls, **kwargs)
+        return serialize_to_dict(data) if data else None
 
     @classmethod
     async def modify(cls, get_kwargs, update_kwargs):
@@ -310,6 +342,27 @@ class User(BaseUser):
     _idx_user_role_id = db.Index("idx_user_role_id", "role_id")
     _idx_user_organisation_id = db.Index("_idx_user_organisation_id", "organisation_id")
 
+    # The directory of the high-ups is cached, and the staffs are versioned
+    @classmethod
+    async def add(cls, **kwargs):
+        user = await super(User, cls).add(**kwargs)
+        await after_commit(invalidate_high_ups)
+        await after_commit(bump_table_version, cls.__tablename__)
+        return user
+
+    @classmethod
+    async def modify(cls, get_kwargs, update_kwargs):
+        user = await super(User, cls).modify(get_kwargs, update_kwargs)
+        await after_commit(invalidate_high_ups)
+        await after_commit(bump_table_version, cls.__tablename__)
+        return user
+
+    @classmethod
+    async def remove(cls, **kwargs):
+        await super(User, cls).remove(**kwargs)
+        await after_commit(invalidate_high_ups)
+        await after_commit(bump_table_version, cls.__tablename__)
+
 
 class BookmarkVisitor(BaseModel):
     __tablename__ = "bookmark_visitor"
@@ -328,35 +381,30 @@ class BookmarkVisitor(BaseModel):
         "idx_bookmark_visitor_staff_id", "staff_id"
     )
     _idx_bookmark_visitor_staff_visitor = db.Index(
-        "idx_bookmark_visitor_staff_visitor", "staff_id", "visitor_id"
+        "idx_bookmark_visitor_staff_visitor", "staff_id", "visitor_id", unique=True
     )
 
     @classmethod
     async def get_or_create(cls, **kwargs):
-        payload = await get_one(cls, **kwargs)
-        if payload:
-            return serialize_to_dict(payload)
-
-        # Create
-        data = await create_one(
-            cls, staff_id=kwargs["staff_id"], visitor_id=kwargs["visitor_id"]
+        data = await upsert_one(
+            cls,
+            ["staff_id", "visitor_id"],
+            {"staff_id": kwargs["staff_id"], "visitor_id": kwargs["visitor_id"]},
         )
         return serialize_to_dict(data)
 
     @classmethod
     async def update_or_create(cls, get_kwargs, update_kwargs):
-        payload = await get_one(cls, **get_kwargs)
-
-        if not payload:
-            data = await create_one(
-                cls,
+        data = await upsert_one(
+            cls,
+            ["staff_id", "visitor_id"],
+            {
                 **update_kwargs,
-                staff_id=get_kwargs["staff_id"],
-                visitor_id=get_kwargs["visitor_id"],
-            )
-            return serialize_to_dict(data)
-        # Update the existing one
-        data = await update_one(payload, **update_kwargs)
+                "staff_id": get_kwargs["staff_id"],
+                "visitor_id": get_kwargs["visitor_id"],
+            },
+            update_kwargs,
+        )
         return serialize_to_dict(data)
 
 
@@ -382,32 +430,103 @@ class StaffSubscriptionChat(BaseModel):
         unique=True,
     )
 
+    # Count the chats subscribed by each volunteer, to assign chats to the least loaded
+    # The subscriptions are versioned
     @classmethod
-    async def get_or_create(cls, **kwargs):
-        payload = await get_one(cls, **kwargs)
-        if payload:
-            return serialize_to_dict(payload)
+    async def add(cls, **kwargs):
+        subscription = await super(StaffSubscriptionChat, cls).add(**kwargs)
+        await after_commit(change_volunteer_loads, [subscription["staff_id"]], 1)
+        await after_commit(bump_table_version, cls.__tablename__)
+        return subscription
+
+    @classmethod
+    async def add_if_not_exists(cls, **kwargs):
+        subscription = await super(StaffSubscriptionChat, cls).add_if_not_exists(
+            **kwargs
+        )
+        if subscription:
+            await after_commit(change_volunteer_loads, [subscription["staff_id"]], 1)
+            await after_commit(bump_table_version, cls.__tablename__)
+        return subscription
 
-        # Create
-        data = await create_one(
-            cls, staff_id=kwargs["staff_id"], chat_id=kwargs["chat_id"]
+    @classmethod
+    async def remove_if_exists(cls, **kwargs):
+        subscription = await super(StaffSubscriptionChat, cls).remove_if_exists(
+            **kwargs
+        )
+        if subscription:
+            await after_commit(change_volunteer_loads, [subscription["staff_id"]], -1)
+            await after_commit(bump_table_version, cls.__tablename__)
+        return subscription
+
+    @classmethod
+    async def add_many_to_visitor(cls, visitor_id, staff_ids):
+        """Subscribe the staffs to the visitor's chat, and return the new staff ids."""
+        if not staff_ids:
+            return []
+        inserted = await (
+            insert(cls.__table__)
+            .values(
+                [
+                    {
+                        **get_python_defaults(cls),
+                        "staff_id": staff_id,
+                        "visitor_id": visitor_id,
+                    }
+                    for staff_id in staff_ids
+                ]
+            )
+            .on_conflict_do_nothing()
+            .returning(cls.staff_id)
+            .gino.all()
+        )
+        staff_ids = [staff_id for (staff_id,) in inserted]
+        await after_commit(change_volunteer_loads, staff_ids, 1)
+        if staff_ids:
+            await after_commit(bump_table_version, cls.__tablename__)
+        return staff_ids
+
+    @classmethod
+    async def remove_many_from_visitor(cls, visitor_id, staff_ids):
+        """Unsubscribe the staffs from the visitor's chat, and return the removed ids."""
+        if not staff_ids:
+            return []
+        removed = await (
+            cls.delete.where(
+                (cls.visitor_id == visitor_id) & cls.staff_id.in_(staff_ids)
+            )
+            .returning(cls.staff_id)
+            .gino.all()
         )
+        staff_ids = [staff_id for (staff_id,) in removed]
+        await after_commit(change_volunteer_loads, staff_ids, -1)
+        if staff_ids:
+            await after_commit(bump_table_version, cls.__tablename__)
+        return staff_ids
+
+    @classmethod
+    async def get_or_create(cls, **kwargs):
+        data = await upsert_one(
+            cls,
+            ["staff_id", "visitor_id"],
+            {"staff_id": kwargs["staff_id"], "visitor_id": kwargs["visitor_id"]},
+        )
+        await after_commit(bump_table_version, cls.__tablename__)
         return serialize_to_dict(data)
 
     @classmethod
     async def update_or_create(cls, get_kwargs, update_kwargs):
-        payload = await get_one(cls, **get_kwargs)
-
-        if not payload:
-            data = await create_one(
-                cls,
+        data = await upsert_one(
+            cls,
+            ["staff_id", "visitor_id"],
+            {
                 **update_kwargs,
-                staff_id=get_kwargs["staff_id"],
-                chat_id=get_kwargs["chat_id"],
-            )
-            return serialize_to_dict(data)
-        # Update the existing one
-        data = await update_one(payload, **update_kwargs)
+                "staff_id": get_kwargs["staff_id"],
+                "visitor_id": get_kwargs["visitor_id"],
+            },
+            update_kwargs,
+        )
+        await after_commit(bump_table_version, cls.__tablename__)
         return serialize_to_dict(data)
 
 
@@ -420,24 +539,146 @@ class ChatMessage(BaseModel):
     type_id = db.Column(db.SmallInteger, nullable=False, default=1)
     sender = db.Column(db.String(length=32), nullable=True)
     content = db.Column(JSON(), nullable=False, server_default="{}")
-    created_at = db.Column(db.BigInteger, nullable=False, default=unix_time)
+    # Part of the primary key, as the table is partitioned by month on it
+    # (Refer to ora_backend/utils/partitions.py)
+    created_at = db.Column(
+        db.BigInteger, primary_key=True, nullable=False, default=unix_time
+    )
     updated_at = db.Column(db.BigInteger, onupdate=unix_time)
 
+    __table_args__ = {"postgresql_partition_by": "RANGE (created_at)"}
+
     # Index
     _idx_chat_msg_id = db.Index("idx_chat_msg_id", "id")
     _idx_chat_msg_chat_id = db.Index("idx_chat_msg_chat_id", "chat_id")
     _idx_chat_msg_sender = db.Index("idx_chat_msg_sender", "sender")
 
+    @classmethod
+    async def add(cls, **kwargs):
+        message = await super(ChatMessage, cls).add(**kwargs)
+
+        # Only the staffs' messages have a sender
+        if message["sender"]:
+            await update_chat_activity(
+                message["chat_id"], message["sender"], message["created_at"]
+            )
+        return message
+
     @classmethod
     async def get(cls, *, chat_id, **kwargs):
-        messages = await get_messages(cls, User, chat_id=chat_id, **kwargs)
+        messages = await get_messages(
+            cls, User, chat_id=chat_id, archive_model=ChatMessageArchive, **kwargs
+        )
         return messages
 
     @classmethod
     async def get_first_message_of_chat(cls, chat_id, **kwargs):
         data = await get_one_oldest(cls, chat_id=chat_id, order_by="sequence_num")
+
+        # The older messages of a chat could have been archived
+        first_archived = await ChatMessageArchive.get_first_sequence_num(chat_id)
+        if first_archived is not None and (
+            not data or first_archived < data.sequence_num
+        ):
+            archived_messages = await get_archived_messages(
+                ChatMessageArchive,
+                chat_id,
+                limit=1,
+                after=first_archived,
+                inclusive=True,
+            )
+            if archived_messages:
+                # Serialize it as the live messages
+                data = cls(**archived_messages[0])
+
         return serialize_to_dict(data)
 
+    @classmethod
+    async def get_latest_sequence_num(cls, chat_id):
+        latest_message = await get_one_latest(
+            cls, chat_id=chat_id, order_by="sequence_num"
+        )
+        if latest_message:
+            return latest_message.sequence_num
+
+        # All the messages of the chat could have been archived
+        return await ChatMessageArchive.get_last_sequence_num(chat_id) or 0
+
+
+class ChatMessageArchive(BaseModel):
+    """
+    The old messages of the inactive chats, moved out of `chat_message`
+    (Refer to ora_backend/utils/archive.py).
+
+    Each row is a segment of consecutive messages of a chat,
+    stored as a zlib-compressed JSON list.
+    """
+
+    __tablename__ = "chat_message_archive"
+
+    id = db.Column(db.String(length=32), primary_key=True, default=generate_uuid)
+    chat_id = db.Column(db.String(length=32), nullable=False)
+    first_sequence_num = db.Column(db.BigInteger, nullable=False)
+    last_sequence_num = db.Column(db.BigInteger, nullable=False)
+    first_created_at = db.Column(db.BigInteger, nullable=False)
+    last_created_at = db.Column(db.BigInteger, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    messages = db.Column(db.LargeBinary, nullable=False)
+    # The ids of the messages, to find the segment of a message without decompressing
+    message_ids = db.Column(
+        ARRAY(db.String(length=32)), nullable=False, server_default="{}"
+    )
+    created_at = db.Column(db.BigInteger, nullable=False, default=unix_time)
+
+    # Index
+    _idx_chat_msg_archive_chat_sequence_num = db.Index(
+        "idx_chat_msg_archive_chat_sequence_num", "chat_id", "first_sequence_num"
+    )
+    _idx_chat_msg_archive_message_ids = db.Index(
+        "idx_chat_msg_archive_message_ids", "message_ids", postgresql_using="gin"
+    )
+
+    @classmethod
+    async def get_first_sequence_num(cls, chat_id):
+        return await (
+            db.select([db.func.min(cls.first_sequence_num)])
+            .where(cls.chat_id == chat_id)
+            .gino.scalar()
+        )
+
+    @classmethod
+    async def get_last_sequence_num(cls, chat_id):
+        return await (
+            db.select([db.func.max(cls.last_sequence_num)])
+            .where(cls.chat_id == chat_id)
+            .gino.scalar()
+        )
+
+
+class ChatActivity(BaseModel):
+    """
+    The time of the last message of an organisation's staffs to each visitor,
+    to list the visitors with the most recent chats.
+    """
+
+    __tablename__ = "chat_activity"
+
+    internal_id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    organisation_id = db.Column(db.String(length=32), nullable=False)
+    visitor_id = db.Column(db.String(length=32), nullable=False)
+    last_staff_msg_at = db.Column(db.BigInteger, nullable=False)
+
+    # Index
+    _idx_chat_activity_org_visitor = db.Index(
+        "idx_chat_activity_org_visitor", "organisation_id", "visitor_id", unique=True
+    )
+    _idx_chat_activity_org_last_staff_msg = db.Index(
+        "idx_chat_activity_org_last_staff_msg",
+        "organisation_id",
+        "last_staff_msg_at",
+        "visitor_id",
+    )
+
 
 class Chat(BaseModel):
     __tablename__ = "chat"
@@ -461,14 +702,8 @@ class Chat(BaseModel):
 
     @classmethod
     async def get_or_create(cls, **kwargs):
-        created_attempt = await get_one(cls, **kwargs)
-
-        # Update the number of attempts in Quiz, if no previous attempts of the user are found
-        if not created_attempt:
-            data = await create_one(cls, **kwargs)
-            return serialize_to_dict(data)
-
-        return serialize_to_dict(created_attempt)
+        data = await upsert_one(cls, ["visitor_id"], kwargs)
+        return serialize_to_dict(data)
 
 
 class ChatUnhandled(BaseModel):
@@ -487,6 +722,34 @@ class ChatUnhandled(BaseModel):
     _idx_chat_unhandled_vistor_id = db.Index(
         "idx_chat_unhandled_vistor_id", "visitor_id"
     )
+    _idx_chat_unhandled_created_at = db.Index(
+        "idx_chat_unhandled_created_at", "created_at"
+    )
+
+    # A chat is reassigned once it has been unhandled for too long
+    @classmethod
+    async def add(cls, **kwargs):
+        payload = await super(ChatUnhandled, cls).add(**kwargs)
+        await after_commit(
+            start_reassign_timer, payload["visitor_id"], payload["created_at"]
+        )
+        return payload
+
+    @classmethod
+    async def add_if_not_exists(cls, **kwargs):
+        payload = await super(ChatUnhandled, cls).add_if_not_exists(**kwargs)
+        if payload:
+            await after_commit(
+                start_reassign_timer, payload["visitor_id"], payload["created_at"]
+            )
+        return payload
+
+    @classmethod
+    async def remove_if_exists(cls, **kwargs):
+        payload = await super(ChatUnhandled, cls).remove_if_exists(**kwargs)
+        if payload:
+            await after_commit(stop_reassign_timer, payload["visitor_id"])
+        return payload
 
 
 class ChatFlagged(BaseModel):
@@ -538,35 +801,30 @@ class ChatMessageSeen(BaseModel):
     # Index
     _idx_chat_msg_seen_id = db.Index("idx_chat_msg_seen_id", "id")
     _idx_chat_msg_seen_staff_chat = db.Index(
-        "idx_chat_msg_seen_staff_chat", "staff_id", "chat_id"
+        "idx_chat_msg_seen_staff_chat", "staff_id", "chat_id", unique=True
     )
 
     @classmethod
     async def get_or_create(cls, **kwargs):
-        payload = await get_one(cls, **kwargs)
-        if payload:
-            return serialize_to_dict(payload)
-
-        # Create
-        data = await create_one(
-            cls, staff_id=kwargs["staff_id"], chat_id=kwargs["chat_id"]
+        data = await upsert_one(
+            cls,
+            ["staff_id", "chat_id"],
+            {"staff_id": kwargs["staff_id"], "chat_id": kwargs["chat_id"]},
         )
         return serialize_to_dict(data)
 
     @classmethod
     async def update_or_create(cls, get_kwargs, update_kwargs):
-        payload = await get_one(cls, **get_kwargs)
-
-        if not payload:
-            data = await create_one(
-                cls,
+        data = await upsert_one(
+            cls,
+            ["staff_id", "chat_id"],
+            {
                 **update_kwargs,
-                staff_id=get_kwargs["staff_id"],
-                chat_id=get_kwargs["chat_id"],
-            )
-            return serialize_to_dict(data)
-        # Update the existing one
-        data = await update_one(payload, **update_kwargs)
+                "staff_id": get_kwargs["staff_id"],
+                "chat_id": get_kwargs["chat_id"],
+            },
+            update_kwargs,
+        )
         return serialize_to_dict(data)
 
 
@@ -586,6 +844,7 @@ class Setting(BaseModel):
     _idx_settings_id = db.Index("idx_settings_id", "id")
     _idx_settings_key = db.Index("idx_settings_key", "key")
 
+    # The settings are versioned
     @classmethod
     async def modify_if_exists(cls, get_kwargs, update_kwargs):
         payload = await get_one(cls, **get_kwargs)
@@ -593,6 +852,7 @@ class Setting(BaseModel):
             return None
 
         data = await update_one(payload, **update_kwargs)
+        await after_commit(bump_table_version, cls.__tablename__)
         return serialize_to_dict(data)
 
 
@@ -642,26 +902,17 @@ class NotificationStaffRead(BaseModel):
 
     @classmethod
     async def get_or_create(cls, serialized=True, **kwargs):
-        payload = await get_one(cls, **kwargs)
-        if payload:
-            return serialize_to_dict(payload) if serialized else payload
-
-        # Create
-        data = await create_one(cls, staff_id=kwargs["staff_id"])
+        data = await upsert_one(cls, ["staff_id"], {"staff_id": kwargs["staff_id"]})
         return serialize_to_dict(data) if serialized else data
 
     @classmethod
     async def update_or_create(cls, get_kwargs, update_kwargs):
-        payload = await get_one(cls, **get_kwargs)
-
-        if not payload:
-            data = await create_one(
-                cls, **update_kwargs, staff_id=get_kwargs["staff_id"]
-            )
-            return serialize_to_dict(data)
-
-        # Update the existing one
-        data = await update_one(payload, **update_kwargs)
+        data = await upsert_one(
+            cls,
+            ["staff_id"],
+            {**update_kwargs, "staff_id": get_kwargs["staff_id"]},
+            update_kwargs,
+        )
         return serialize_to_dict(data)
 
 
@@ -681,11 +932,30 @@ class NotificationStaff(BaseModel):
         "idx_notification_staff_staff_id", "staff_id"
     )
 
+    @classmethod
+    async def add(cls, **kwargs):
+        notification = await super(NotificationStaff, cls).add(**kwargs)
+        await after_commit(increment_unread_counts, [notification["staff_id"]])
+        return notification
+
     @classmethod
     async def bulk_upsert(cls, notifications):
-        await insert(cls.__table__).values(
-            notifications
-        ).on_conflict_do_nothing().gino.scalar()
+        """Insert the notifications, and return the inserted ones."""
+        if not notifications:
+            return []
+        inserted = await (
+            insert(cls.__table__)
+            .values(notifications)
+            .on_conflict_do_nothing()
+            .returning(*cls.__table__.columns)
+            .gino.load(cls)
+            .all()
+        )
+        await after_commit(
+            increment_unread_counts,
+            [notification.staff_id for notification in inserted],
+        )
+        return serialize_to_dict(inserted)
 
 
 class StaffNotificationSetting(BaseModel):
@@ -705,3 +975,23 @@ class StaffNotificationSetting(BaseModel):
     _idx_staff_notification_setting_staff_id = db.Index(
         "idx_staff_notification_setting_staff_id", "staff_id"
     )
+
+    # The directory of the high-ups is cached, with whether they receive emails
+    @classmethod
+    async def add(cls, **kwargs):
+        setting = await super(StaffNotificationSetting, cls).add(**kwargs)
+        await after_commit(invalidate_high_ups)
+        return setting
+
+    @classmethod
+    async def modify(cls, get_kwargs, update_kwargs):
+        setting = await super(StaffNotificationSetting, cls).modify(
+            get_kwargs, update_kwargs
+        )
+        await after_commit(invalidate_high_ups)
+        return setting
+
+    @classmethod
+    async def remove(cls, **kwargs):
+        await super(StaffNotificationSetting, cls).remove(**kwargs)
+        await after_commit(invalidate_high_ups)
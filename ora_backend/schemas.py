@@ -213,6 +213,7 @@ GLOBAL_READ_SCHEMA = {"internal_id": is_integer}
 GLOBAL_WRITE_SCHEMA = {"internal_id": {"readonly": True}}
 QUERY_PARAM_READ_SCHEMA = {"after_id": is_string, "limit": is_unsigned_integer_with_max}
 QUERY_PARAM_GET_VISITORS = {
+    "after_id": is_string,
     "page": is_unsigned_integer_with_max,
     "limit": is_unsigned_integer_with_max,
 }
@@ -0,0 +1,43 @@
+import asyncio
+
+from sanic.log import logger
+
+from ora_backend.config.db import (
+    CHAT_ARCHIVE_BATCH_SIZE,
+    CHAT_INACTIVE_DAYS,
+    CHAT_MESSAGE_ARCHIVE_AFTER_DAYS,
+)
+from ora_backend.models import ChatMessage, ChatMessageArchive, unix_time
+from ora_backend.utils.archive import archive_chat_messages
+from ora_backend.utils.lease import LeaseLock
+
+ARCHIVE_INTERVAL = 60 * 60 * 24  # Seconds
+
+# 1 day, in miliseconds
+DAY = 24 * 60 * 60 * 1000
+
+# Every worker runs the task, but only the holder of the lease archives the messages
+archive_lock = LeaseLock("archive_chat_messages", lease=ARCHIVE_INTERVAL * 1.5)
+
+
+async def archive_old_chat_messages_every_day():
+    try:
+        while True:
+            await asyncio.sleep(ARCHIVE_INTERVAL)
+            try:
+                async with archive_lock.hold() as is_holder:
+                    if not is_holder:
+                        continue
+
+                    now = unix_time()
+                    await archive_chat_messages(
+                        ChatMessage,
+                        ChatMessageArchive,
+                        archive_before=now - CHAT_MESSAGE_ARCHIVE_AFTER_DAYS * DAY,
+                        inactive_since=now - CHAT_INACTIVE_DAYS * DAY,
+                        batch_size=CHAT_ARCHIVE_BATCH_SIZE,
+                    )
+            except Exception:
+                logger.exception("Failed to archive the old chat messages")
+    finally:
+        await archive_lock.release()
@@ -1,24 +1,126 @@
 import asyncio
+from time import perf_counter
 
-from ora_backend import cache
-from ora_backend.constants import CACHE_SETTINGS
-from ora_backend.models import Setting
-from ora_backend.utils.assign import auto_reassign_staff_to_chat
-from ora_backend.utils.query import get_unhandled_visitors_with_no_replies
-from ora_backend.utils.settings import get_latest_settings
+from sanic.log import logger
 
+from ora_backend import db
+from ora_backend.models import ChatUnhandled, unix_time
+from ora_backend.utils.assign import auto_reassign_staffs_to_chats
+from ora_backend.utils.lease import LeaseLock
+from ora_backend.utils.query import get_unhandled_cutoff
+from ora_backend.utils.reassign_timers import (
+    pop_due_reassign_timers,
+    start_reassign_timers,
+)
+from ora_backend.utils.settings import get_settings_from_cache
+from ora_backend.utils.staff_loads import keep_volunteers_online, reset_volunteer_loads
 
-async def check_for_reassign_chats_every_half_hour():
+REASSIGN_INTERVAL = 60  # Seconds
+
+# Every worker keeps its online volunteers online at that interval
+HEARTBEAT_INTERVAL = 60  # Seconds
+
+# The number of chats reassigned per transaction
+REASSIGN_BATCH_SIZE = 200
+
+# Every worker runs the task, but only the holder of the lease reassigns the chats.
+# The holder renews it on every run, and another worker takes over once it expires
+reassign_lock = LeaseLock("reassign_chats", lease=REASSIGN_INTERVAL * 1.5)
+
+
+async def start_missing_reassign_timers():
+    """Start the timers of the unhandled chats, which were not started before."""
+    rows = await db.select(
+        [ChatUnhandled.visitor_id, ChatUnhandled.created_at]
+    ).gino.all()
+    await start_reassign_timers(
+        {visitor_id: created_at for visitor_id, created_at in rows}, only_new=True
+    )
+
+
+async def reassign_due_chats():
+    """Return the number of reassigned chats."""
+    settings = await get_settings_from_cache()
+    if not settings.get("auto_reassign", 1):
+        return 0
+
+    now = unix_time()
+    cutoff = get_unhandled_cutoff(settings.get("hours_to_auto_reassign", 24), now)
+
+    count = 0
     while True:
-        await asyncio.sleep(60 * 30)  # Seconds
-        settings = await get_latest_settings()
-        if not settings.get("auto_reassign", 1):
-            continue
-
-        max_waiting_hours = settings.get("hours_to_auto_reassign", 24)
-        long_waited_visitors = await get_unhandled_visitors_with_no_replies(
-            max_waiting_hours
+        due_visitor_ids = await pop_due_reassign_timers(cutoff, REASSIGN_BATCH_SIZE)
+        if not due_visitor_ids:
+            return count
+
+        # Skip the chats handled in the meantime
+        rows = (
+            await db.select([ChatUnhandled.visitor_id])
+            .where(ChatUnhandled.visitor_id.in_(due_visitor_ids))
+            .gino.all()
         )
+        visitor_ids = [visitor_id for (visitor_id,) in rows]
 
-        for visitor in long_waited_visitors:
-            await auto_reassign_staff_to_chat(visitor["id"])
+        # The chats which are not reassigned are due again on the next run,
+        # so that the chats still unhandled are never skipped
+        try:
+            new_staffs = await auto_reassign_staffs_to_chats(visitor_ids)
+        except Exception:
+            await start_reassign_timers(
+                {visitor_id: cutoff + 1 for visitor_id in visitor_ids}
+            )
+            raise
+        count += len(new_staffs)
+
+        # Reassign them again if the new staffs don't reply in time either
+        await start_reassign_timers(
+            {
+                visitor_id: now if visitor_id in new_staffs else cutoff + 1
+                for visitor_id in visitor_ids
+            }
+        )
+
+        if len(due_visitor_ids) < REASSIGN_BATCH_SIZE:
+            return count
+
+
+async def reassign_due_chats_every_minute():
+    is_leader = False
+    try:
+        while True:
+            await asyncio.sleep(REASSIGN_INTERVAL)
+            try:
+                async with reassign_lock.hold() as is_holder:
+                    was_leader, is_leader = is_leader, is_holder
+                    if not is_leader:
+                        continue
+
+                    # Start the timers missing from the cache,
+                    # e.g. after it was flushed, and correct the loads of the volunteers
+                    if not was_leader:
+                        await start_missing_reassign_timers()
+                        await reset_volunteer_loads()
+
+                    started_at = perf_counter()
+                    count = await reassign_due_chats()
+                    if count:
+                        logger.info(
+                            "Reassigned %d chats in %.3f seconds",
+                            count,
+                            perf_counter() - started_at,
+                        )
+            except Exception:
+                # The lease is released, for another worker to take over
+                is_leader = False
+                logger.exception("Failed to reassign the chats")
+    finally:
+        await reassign_lock.release()
+
+
+async def keep_volunteers_online_every_minute():
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        try:
+            await keep_volunteers_online()
+        except Exception:
+            logger.exception("Failed to keep the online volunteers online")
@@ -0,0 +1,21 @@
+import asyncio
+
+from ora_backend.utils.lease import LeaseLock
+from ora_backend.utils.notification_counters import reconcile_unread_counts
+
+RECONCILE_INTERVAL = 60 * 60  # Seconds
+
+# Every worker runs the task, but only the holder of the lease reconciles the counts
+reconcile_lock = LeaseLock(
+    "reconcile_unread_notification_counts", lease=RECONCILE_INTERVAL * 1.5
+)
+
+
+async def reconcile_unread_notification_counts_every_hour():
+    try:
+        while True:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            if await reconcile_lock.acquire():
+                await reconcile_unread_counts()
+    finally:
+        await reconcile_lock.release()
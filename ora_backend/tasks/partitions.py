@@ -0,0 +1,27 @@
+import asyncio
+
+from sanic.log import logger
+
+from ora_backend.utils.lease import LeaseLock
+from ora_backend.utils.partitions import create_chat_message_partitions
+
+PARTITIONS_INTERVAL = 60 * 60 * 24  # Seconds
+
+# Every worker runs the task, but only the holder of the lease creates the partitions
+partitions_lock = LeaseLock(
+    "create_chat_message_partitions", lease=PARTITIONS_INTERVAL * 1.5
+)
+
+
+async def create_chat_message_partitions_every_day():
+    try:
+        while True:
+            await asyncio.sleep(PARTITIONS_INTERVAL)
+            try:
+                async with partitions_lock.hold() as is_holder:
+                    if is_holder:
+                        await create_chat_message_partitions()
+            except Exception:
+                logger.exception("Failed to create the partitions of chat_message")
+    finally:
+        await partitions_lock.release()
@@ -231,4 +231,21 @@ def create_async_client(sio):
         # assert room is closed
         # assert room is deleted from cache
 
+    @sio.event
+    async def notification_new(data: dict):
+        """
+        For the staff to receive a new notification, instead of polling for it.
+
+        Args:
+            data (dict):
+                {
+                    "notification": notification,   # A NotificationStaff
+                    "num_of_unread": num_of_unread  # The staff's unread notifications
+                }
+        """
+        if data["num_of_unread"] < 1:
+            excs = await cache.get("exceptions", [])
+            excs.append({"event": "notification_new", "condition": "num_of_unread < 1"})
+            await cache.set("exceptions", excs)
+
     return sio
@@ -7,7 +7,8 @@ import uvloop
 import socketio
 from sanic.websocket import WebSocketProtocol
 
-from ora_backend import app as _app, db
+from ora_backend import app as _app, cache, db
+from ora_backend.constants import CACHE_UNREAD_NOTIFICATIONS
 from ora_backend.views.chat_socketio import app as _app_socketio
 from ora_backend.tests.setup_dev_db import setup_db
 from ora_backend.tests import get_access_token_for_user, get_refresh_token_for_user
@@ -19,6 +20,8 @@ from ora_backend.tests.fixtures import (
 )
 from ora_backend.config.db import get_db_url
 from ora_backend.utils.crypto import sign_str
+from ora_backend.utils.high_ups import invalidate_high_ups
+from ora_backend.utils.partitions import create_chat_message_partitions
 
 asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
 
@@ -37,6 +40,7 @@ def pytest_configure(config):
     else:
         loop.run_until_complete(db.set_bind(get_db_url()))
     loop.run_until_complete(db.gino.create_all())
+    loop.run_until_complete(create_chat_message_partitions())
 
 
 @pytest.fixture(autouse=True)
@@ -48,10 +52,22 @@ async def reset_db():
     await db.status(db.text("""TRUNCATE "visitor" RESTART IDENTITY CASCADE;"""))
     await db.status(db.text("""TRUNCATE "chat" RESTART IDENTITY CASCADE;"""))
     await db.status(db.text("""TRUNCATE "chat_message" RESTART IDENTITY CASCADE;"""))
+    await db.status(
+        db.text("""TRUNCATE "chat_message_archive" RESTART IDENTITY CASCADE;""")
+    )
+    await db.status(db.text("""TRUNCATE "chat_activity" RESTART IDENTITY CASCADE;"""))
     await db.status(
         db.text("""TRUNCATE "bookmark_visitor" RESTART IDENTITY CASCADE;""")
     )
     await db.status(db.text("""TRUNCATE "chat_unclaimed" RESTART IDENTITY CASCADE;"""))
+    await db.status(
+        db.text("""TRUNCATE "notification_staff" RESTART IDENTITY CASCADE;""")
+    )
+    await db.status(
+        db.text("""TRUNCATE "notification_staff_read" RESTART IDENTITY CASCADE;""")
+    )
+    await cache.clear(namespace=CACHE_UNREAD_NOTIFICATIONS)
+    await invalidate_high_ups()
 
     # Re-setup the db
     await setup_db()
@@ -4,8 +4,17 @@ from pytest import raises
 
 from ora_backend import cache, db
 from ora_backend.constants import UNCLAIMED_CHATS_PREFIX
-from ora_backend.models import Chat, ChatMessage, Organisation, Visitor, User
+from ora_backend.models import (
+    Chat,
+    ChatMessage,
+    ChatMessageArchive,
+    Organisation,
+    Visitor,
+    User,
+)
+from ora_backend.utils.archive import archive_chat, get_archived_message
 from ora_backend.utils.query import get_one
+from ora_backend.utils.serialization import serialize_to_dict
 from ora_backend.tests import (
     profile_created_from_origin,
     fake,
@@ -96,6 +105,41 @@ async def test_get_chat_messages_as_agent(agent1_client, visitors, users):
     assert not body["links"]
 
 
+async def test_get_chat_messages_with_fields(agent1_client, visitors, users):
+    visitor_id = visitors[-1]["id"]
+    chat = await Chat.add(visitor_id=visitor_id)
+    for sequence_num in range(1, 5):
+        await ChatMessage.add(
+            chat_id=chat["id"],
+            sequence_num=sequence_num,
+            content={"value": fake.sentence(nb_words=10)},
+            sender=users[-6]["id"],
+        )
+
+    # The content and senders are not selected
+    res = await agent1_client.get(
+        "/visitors/{}/messages?fields=created_at".format(visitor_id)
+    )
+    assert res.status == 200
+    body = await res.json()
+    assert len(body["data"]) == 4
+    for sequence_num, message in enumerate(body["data"], 1):
+        assert set(message) == {"id", "sequence_num", "created_at"}
+        assert message["sequence_num"] == sequence_num
+
+    # The senders are joined if requested
+    res = await agent1_client.get(
+        "/visitors/{}/messages?fields=sender".format(visitor_id)
+    )
+    assert res.status == 200
+    body = await res.json()
+    assert all(
+        profile_created_from_origin(users[-6], message["sender"])
+        for message in body["data"]
+    )
+    assert all("content" not in message for message in body["data"])
+
+
 async def test_get_chat_messages_as_supervisor(supervisor1_client, visitors, users):
     visitor_id = visitors[-1]["id"]
 
@@ -152,6 +196,82 @@ async def test_get_chat_messages_as_supervisor(supervisor1_client, visitors, use
     assert not body["links"]
 
 
+async def test_get_chat_messages_from_archive(supervisor1_client, visitors, users):
+    visitor_id = visitors[-1]["id"]
+
+    # Create some dummy chat messages, the first 16 messages are old
+    chat = await Chat.add(visitor_id=visitor_id)
+    messages = []
+    for sequence_num in range(1, 25):
+        content = {"value": fake.sentence(nb_words=10)}
+        sender = users[-6]["id"] if randint(0, 1) else None
+        chat_msg = {
+            "chat_id": chat["id"],
+            "sequence_num": sequence_num,
+            "content": content,
+            "sender": sender,
+        }
+        if sequence_num <= 16:
+            chat_msg["created_at"] = sequence_num
+        await ChatMessage.add(**chat_msg)
+        chat_msg["sender"] = users[-6] if sender else None
+        messages.append(chat_msg)
+
+    # Archive the old messages
+    assert (
+        await archive_chat(
+            ChatMessage, ChatMessageArchive, chat["id"], archive_before=100
+        )
+        == 16
+    )
+    assert len(await ChatMessage.query.gino.all()) == 8
+    assert await ChatMessage.get_latest_sequence_num(chat["id"]) == 24
+    first_msg = await ChatMessage.get_first_message_of_chat(chat["id"])
+    assert first_msg["sequence_num"] == 1
+
+    # The archived messages are serialized as the live ones
+    live_msg = serialize_to_dict(await ChatMessage.query.gino.first())
+    assert set(first_msg) == set(live_msg)
+
+    # The archived messages are found by their ids
+    archived_msg = await get_archived_message(
+        ChatMessageArchive, chat["id"], first_msg["id"]
+    )
+    assert archived_msg["sequence_num"] == 1
+    assert not await get_archived_message(
+        ChatMessageArchive, chat["id"], live_msg["id"]
+    )
+
+    # The first page is completed with the archived messages
+    res = await supervisor1_client.get("/visitors/{}/messages".format(visitor_id))
+    assert res.status == 200
+    body = await res.json()
+    assert len(body["data"]) == 15
+    for expected, actual in zip(messages[9:], body["data"]):
+        assert profile_created_from_origin(expected, actual, ignore={"sender"})
+        assert profile_created_from_origin(expected["sender"], actual["sender"])
+
+    # The next page starts from an archived message
+    prev_page_link = get_prev_page_link(body)
+    res = await supervisor1_client.get(prev_page_link)
+    assert res.status == 200
+    body = await res.json()
+    assert len(body["data"]) == 9
+    for expected, actual in zip(messages[:9], body["data"]):
+        assert profile_created_from_origin(expected, actual, ignore={"sender"})
+        assert profile_created_from_origin(expected["sender"], actual["sender"])
+
+    # Paging forward goes through the archived and the live messages
+    res = await supervisor1_client.get(
+        "/visitors/{}/messages?after_id={}".format(visitor_id, body["data"][-1]["id"])
+    )
+    assert res.status == 200
+    body = await res.json()
+    assert len(body["data"]) == 15
+    for expected, actual in zip(messages[9:], body["data"]):
+        assert profile_created_from_origin(expected, actual, ignore={"sender"})
+
+
 async def test_get_chat_messages_as_visitor(visitor1_client, visitors, users):
     visitor_id = visitors[-1]["id"]
 
@@ -39,6 +39,49 @@ async def test_get_one_user(agent1_client, users):
     assert res.status == 404
 
 
+async def test_get_users_with_fields(supervisor1_client, users):
+    # Only the given fields are returned, with the id
+    res = await supervisor1_client.get("/users?fields=full_name,email&limit=10")
+    assert res.status == 200
+    body = await res.json()
+    assert len(body["data"]) == 10
+    for origin, created in zip(users, body["data"]):
+        assert created == {
+            "id": origin["id"],
+            "full_name": origin["full_name"],
+            "email": origin["email"],
+        }
+    assert "next" in body["links"]
+
+    # The readonly and unknown fields are ignored
+    res = await supervisor1_client.get(
+        "/users/{}?fields=password,unknown".format(users[2]["id"])
+    )
+    assert res.status == 200
+    body = await res.json()
+    assert body["data"] == {"id": users[2]["id"]}
+
+
+async def test_get_one_user_not_modified(agent1_client, users):
+    url = "/users/{}".format(users[0]["id"])
+    res = await agent1_client.get(url)
+    assert res.status == 200
+    etag = res.headers["ETag"]
+
+    # The client already has the user
+    res = await agent1_client.get(url, headers={"If-None-Match": etag})
+    assert res.status == 304
+    assert res.headers["ETag"] == etag
+
+    # The user has changed
+    await User.modify({"id": users[0]["id"]}, {"full_name": "A new name"})
+    res = await agent1_client.get(url, headers={"If-None-Match": etag})
+    assert res.status == 200
+    body = await res.json()
+    assert body["data"]["full_name"] == "A new name"
+    assert res.headers["ETag"] != etag
+
+
 async def test_get_all_users(supervisor1_client, users):
     res = await supervisor1_client.get("/users")
     assert res.status == 200
@@ -336,6 +336,22 @@ async def test_get_visitors_most_recent(users, supervisor1_client):
     for expected, actual in zip(visitors[30:], body["data"]):
         assert profile_created_from_origin(expected, actual)
 
+    # The visitors without messages of the staffs are not listed
+    visitor = get_fake_visitor()
+    if "password" in visitor:
+        visitor["password"] = hash_password(visitor["password"])
+    await Visitor(**visitor).create()
+    res = await supervisor1_client.get(
+        "/visitors/most_recent?after_id={}".format(visitor["id"])
+    )
+    assert res.status == 404
+
+    # The visitors are not filtered by other params
+    res = await supervisor1_client.get(
+        "/visitors/most_recent?staff_id={}".format(staff["id"])
+    )
+    assert res.status == 400
+
 
 ## REPLACE USER ##
 
@@ -117,3 +117,52 @@ async def test_get_unread_visitors_for_staff(supervisor1_client):
     assert "links" not in body
     assert isinstance(body["data"], list)
     assert not body["data"]
+
+
+async def test_get_unread_visitors_without_recent_messages(
+    supervisor1_client, visitors
+):
+    # A chat with only old messages, and a chat without messages, never seen
+    old_chat = await Chat.add(visitor_id=visitors[0]["id"])
+    await ChatMessage.add(
+        chat_id=old_chat["id"], sequence_num=0, content={"content": "Hi"}, created_at=1
+    )
+    empty_chat = await Chat.add(visitor_id=visitors[1]["id"])
+
+    # A read chat with a recent message
+    read_chat = await Chat.add(visitor_id=visitors[2]["id"])
+    chat_msg = await ChatMessage.add(
+        chat_id=read_chat["id"], sequence_num=0, content={"content": "Hi"}
+    )
+    res = await supervisor1_client.patch(
+        "/visitors/{}/last_seen".format(visitors[2]["id"]),
+        json={"last_seen_msg_id": chat_msg["id"]},
+    )
+    assert res.status == 200
+
+    # Two seen chats with only old messages, one of them unread
+    old_chats = []
+    for visitor in visitors[3:5]:
+        chat = await Chat.add(visitor_id=visitor["id"])
+        old_chats.append(chat)
+        first_msg = await ChatMessage.add(
+            chat_id=chat["id"], sequence_num=0, content={"content": "Hi"}, created_at=2
+        )
+        last_msg = await ChatMessage.add(
+            chat_id=chat["id"], sequence_num=1, content={"content": "Hi"}, created_at=3
+        )
+        seen_msg = first_msg if visitor is visitors[3] else last_msg
+        res = await supervisor1_client.patch(
+            "/visitors/{}/last_seen".format(visitor["id"]),
+            json={"last_seen_msg_id": seen_msg["id"]},
+        )
+        assert res.status == 200
+
+    # The unseen chats are unread, even without recent messages,
+    # as are the seen chats with old unread messages
+    res = await supervisor1_client.get("/visitors/unread")
+    assert res.status == 200
+    body = await res.json()
+    assert sorted(item["room"]["id"] for item in body["data"]) == sorted(
+        [old_chat["id"], empty_chat["id"], old_chats[0]["id"]]
+    )
@@ -0,0 +1,62 @@
+from pytest import raises
+
+from ora_backend import cache
+from ora_backend.constants import ROLES
+from ora_backend.models import StaffSubscriptionChat, User
+from ora_backend.utils import assign
+from ora_backend.utils.assign import auto_reassign_staffs_to_chats
+from ora_backend.utils.staff_loads import VOLUNTEER_LOADS, reset_volunteer_loads
+
+
+async def test_auto_reassign_staffs_to_chats(visitors):
+    agents = await User.query.where(User.role_id == ROLES.inverse["agent"]).gino.all()
+    agent_ids = {agent.id for agent in agents if not agent.disabled}
+    visitor_ids = [visitor["id"] for visitor in visitors[:5]]
+
+    # Subscribe some staffs to the chats
+    current_staff_id = next(iter(agent_ids))
+    for visitor_id in visitor_ids[:3]:
+        await StaffSubscriptionChat.add(
+            staff_id=current_staff_id, visitor_id=visitor_id
+        )
+
+    new_staffs = await auto_reassign_staffs_to_chats(visitor_ids)
+    assert set(new_staffs) == set(visitor_ids)
+
+    # Each chat has only its new staff
+    for visitor_id in visitor_ids:
+        subscriptions = await StaffSubscriptionChat.query.where(
+            StaffSubscriptionChat.visitor_id == visitor_id
+        ).gino.all()
+        assert [item.staff_id for item in subscriptions] == [
+            new_staffs[visitor_id]["id"]
+        ]
+        assert new_staffs[visitor_id]["id"] in agent_ids
+        if visitor_id in visitor_ids[:3] and len(agent_ids) > 1:
+            assert new_staffs[visitor_id]["id"] != current_staff_id
+
+    assert await auto_reassign_staffs_to_chats([]) == {}
+
+
+async def test_auto_reassign_staffs_to_chats_on_errors(visitors, monkeypatch):
+    await reset_volunteer_loads()
+    visitor_ids = [visitor["id"] for visitor in visitors[:3]]
+    loads_key = cache.build_key(VOLUNTEER_LOADS, namespace="staffs")
+    loads = await cache.raw("zrange", loads_key, 0, -1, "withscores")
+
+    # The picked volunteers are uncounted if their subscriptions are rolled back
+    async def fail(subscriptions):
+        raise RuntimeError
+
+    with monkeypatch.context() as patch:
+        patch.setattr(assign, "subscribe_picked_staffs", fail)
+        with raises(RuntimeError):
+            await auto_reassign_staffs_to_chats(visitor_ids)
+    assert await cache.raw("zrange", loads_key, 0, -1, "withscores") == loads
+
+    # The staffs which no longer exist are skipped
+    async def get_no_staffs(staff_ids):
+        return {}
+
+    monkeypatch.setattr(assign, "get_staffs_by_id", get_no_staffs)
+    assert await auto_reassign_staffs_to_chats(visitor_ids) == {}
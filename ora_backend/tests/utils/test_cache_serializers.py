@@ -0,0 +1,45 @@
+from ora_backend import cache
+from ora_backend.constants import CACHE_UNREAD_NOTIFICATIONS
+from ora_backend.utils.cache_serializers import MSGPACK_V1, CacheSerializer, msgpack
+
+
+def test_cache_serializer():
+    value = {"staff": {"id": "1", "full_name": "Xin chào"}, "count": 2}
+    json_serializer = CacheSerializer()
+    binary_serializer = CacheSerializer(binary=True)
+
+    encoded = binary_serializer.dumps(value)
+    if msgpack is not None:
+        assert encoded[:1] == MSGPACK_V1
+        assert len(encoded) < len(json_serializer.dumps(value).encode("utf-8"))
+
+    # Both formats are read by both serializers
+    for serializer in (json_serializer, binary_serializer):
+        assert serializer.loads(encoded) == value
+        assert serializer.loads(json_serializer.dumps(value).encode("utf-8")) == value
+        assert serializer.loads(None) is None
+
+    # The values which msgpack can't pack are stored as JSON
+    value = {"count": 1 << 70}
+    encoded = binary_serializer.dumps(value)
+    assert encoded == json_serializer.dumps(value)
+    assert binary_serializer.loads(encoded.encode("utf-8")) == value
+
+
+async def test_cache_namespaces():
+    value = {"id": "1", "name": "Visitor 1"}
+    await cache.set("1", value, namespace="visitor_info")
+    assert await cache.get("1", namespace="visitor_info") == value
+    stored = await cache.raw("get", cache.build_key("1", namespace="visitor_info"))
+    assert (stored[:1] == MSGPACK_V1) == (msgpack is not None)
+
+    # The default namespace stays as JSON, whose keys are strings
+    await cache.set("1", {1: "Staff 1"})
+    assert await cache.get("1") == {"1": "Staff 1"}
+    assert (await cache.raw("get", cache.build_key("1")))[:1] == b"{"
+
+    # The counters stay as JSON, to be incremented by Redis
+    await cache.set("1", 2, namespace=CACHE_UNREAD_NOTIFICATIONS)
+    key = cache.build_key("1", namespace=CACHE_UNREAD_NOTIFICATIONS)
+    assert await cache.raw("incrby", key, 1) == 3
+    assert await cache.get("1", namespace=CACHE_UNREAD_NOTIFICATIONS) == 3
@@ -0,0 +1,31 @@
+from ora_backend.models import StaffSubscriptionChat, User
+from ora_backend.utils.etag import compute_etag, etag_matches
+from ora_backend.utils.versions import bump_table_version, get_table_versions
+
+
+def test_etag_matches():
+    etag = compute_etag("/users/1", "", "2", "3")
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag != compute_etag("/users/1", "", "2", "4")
+
+    assert etag_matches(etag, etag)
+    assert etag_matches('"other", W/{}'.format(etag), etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
+
+
+async def test_table_versions(users, visitors):
+    tables = (StaffSubscriptionChat.__tablename__, User.__tablename__)
+    version = await get_table_versions(*tables)
+    assert await get_table_versions(*tables) == version
+
+    await bump_table_version(User.__tablename__)
+    new_version = await get_table_versions(*tables)
+    assert new_version != version
+
+    # The versions are bumped when the rows change
+    await StaffSubscriptionChat.add(
+        staff_id=users[-6]["id"], visitor_id=visitors[0]["id"]
+    )
+    assert await get_table_versions(*tables) != new_version
@@ -0,0 +1,15 @@
+import json
+
+from ora_backend.utils.fast_json import dumps, loads
+
+
+def test_dumps_and_loads():
+    payload = {"data": [{"id": "1", "content": {"content": "Xin chào"}}], "links": {}}
+    assert json.loads(dumps(payload)) == payload
+    assert loads(dumps(payload)) == payload
+
+    # The keyword arguments of the standard library are accepted
+    assert loads(dumps(payload, separators=(",", ":"))) == payload
+
+    # The values unsupported by the faster libraries are encoded by the standard one
+    assert loads(dumps({"value": 2**70})) == {"value": 2**70}
@@ -0,0 +1,39 @@
+from ora_backend.constants import ROLES
+from ora_backend.models import StaffNotificationSetting, User
+from ora_backend.utils.high_ups import get_high_ups
+from ora_backend.utils.query import get_supervisor_emails_to_send_emails
+
+
+async def test_high_ups_directory(users):
+    high_ups = await User.query.where(User.role_id < ROLES.inverse["agent"]).gino.all()
+    assert {high_up["id"] for high_up in await get_high_ups()} == {
+        user.id for user in high_ups
+    }
+
+    supervisors = [
+        user
+        for user in high_ups
+        if user.role_id == ROLES.inverse["supervisor"] and not user.disabled
+    ]
+    emails = {user.email for user in supervisors}
+    assert set(await get_supervisor_emails_to_send_emails()) == emails
+
+    # The directory is invalidated when the notification settings change
+    supervisor = supervisors[0]
+    setting = await StaffNotificationSetting.add(
+        staff_id=supervisor.id, receive_emails=False
+    )
+    assert set(await get_supervisor_emails_to_send_emails()) == emails - {
+        supervisor.email
+    }
+
+    await StaffNotificationSetting.modify(
+        {"id": setting["id"]}, {"receive_emails": True}
+    )
+    assert set(await get_supervisor_emails_to_send_emails()) == emails
+
+    # And when the staffs are disabled
+    await User.remove(id=supervisor.id)
+    assert set(await get_supervisor_emails_to_send_emails()) == emails - {
+        supervisor.email
+    }
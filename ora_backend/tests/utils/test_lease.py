@@ -0,0 +1,37 @@
+from pytest import raises
+
+from ora_backend.utils.lease import LeaseLock
+
+
+async def test_lease_lock():
+    lock = LeaseLock("test_lease_lock", lease=5)
+    other_lock = LeaseLock("test_lease_lock", lease=5)
+
+    # Only one holder at a time, which can renew its lease
+    assert await lock.acquire()
+    assert not await other_lock.acquire()
+    assert await lock.acquire()
+
+    # The lock is taken over once released
+    assert not await other_lock.release()
+    assert await lock.release()
+    assert await other_lock.acquire()
+    assert await other_lock.release()
+
+
+async def test_lease_lock_hold():
+    lock = LeaseLock("test_lease_lock_hold", lease=5)
+    other_lock = LeaseLock("test_lease_lock_hold", lease=5)
+
+    async with lock.hold() as held:
+        assert held
+    async with other_lock.hold() as held:
+        assert not held
+
+    # The lock is released on errors
+    with raises(RuntimeError):
+        async with lock.hold():
+            raise RuntimeError
+    async with other_lock.hold() as held:
+        assert held
+    assert await other_lock.release()
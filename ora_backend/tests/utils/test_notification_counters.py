@@ -0,0 +1,83 @@
+from ora_backend.models import NotificationStaff, NotificationStaffRead
+from ora_backend.utils.notification_counters import (
+    get_unread_count,
+    reconcile_unread_counts,
+    reset_unread_count,
+    set_unread_count,
+)
+from ora_backend.utils.query import (
+    get_number_of_unread_notifications_for_staff,
+    get_numbers_of_unread_notifications_for_staffs,
+)
+
+
+async def get_unread(staff_id):
+    return await get_number_of_unread_notifications_for_staff(
+        staff_id, NotificationStaffRead, NotificationStaff
+    )
+
+
+async def test_unread_notification_counters(users):
+    staff_id = users[0]["id"]
+    other_staff_id = users[1]["id"]
+
+    # The counters are only incremented once they are counted from the db
+    await NotificationStaff.add(staff_id=staff_id, content={"index": 0})
+    assert await get_unread_count(staff_id) is None
+    assert await get_unread(staff_id) == 1
+    assert await get_unread_count(staff_id) == 1
+
+    await NotificationStaff.add(staff_id=staff_id, content={"index": 1})
+    await NotificationStaff.bulk_upsert(
+        [
+            {"staff_id": staff_id, "content": {"index": 2}},
+            {"staff_id": staff_id, "content": {"index": 3}},
+            {"staff_id": other_staff_id, "content": {"index": 0}},
+        ]
+    )
+    assert await get_unread(staff_id) == 4
+    assert await get_unread_count(other_staff_id) is None
+    assert await get_unread(other_staff_id) == 1
+
+    # Mark the notifications as read
+    latest = await NotificationStaff.query.where(
+        NotificationStaff.staff_id == staff_id
+    ).gino.all()
+    await NotificationStaffRead.update_or_create(
+        {"staff_id": staff_id},
+        {"last_read_internal_id": max(noti.internal_id for noti in latest)},
+    )
+    await reset_unread_count(staff_id)
+    assert await get_unread(staff_id) == 0
+
+    # Drifted counters are corrected against the db
+    await set_unread_count(staff_id, 10)
+    await set_unread_count(other_staff_id, 0)
+    assert await reconcile_unread_counts() == 2
+    assert await get_unread(staff_id) == 0
+    assert await get_unread(other_staff_id) == 1
+
+
+async def test_unread_notification_counters_of_staffs(users):
+    staff_id = users[0]["id"]
+    other_staff_id = users[1]["id"]
+    await NotificationStaff.bulk_upsert(
+        [
+            {"staff_id": staff_id, "content": {"index": 0}},
+            {"staff_id": staff_id, "content": {"index": 1}},
+            {"staff_id": other_staff_id, "content": {"index": 0}},
+        ]
+    )
+
+    # The cached counters are kept, the missing ones are counted from the db
+    await set_unread_count(staff_id, 5)
+    counts = await get_numbers_of_unread_notifications_for_staffs(
+        [staff_id, other_staff_id, other_staff_id],
+        NotificationStaffRead,
+        NotificationStaff,
+    )
+    assert counts == {staff_id: 5, other_staff_id: 1}
+    assert await get_unread_count(other_staff_id) == 1
+    assert await NotificationStaffRead.query.where(
+        NotificationStaffRead.staff_id == other_staff_id
+    ).gino.first()
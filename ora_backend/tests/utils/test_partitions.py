@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime, timezone
+
+from ora_backend import db
+from ora_backend.models import ChatMessage
+from ora_backend.utils.partitions import (
+    DEFAULT_PARTITION,
+    add_months,
+    create_chat_message_partition,
+    create_chat_message_partitions,
+    get_month_start,
+    get_partition_bounds,
+    get_partition_name,
+    to_timestamp,
+)
+
+
+def test_partition_months():
+    month_start = get_month_start(
+        to_timestamp(datetime(2019, 12, 31, 23, 59, tzinfo=timezone.utc))
+    )
+    assert month_start == datetime(2019, 12, 1, tzinfo=timezone.utc)
+    assert add_months(month_start, 1) == datetime(2020, 1, 1, tzinfo=timezone.utc)
+    assert add_months(month_start, -12) == datetime(2018, 12, 1, tzinfo=timezone.utc)
+    assert get_partition_name(month_start) == "chat_message_y2019m12"
+    assert get_partition_bounds(month_start) == (1575158400000, 1577836800000)
+
+
+async def test_create_chat_message_partitions(visitors):
+    # The partitions are created on start up
+    assert await create_chat_message_partitions() == []
+
+    # A message without a partition of its month is stored in the default partition
+    month_start = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    chat_id = visitors[0]["id"]
+    message = await ChatMessage.add(
+        chat_id=chat_id,
+        sequence_num=0,
+        content={},
+        created_at=to_timestamp(month_start),
+    )
+    partition = await db.scalar(
+        db.text("SELECT tableoid::regclass::text FROM chat_message WHERE id = :id"),
+        id=message["id"],
+    )
+    assert partition == DEFAULT_PARTITION
+
+    # Its rows are moved to the new partition
+    try:
+        assert await create_chat_message_partition(month_start)
+        assert not await create_chat_message_partition(month_start)
+        partition = await db.scalar(
+            db.text("SELECT tableoid::regclass::text FROM chat_message WHERE id = :id"),
+            id=message["id"],
+        )
+        assert partition == get_partition_name(month_start)
+    finally:
+        await db.status(db.text("DROP TABLE IF EXISTS chat_message_y2000m01;"))
+
+
+async def test_create_chat_message_partition_concurrently():
+    # Only one of the workers creating a partition at the same time creates it
+    month_start = datetime(2000, 2, 1, tzinfo=timezone.utc)
+    try:
+        created = await asyncio.gather(
+            *(create_chat_message_partition(month_start) for _ in range(3))
+        )
+        assert sorted(created) == [False, False, True]
+    finally:
+        await db.status(db.text("DROP TABLE IF EXISTS chat_message_y2000m02;"))
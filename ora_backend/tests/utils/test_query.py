@@ -2,9 +2,14 @@ from time import sleep
 from pprint import pprint
 
 from ora_backend.constants import DEFAULT_SEVERITY_LEVEL_OF_CHAT
-from ora_backend.models import Visitor, Chat
+from ora_backend.models import BookmarkVisitor, Visitor, Chat
 from ora_backend.tests import get_fake_visitor, profile_created_from_origin
-from ora_backend.utils.query import get_flagged_chats_of_online_visitors
+from ora_backend.utils.query import (
+    get_flagged_chats_of_online_visitors,
+    get_many,
+    get_one,
+    upsert_one,
+)
 
 
 async def test_get_flagged_chats_of_online_visitors(supervisor1_client):
@@ -71,3 +76,71 @@ async def test_get_flagged_chats_of_online_visitors(supervisor1_client):
         # assert profile_created_from_origin(room, chat)
         # assert profile_created_from_origin(expected, visitor)
         assert profile_created_from_origin({**chat, **expected}, visitor)
+
+
+async def test_get_one_and_get_many_with_cached_queries(visitors):
+    # The queries of the same shape are re-used with different values
+    for visitor in visitors[:3]:
+        row = await get_one(Visitor, id=visitor["id"])
+        assert row.id == visitor["id"]
+        assert row.name == visitor["name"]
+
+    # Filter by None
+    anonymous_visitors = await get_many(Visitor, email=None, limit=100)
+    assert {row.name for row in anonymous_visitors} == {
+        visitor["name"] for visitor in visitors if not visitor.get("email")
+    }
+    row = await get_one(Visitor, email=None, is_anonymous=True)
+    assert row.is_anonymous and row.email is None
+
+    # Paginate
+    all_visitors = await get_many(Visitor, limit=100)
+    assert [row.id for row in all_visitors] == [visitor["id"] for visitor in visitors]
+    for index in range(3):
+        page = await get_many(Visitor, after_id=all_visitors[index].id, limit=2)
+        assert [row.id for row in page] == [
+            row.id for row in all_visitors[index + 1 : index + 3]
+        ]
+
+    # Filter by a list of values
+    visitor_ids = [visitor["id"] for visitor in visitors[2:5]]
+    rows = await get_many(Visitor, in_column="id", in_values=visitor_ids)
+    assert [row.id for row in rows] == visitor_ids
+    rows = await get_many(Visitor, in_column="id", in_values=[])
+    assert rows == []
+    rows = await get_many(
+        Visitor, not_in_column="id", not_in_values=visitor_ids, limit=100
+    )
+    assert len(rows) == len(visitors) - len(visitor_ids)
+    assert not set(visitor_ids) & {row.id for row in rows}
+
+
+async def test_upsert_one(visitors, users):
+    key = {"staff_id": users[0]["id"], "visitor_id": visitors[0]["id"]}
+
+    # Insert a new row, with the default values
+    created = await upsert_one(BookmarkVisitor, ["staff_id", "visitor_id"], key)
+    assert created.id and created.internal_id and created.created_at
+    assert created.is_bookmarked is False
+
+    # Return the existing row as it is
+    existing = await upsert_one(
+        BookmarkVisitor, ["staff_id", "visitor_id"], {**key, "is_bookmarked": True}
+    )
+    assert existing.id == created.id
+    assert existing.is_bookmarked is False
+    assert existing.updated_at is None
+
+    # Update the existing row
+    updated = await upsert_one(
+        BookmarkVisitor,
+        ["staff_id", "visitor_id"],
+        {**key, "is_bookmarked": True},
+        {"is_bookmarked": True},
+    )
+    assert updated.id == created.id
+    assert updated.is_bookmarked is True
+    assert updated.updated_at
+
+    rows = await BookmarkVisitor.query.gino.all()
+    assert len(rows) == 1
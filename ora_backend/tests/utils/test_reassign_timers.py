@@ -0,0 +1,55 @@
+from ora_backend import cache
+from ora_backend.constants import ROLES
+from ora_backend.models import ChatUnhandled, User, unix_time
+from ora_backend.tasks.assign import REASSIGN_INTERVAL, reassign_due_chats
+from ora_backend.utils.query import get_unhandled_cutoff
+from ora_backend.utils.reassign_timers import (
+    REASSIGN_TIMERS,
+    pop_due_reassign_timers,
+    start_reassign_timers,
+)
+from ora_backend.utils.staff_loads import reset_volunteer_loads
+
+
+async def test_reassign_timers(visitors):
+    await cache.delete(REASSIGN_TIMERS, namespace="tasks")
+    hour = 60 * 60 * 1000
+    now = unix_time()
+
+    # The timers start when the chats become unhandled
+    for index, visitor in enumerate(visitors[:4]):
+        await ChatUnhandled.add(visitor_id=visitor["id"], created_at=now - index * hour)
+
+    # And stop when they are handled
+    await ChatUnhandled.remove_if_exists(visitor_id=visitors[3]["id"])
+
+    # Only the chats unhandled for long enough are due, the longest first
+    assert await pop_due_reassign_timers(now - hour, 10) == [
+        visitors[2]["id"],
+        visitors[1]["id"],
+    ]
+    assert await pop_due_reassign_timers(now - hour, 10) == []
+
+    # The timers already started are kept
+    await start_reassign_timers(
+        {visitors[0]["id"]: now - 2 * hour, visitors[1]["id"]: now - 2 * hour},
+        only_new=True,
+    )
+    assert await pop_due_reassign_timers(now - hour, 1) == [visitors[1]["id"]]
+    assert await pop_due_reassign_timers(now, 10) == [visitors[0]["id"]]
+
+
+async def test_reassign_due_chats_without_volunteers(visitors):
+    await cache.delete(REASSIGN_TIMERS, namespace="tasks")
+    await User.update.values(disabled=True).where(
+        User.role_id == ROLES.inverse["agent"]
+    ).gino.status()
+    await reset_volunteer_loads()
+    await ChatUnhandled.add(
+        visitor_id=visitors[0]["id"], created_at=unix_time() - 100 * 60 * 60 * 1000
+    )
+
+    # The chats which are not reassigned are due again on the next run
+    assert await reassign_due_chats() == 0
+    next_cutoff = get_unhandled_cutoff(24, unix_time() + REASSIGN_INTERVAL * 1000)
+    assert await pop_due_reassign_timers(next_cutoff, 10) == [visitors[0]["id"]]
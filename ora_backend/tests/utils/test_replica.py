@@ -0,0 +1,45 @@
+from ora_backend import db
+from ora_backend.config.db import get_db_url
+from ora_backend.models import Visitor
+from ora_backend.utils.replica import ReplicaRouter, read_from_primary
+
+
+async def test_replica_router(visitors):
+    router = ReplicaRouter(check_interval=0)
+
+    # Without a replica, all queries go to the primary
+    assert await router.get_read_bind() is db.bind
+
+    # Use the testing DB as the replica
+    await router.connect(get_db_url())
+    try:
+        bind = await router.get_read_bind()
+        assert bind is router.engine
+        # The testing DB is not in recovery
+        assert router.lag == 0
+        rows = await bind.all(Visitor.query)
+        assert len(rows) == len(visitors)
+
+        # Read-your-writes paths use the primary
+        with read_from_primary():
+            assert await router.get_read_bind() is db.bind
+        assert await router.get_read_bind() is router.engine
+
+        # Fall back to the primary if the replica lags behind
+        router.max_lag = -1
+        assert await router.get_read_bind() is db.bind
+
+        # Fall back to the primary if a query fails on the replica
+        router.max_lag = 10
+        await router.engine.close()
+        router.check_interval = 60
+        router.lag = 0
+        rows = await router.run("all", Visitor.query)
+        assert len(rows) == len(visitors)
+        assert router.lag is None
+        assert await router.get_read_bind() is db.bind
+        router.engine = None
+    finally:
+        await router.close()
+
+    assert await router.get_read_bind() is db.bind
@@ -0,0 +1,33 @@
+from ora_backend.utils.row_mapper import RowMapper
+
+
+def test_row_mapper_merged_groups():
+    mapper = RowMapper((None, ["id", "name"]), (None, ["id", "email"]))
+
+    # The later groups override the same keys of the earlier ones
+    assert mapper([(1, "chat", 2, "a@b.c")]) == [
+        {"id": 2, "name": "chat", "email": "a@b.c"}
+    ]
+    assert mapper([]) == []
+
+
+def test_row_mapper_nested_groups():
+    mapper = RowMapper(
+        ("user", ["id"]), ("room", ["id", "severity_level"]), (None, ["unread"])
+    )
+    assert mapper([("v1", "c1", 0, True)]) == [
+        {
+            "unread": True,
+            "user": {"id": "v1"},
+            "room": {"id": "c1", "severity_level": 0},
+        }
+    ]
+
+
+def test_row_mapper_required_key():
+    mapper = RowMapper((None, ["id", "sender"]), ("sender", ["id", "name"], "sender"))
+    rows = [("m1", "s1", "s1", "Staff"), ("m2", None, None, None)]
+    assert mapper(rows) == [
+        {"id": "m1", "sender": {"id": "s1", "name": "Staff"}},
+        {"id": "m2", "sender": None},
+    ]
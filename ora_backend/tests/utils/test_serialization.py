@@ -0,0 +1,28 @@
+from ora_backend.models import Visitor
+from ora_backend.utils.serialization import serialize_records, serialize_to_dict
+
+
+async def test_serialize_records(visitors):
+    rows = await Visitor.query.order_by(Visitor.internal_id).gino.all()
+    records = (
+        await Visitor.query.order_by(Visitor.internal_id)
+        .execution_options(return_model=False)
+        .gino.all()
+    )
+
+    # The raw records are serialized as the loaded models
+    assert serialize_records(Visitor, records) == serialize_to_dict(rows)
+    assert serialize_records(
+        Visitor, records, allow_readonly=True
+    ) == serialize_to_dict(rows, allow_readonly=True)
+
+    # The readonly properties are hidden
+    assert all(
+        "password" not in visitor for visitor in serialize_records(Visitor, records)
+    )
+
+    # Only the given fields are kept
+    assert serialize_records(Visitor, records, fields=["id"]) == [
+        {"id": row.id} for row in rows
+    ]
+    assert serialize_records(Visitor, []) == []
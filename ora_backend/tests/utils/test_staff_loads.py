@@ -0,0 +1,118 @@
+from ora_backend import cache
+from ora_backend.constants import ROLES
+from ora_backend.models import StaffSubscriptionChat, User
+from ora_backend.utils.staff_loads import (
+    ONLINE_VOLUNTEER_LOADS,
+    ONLINE_VOLUNTEERS,
+    VOLUNTEER_LOADS,
+    keep_volunteers_online,
+    pick_volunteer,
+    pick_volunteers,
+    reset_volunteer_loads,
+    set_volunteer_online,
+)
+
+
+async def test_pick_volunteer(visitors):
+    await cache.raw(
+        "delete",
+        cache.build_key(ONLINE_VOLUNTEERS, namespace="staffs"),
+        cache.build_key(ONLINE_VOLUNTEER_LOADS, namespace="staffs"),
+    )
+    await reset_volunteer_loads()
+    agents = await User.query.where(User.role_id == ROLES.inverse["agent"]).gino.all()
+    agent_ids = [agent.id for agent in agents if not agent.disabled]
+    first_id, second_id = agent_ids[:2]
+
+    # The online volunteers are picked first
+    await set_volunteer_online(second_id, True)
+    assert await pick_volunteer() == second_id
+    assert await pick_volunteer([second_id]) in agent_ids
+
+    # Until they are no longer kept online, e.g. when their worker stopped
+    online_loads_key = cache.build_key(ONLINE_VOLUNTEER_LOADS, namespace="staffs")
+    await cache.raw(
+        "zadd", cache.build_key(ONLINE_VOLUNTEERS, namespace="staffs"), 0, second_id
+    )
+    await pick_volunteer()
+    assert await cache.raw("zscore", online_loads_key, second_id) is None
+
+    # The heartbeat of their worker keeps them online
+    await keep_volunteers_online()
+    assert await cache.raw("zscore", online_loads_key, second_id) is not None
+
+    # Then the least loaded offline ones
+    await set_volunteer_online(second_id, False)
+    await reset_volunteer_loads()
+    for agent_id in agent_ids[1:]:
+        await StaffSubscriptionChat.add(staff_id=agent_id, visitor_id=visitors[0]["id"])
+    assert await pick_volunteer() == first_id
+
+    # The loads are updated when the staffs are unsubscribed
+    for agent_id in agent_ids[1:]:
+        await StaffSubscriptionChat.remove_if_exists(
+            staff_id=agent_id, visitor_id=visitors[0]["id"]
+        )
+    assert await pick_volunteer([first_id]) != first_id
+
+    # Only the non-excluded volunteers are picked
+    assert await pick_volunteer(agent_ids) is None
+
+
+async def test_pick_volunteers():
+    await cache.raw(
+        "delete",
+        cache.build_key(ONLINE_VOLUNTEERS, namespace="staffs"),
+        cache.build_key(ONLINE_VOLUNTEER_LOADS, namespace="staffs"),
+    )
+    await reset_volunteer_loads()
+    agents = await User.query.where(User.role_id == ROLES.inverse["agent"]).gino.all()
+    agent_ids = [agent.id for agent in agents if not agent.disabled]
+    loads_key = cache.build_key(VOLUNTEER_LOADS, namespace="staffs")
+    loads = await cache.raw("zrange", loads_key, 0, -1, "withscores")
+
+    # The volunteers of the chats are picked in one step, by their loads
+    staff_ids = await pick_volunteers([(), [agent_ids[0]], ()])
+    assert len(staff_ids) == 3
+    assert set(staff_ids) <= set(agent_ids)
+    assert staff_ids[1] != agent_ids[0]
+
+    # None is picked if a chat has no volunteers
+    await reset_volunteer_loads()
+    assert await pick_volunteers([(), agent_ids]) == []
+    assert await cache.raw("zrange", loads_key, 0, -1, "withscores") == loads
+
+    # Unless the excluded volunteers are picked if there are no others
+    staff_ids = await pick_volunteers([(), agent_ids], fallback=True)
+    assert len(staff_ids) == 2 and staff_ids[1] in agent_ids
+
+
+async def test_subscribe_many_staffs_to_visitor(visitors):
+    await reset_volunteer_loads()
+    agents = await User.query.where(User.role_id == ROLES.inverse["agent"]).gino.all()
+    agent_ids = [agent.id for agent in agents if not agent.disabled]
+    first_id = agent_ids[0]
+    visitor_id = visitors[0]["id"]
+
+    loads_key = cache.build_key(VOLUNTEER_LOADS, namespace="staffs")
+    get_load = lambda staff_id: cache.raw("zscore", loads_key, staff_id)
+
+    # Only the new subscriptions are returned and counted
+    await StaffSubscriptionChat.add(staff_id=first_id, visitor_id=visitor_id)
+    loads = {agent_id: await get_load(agent_id) for agent_id in agent_ids}
+    added = await StaffSubscriptionChat.add_many_to_visitor(visitor_id, agent_ids)
+    assert sorted(added) == sorted(agent_ids[1:])
+    assert await get_load(first_id) == loads[first_id]
+    for agent_id in agent_ids[1:]:
+        assert await get_load(agent_id) == loads[agent_id] + 1
+
+    removed = await StaffSubscriptionChat.remove_many_from_visitor(
+        visitor_id, agent_ids[1:]
+    )
+    assert sorted(removed) == sorted(agent_ids[1:])
+    for agent_id in agent_ids:
+        assert await get_load(agent_id) == loads[agent_id]
+    subscriptions = await StaffSubscriptionChat.query.where(
+        StaffSubscriptionChat.visitor_id == visitor_id
+    ).gino.all()
+    assert [item.staff_id for item in subscriptions] == [first_id]
@@ -0,0 +1,51 @@
+import pytest
+
+from ora_backend.models import ChatUnhandled
+from ora_backend.utils.transaction import after_commit, after_rollback, unit_of_work
+
+
+async def test_unit_of_work(visitors):
+    calls = []
+    visitor_ids = [visitor["id"] for visitor in visitors[:3]]
+
+    async def count_unhandled():
+        rows = await ChatUnhandled.query.where(
+            ChatUnhandled.visitor_id.in_(visitor_ids)
+        ).gino.all()
+        return len(rows)
+
+    async def record(name):
+        calls.append(name)
+
+    # The changes are committed together, before running the callbacks
+    async with unit_of_work():
+        await ChatUnhandled.add_if_not_exists(visitor_id=visitors[0]["id"])
+        async with unit_of_work():
+            await ChatUnhandled.add_if_not_exists(visitor_id=visitors[1]["id"])
+            await after_commit(record, "inner")
+        # The conflicting rows don't abort the transaction
+        assert (
+            await ChatUnhandled.add_if_not_exists(visitor_id=visitors[0]["id"]) is None
+        )
+        await after_commit(record, "outer")
+        await after_rollback(record, "not rolled back")
+        assert calls == []
+
+    assert calls == ["inner", "outer"]
+    assert await count_unhandled() == 2
+
+    # Nothing is committed nor run if an error is raised
+    with pytest.raises(ValueError):
+        async with unit_of_work():
+            await ChatUnhandled.add_if_not_exists(visitor_id=visitors[2]["id"])
+            await after_commit(record, "rolled back")
+            await after_rollback(record, "undone")
+            raise ValueError
+
+    assert calls == ["inner", "outer", "undone"]
+    assert await count_unhandled() == 2
+
+    # The callbacks run right away outside of a unit of work
+    await after_commit(record, "now")
+    await after_rollback(record, "never")
+    assert calls == ["inner", "outer", "undone", "now"]
@@ -0,0 +1,46 @@
+from threading import Thread
+
+from cerberus import Validator
+
+from ora_backend.schemas import schemas
+from ora_backend.utils.validators import get_fast_validator, get_validator
+
+
+def test_get_validator():
+    validator = get_validator("user_write")
+    assert get_validator("user_write") is validator
+
+    # Each thread has its own validators
+    validators = []
+    thread = Thread(target=lambda: validators.append(get_validator("user_write")))
+    thread.start()
+    thread.join()
+    assert validators[0] is not validator
+
+
+def test_fast_validator():
+    # The schemas with nested rules are only validated by Cerberus
+    assert get_fast_validator("chat_write") is None
+
+    validate = get_fast_validator("user_write")
+    document = {
+        "full_name": "Staff",
+        "email": "STAFF@example.com",
+        "password": "a-long-password",
+        "disabled": "true",
+    }
+    assert validate(document) == {
+        **document,
+        "email": "staff@example.com",
+        "disabled": True,
+    }
+    assert validate(document) == Validator(schemas["user_write"]).validated(document)
+
+    # The documents which might be invalid are left to Cerberus
+    assert validate({"full_name": "Staff"}) is None
+    assert validate({"full_name": "Staff"}, update=True) == {"full_name": "Staff"}
+    assert validate({"id": "an-id"}, update=True) is None
+    assert validate({"unknown": 1}, update=True) is None
+    assert validate({"full_name": ""}, update=True) is None
+    assert validate({"full_name": None}, update=True) is None
+    assert validate({"role_id": "not a number"}, update=True) is None
@@ -0,0 +1,218 @@
+import json
+import zlib
+
+from sqlalchemy import and_, desc
+
+from ora_backend import db
+
+# The columns of `chat_message` kept in the archive
+ARCHIVED_FIELDS = (
+    "id",
+    "sequence_num",
+    "chat_id",
+    "type_id",
+    "sender",
+    "content",
+    "created_at",
+    "updated_at",
+)
+
+# The chats with old messages, which haven't had any new messages for a while
+inactive_chats_query = db.text(
+    """
+    SELECT DISTINCT old_message.chat_id
+    FROM chat_message AS old_message
+    WHERE
+        old_message.created_at < :archive_before
+        AND NOT EXISTS (
+            SELECT 1
+            FROM chat_message
+            WHERE
+                chat_message.chat_id = old_message.chat_id
+                AND chat_message.created_at >= :inactive_since
+        )
+    LIMIT :limit;
+    """
+)
+
+
+def compress_messages(messages: list) -> bytes:
+    return zlib.compress(json.dumps(messages, separators=(",", ":")).encode("utf-8"))
+
+
+def decompress_messages(data: bytes) -> list:
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+async def archive_chat(message_model, archive_model, chat_id, *, archive_before):
+    """
+    Move the messages of a chat created before `archive_before` (in miliseconds)
+    to a compressed segment of the archive.
+
+    Return the number of archived messages.
+    """
+    async with db.transaction():
+        rows = (
+            await message_model.query.where(
+                and_(
+                    message_model.chat_id == chat_id,
+                    message_model.created_at < archive_before,
+                )
+            )
+            .order_by(message_model.sequence_num, message_model.created_at)
+            .with_for_update()
+            .gino.all()
+        )
+        if not rows:
+            return 0
+
+        messages = [{key: getattr(row, key) for key in ARCHIVED_FIELDS} for row in rows]
+        await archive_model.create(
+            chat_id=chat_id,
+            first_sequence_num=rows[0].sequence_num,
+            last_sequence_num=rows[-1].sequence_num,
+            first_created_at=rows[0].created_at,
+            last_created_at=rows[-1].created_at,
+            message_count=len(rows),
+            messages=compress_messages(messages),
+            message_ids=[row.id for row in rows],
+        )
+        await message_model.delete.where(
+            and_(
+                message_model.chat_id == chat_id,
+                message_model.created_at < archive_before,
+            )
+        ).gino.status()
+
+    return len(rows)
+
+
+async def archive_chat_messages(
+    message_model, archive_model, *, archive_before, inactive_since, batch_size=500
+):
+    """
+    Archive the messages created before `archive_before`
+    of the chats without any messages since `inactive_since` (both in miliseconds).
+
+    Return the number of archived messages.
+    """
+    count = 0
+    while True:
+        chat_ids = (
+            await db.status(
+                inactive_chats_query,
+                {
+                    "archive_before": archive_before,
+                    "inactive_since": inactive_since,
+                    "limit": batch_size,
+                },
+            )
+        )[1]
+        if not chat_ids:
+            return count
+
+        for (chat_id,) in chat_ids:
+            count += await archive_chat(
+                message_model, archive_model, chat_id, archive_before=archive_before
+            )
+
+
+def _matches(message: dict, filters: dict):
+    return all(message.get(key) == value for key, value in filters.items())
+
+
+async def get_archived_messages(
+    archive_model,
+    chat_id,
+    *,
+    limit=15,
+    before=None,
+    after=None,
+    inclusive=False,
+    filters: dict = None,
+):
+    """
+    Return the archived messages of a chat, ordered by `sequence_num`.
+
+    Args:
+        before (int):
+            Return the last messages before this `sequence_num`.
+            If both `before` and `after` are None, return the last messages.
+
+        after (int):
+            Return the first messages after this `sequence_num`.
+
+        inclusive (bool):
+            Whether the message of `before`/`after` is included.
+
+        filters (dict):
+            The values of the returned messages' fields.
+    """
+    filters = filters or {}
+
+    # Only decompress the segments needed to fill the page
+    query = db.select([archive_model.id, archive_model.first_sequence_num]).where(
+        archive_model.chat_id == chat_id
+    )
+    if after is not None:
+        query = query.where(archive_model.last_sequence_num >= after).order_by(
+            archive_model.first_sequence_num
+        )
+    else:
+        if before is not None:
+            query = query.where(archive_model.first_sequence_num <= before)
+        query = query.order_by(desc(archive_model.first_sequence_num))
+    segments = await query.gino.all()
+
+    messages = []
+    for segment in segments:
+        data = (
+            await archive_model.select("messages")
+            .where(archive_model.id == segment[0])
+            .gino.scalar()
+        )
+
+        segment_messages = []
+        for message in decompress_messages(data):
+            sequence_num = message["sequence_num"]
+            if after is not None and (
+                sequence_num < after or (sequence_num == after and not inclusive)
+            ):
+                continue
+            if before is not None and (
+                sequence_num > before or (sequence_num == before and not inclusive)
+            ):
+                continue
+            if _matches(message, filters):
+                segment_messages.append(message)
+
+        if after is not None:
+            messages.extend(segment_messages)
+        else:
+            messages = segment_messages + messages
+        if len(messages) >= limit:
+            break
+
+    return messages[:limit] if after is not None else messages[-limit:]
+
+
+async def get_archived_message(archive_model, chat_id, message_id):
+    """Return an archived message of a chat, or None if it is not archived."""
+    # Only decompress the segment with the message
+    data = await (
+        archive_model.select("messages")
+        .where(
+            and_(
+                archive_model.chat_id == chat_id,
+                archive_model.message_ids.contains([message_id]),
+            )
+        )
+        .gino.scalar()
+    )
+    if data is None:
+        return None
+
+    for message in decompress_messages(data):
+        if message["id"] == message_id:
+            return message
+    return None
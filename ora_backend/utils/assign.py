@@ -1,85 +1,116 @@
-from sqlalchemy import and_
+from sqlalchemy.dialects.postgresql import insert
 
-from ora_backend import cache
-from ora_backend.constants import CACHE_SETTINGS, ROLES
+from ora_backend import db
 from ora_backend.models import User, StaffSubscriptionChat
-from ora_backend.utils.query import delete_many
+from ora_backend.utils.query import get_python_defaults
 from ora_backend.utils.serialization import serialize_to_dict
 from ora_backend.utils.settings import get_settings_from_cache
-
-
-async def reset_all_volunteers_in_cache():
-    raw_volunteers = await User.query.where(
-        and_(User.role_id == ROLES.inverse["agent"], User.disabled == False)
-    ).gino.all()
-    volunteers = [serialize_to_dict(user) for user in raw_volunteers]
-    volunteers_data = await cache.get("all_volunteers", namespace="staffs")
-    if not volunteers_data:
-        await cache.set(
-            "all_volunteers", {"counter": 0, "staffs": volunteers}, namespace="staffs"
-        )
-    else:
-        counter = volunteers_data.get("counter", 0)
-        await cache.set(
-            "all_volunteers",
-            {"counter": counter, "staffs": volunteers},
-            namespace="staffs",
+from ora_backend.utils.staff_loads import (
+    change_volunteer_loads,
+    pick_volunteer,
+    pick_volunteers,
+)
+from ora_backend.utils.transaction import after_commit, after_rollback, unit_of_work
+from ora_backend.utils.versions import bump_table_version
+
+
+async def get_staffs_by_id(staff_ids):
+    staffs = await User.query.where(User.id.in_(set(staff_ids))).gino.all()
+    return {staff.id: serialize_to_dict(staff) for staff in staffs}
+
+
+async def subscribe_picked_staffs(subscriptions: dict):
+    """
+    Subscribe the picked volunteers to the visitors' chats.
+
+    Their loads are already counted when they are picked,
+    so the subscriptions are inserted without the hooks of `StaffSubscriptionChat`.
+    """
+    inserted = (
+        await insert(StaffSubscriptionChat.__table__)
+        .values(
+            [
+                {
+                    **get_python_defaults(StaffSubscriptionChat),
+                    "staff_id": staff_id,
+                    "visitor_id": visitor_id,
+                }
+                for visitor_id, staff_id in subscriptions.items()
+            ]
         )
+        .on_conflict_do_nothing()
+        .returning(StaffSubscriptionChat.staff_id)
+        .gino.all()
+    )
+
+    # Uncount the staffs already subscribed to the chats
+    staff_ids = list(subscriptions.values())
+    for (staff_id,) in inserted:
+        staff_ids.remove(staff_id)
+    await after_commit(change_volunteer_loads, staff_ids, -1)
+    await after_commit(bump_table_version, StaffSubscriptionChat.__tablename__)
 
 
 async def auto_reassign_staff_to_chat(visitor_id):
     """Remove all the current subscribed staffs, and add a new one."""
+    new_staffs = await auto_reassign_staffs_to_chats([visitor_id])
+    return new_staffs.get(visitor_id)
+
 
+async def auto_reassign_staffs_to_chats(visitor_ids):
+    """
+    Replace the subscribed staffs of the visitors' chats with a new one each,
+    in one transaction.
+
+    Return the new staff of each visitor.
+    """
     settings = await get_settings_from_cache()
-    if not settings.get("auto_reassign", 1):
-        return None
+    if not visitor_ids or not settings.get("auto_reassign", 1):
+        return {}
 
-    raw_current_staffs = await StaffSubscriptionChat.query.where(
-        StaffSubscriptionChat.visitor_id == visitor_id
-    ).gino.all()
-    current_staffs = {item.staff_id for item in raw_current_staffs}
-
-    all_volunteers = await cache.get("all_volunteers", namespace="staffs")
-    if not all_volunteers:
-        raw_volunteers = await User.query.where(
-            and_(User.role_id == ROLES.inverse["agent"], User.disabled == False)
-        ).gino.all()
-        volunteers = [serialize_to_dict(user) for user in raw_volunteers]
-        counter = 0
-        staff = volunteers[0]
-        while staff["id"] in current_staffs:
-            counter += 1
-            staff = volunteers[counter]
-        await cache.set(
-            "all_volunteers",
-            {"counter": counter + 1, "staffs": volunteers},
-            namespace="staffs",
+    current_staffs = {}
+    subscriptions = (
+        await db.select(
+            [StaffSubscriptionChat.visitor_id, StaffSubscriptionChat.staff_id]
         )
-    else:
-        counter = all_volunteers["counter"]
-        if counter >= len(all_volunteers["staffs"]):
-            counter = 0
-        staff = all_volunteers["staffs"][counter]
-        while staff["id"] in current_staffs:
-            counter += 1
-            if counter >= len(all_volunteers["staffs"]):
-                counter = 0
-            staff = all_volunteers["staffs"][counter]
-        await cache.set(
-            "all_volunteers",
-            {"counter": counter + 1, "staffs": all_volunteers["staffs"]},
-            namespace="staffs",
+        .where(StaffSubscriptionChat.visitor_id.in_(visitor_ids))
+        .gino.all()
+    )
+    for visitor_id, staff_id in subscriptions:
+        current_staffs.setdefault(visitor_id, []).append(staff_id)
+
+    async with unit_of_work():
+        # Pick the least loaded volunteers, other than the current staffs of a chat
+        picked_staff_ids = await pick_volunteers(
+            [current_staffs.get(visitor_id, ()) for visitor_id in visitor_ids],
+            fallback=True,
         )
-
-    # Remove all subscribed staffs for the visitor
-    await delete_many(StaffSubscriptionChat, visitor_id=visitor_id)
-
-    # Assign the chat to the staff
-    if staff:
-        await StaffSubscriptionChat.add_if_not_exists(
-            staff_id=staff["id"], visitor_id=visitor_id
+        if not picked_staff_ids:
+            # There are no volunteers
+            return {}
+
+        # Uncount the picked volunteers if their subscriptions are rolled back
+        await after_rollback(change_volunteer_loads, picked_staff_ids, -1)
+        new_staff_ids = dict(zip(visitor_ids, picked_staff_ids))
+        removed = (
+            await StaffSubscriptionChat.delete.where(
+                StaffSubscriptionChat.visitor_id.in_(visitor_ids)
+            )
+            .returning(StaffSubscriptionChat.staff_id)
+            .gino.all()
         )
-    return staff
+        await subscribe_picked_staffs(new_staff_ids)
+        await after_commit(
+            change_volunteer_loads, [staff_id for (staff_id,) in removed], -1
+        )
+
+    # Skip the staffs deleted in the meantime
+    staffs = await get_staffs_by_id(new_staff_ids.values())
+    return {
+        visitor_id: staffs[staff_id]
+        for visitor_id, staff_id in new_staff_ids.items()
+        if staff_id in staffs
+    }
 
 
 async def auto_assign_staff_to_chat(visitor_id, exclude_staff_id=None):
@@ -88,49 +119,12 @@ async def auto_assign_staff_to_chat(visitor_id, exclude_staff_id=None):
     if not settings.get("auto_assign", 1):
         return None
 
-    staff = None
-    all_volunteers = await cache.get("all_volunteers", namespace="staffs")
-    if not all_volunteers:
-        raw_volunteers = await User.query.where(
-            and_(User.role_id == ROLES.inverse["agent"], User.disabled == False)
-        ).gino.all()
-        volunteers = [serialize_to_dict(user) for user in raw_volunteers]
-        counter = 0
-
-        # If the org has no volunteers
-        if not volunteers:
-            return None
-        staff = volunteers[0]
-        while staff["id"] == exclude_staff_id:
-            counter += 1
-            staff = volunteers[counter]
-        await cache.set(
-            "all_volunteers",
-            {"counter": counter + 1, "staffs": volunteers},
-            namespace="staffs",
-        )
-    else:
-        counter = all_volunteers["counter"]
-        if not all_volunteers["staffs"]:
+    # Assign the chat to the staff
+    async with unit_of_work():
+        staff_id = await pick_volunteer([exclude_staff_id] if exclude_staff_id else ())
+        if staff_id is None:
             return None
 
-        if counter >= len(all_volunteers["staffs"]):
-            counter = 0
-        staff = all_volunteers["staffs"][counter]
-        while staff["id"] == exclude_staff_id:
-            counter += 1
-            if counter >= len(all_volunteers["staffs"]):
-                counter = 0
-            staff = all_volunteers["staffs"][counter]
-        await cache.set(
-            "all_volunteers",
-            {"counter": counter + 1, "staffs": all_volunteers["staffs"]},
-            namespace="staffs",
-        )
-
-    # Assign the chat to the staff
-    if staff:
-        await StaffSubscriptionChat.add_if_not_exists(
-            staff_id=staff["id"], visitor_id=visitor_id
-        )
-    return staff
+        await after_rollback(change_volunteer_loads, [staff_id], -1)
+        await subscribe_picked_staffs({visitor_id: staff_id})
+    return await User.get(id=staff_id)
@@ -0,0 +1,93 @@
+"""
+The serialization of the values in the cache.
+
+The values of the binary namespaces are stored as msgpack,
+prefixed by a version byte of their format, so that the format can evolve,
+or as JSON if msgpack can't pack them.
+The other values are stored as JSON, as the values changed by Lua scripts
+(e.g. the counters) must stay readable by Redis.
+
+Both formats are read in every namespace, so the values can be moved
+from one format to the other without clearing the cache.
+"""
+from aiocache import RedisCache
+from aiocache.serializers import BaseSerializer
+
+from ora_backend.utils import fast_json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# The version bytes of the binary formats, which never start a JSON text
+MSGPACK_V1 = b"\x01"
+
+
+class CacheSerializer(BaseSerializer):
+    # Read the values as bytes, to tell the formats apart
+    DEFAULT_ENCODING = None
+
+    def __init__(self, *args, binary=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Without msgpack, the values are stored as JSON
+        self.binary = binary and msgpack is not None
+
+    def dumps(self, value):
+        if self.binary:
+            try:
+                return MSGPACK_V1 + msgpack.packb(value, use_bin_type=True)
+            except (OverflowError, TypeError, ValueError):
+                # e.g. the integers larger than 64 bits
+                pass
+        return fast_json.dumps(value)
+
+    def loads(self, value):
+        if value is None:
+            return None
+        if value[:1] == MSGPACK_V1:
+            return msgpack.unpackb(value[1:], raw=False, strict_map_key=False)
+        return fast_json.loads(value)
+
+
+class NamespacedRedisCache(RedisCache):
+    """A `RedisCache` storing the values of the `binary_namespaces` as msgpack."""
+
+    def __init__(self, *args, binary_namespaces=(), **kwargs):
+        super().__init__(*args, serializer=CacheSerializer(), **kwargs)
+        self.binary_namespaces = frozenset(binary_namespaces)
+        self.binary_serializer = CacheSerializer(binary=True)
+
+    def _get_dumps_fn(self, dumps_fn, namespace):
+        if dumps_fn is None and namespace in self.binary_namespaces:
+            return self.binary_serializer.dumps
+        return dumps_fn
+
+    async def add(self, key, value, *args, dumps_fn=None, namespace=None, **kwargs):
+        return await super().add(
+            key,
+            value,
+            *args,
+            dumps_fn=self._get_dumps_fn(dumps_fn, namespace),
+            namespace=namespace,
+            **kwargs,
+        )
+
+    async def set(self, key, value, *args, dumps_fn=None, namespace=None, **kwargs):
+        return await super().set(
+            key,
+            value,
+            *args,
+            dumps_fn=self._get_dumps_fn(dumps_fn, namespace),
+            namespace=namespace,
+            **kwargs,
+        )
+
+    async def multi_set(self, pairs, *args, dumps_fn=None, namespace=None, **kwargs):
+        return await super().multi_set(
+            pairs,
+            *args,
+            dumps_fn=self._get_dumps_fn(dumps_fn, namespace),
+            namespace=namespace,
+            **kwargs,
+        )
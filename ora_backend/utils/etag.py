@@ -0,0 +1,82 @@
+"""
+The conditional GET requests of the routes whose responses rarely change.
+
+A route decorated by `conditional_get` tags its responses with a strong ETag,
+computed from a cheap version stamp of the response instead of its content.
+A request whose `If-None-Match` has the current ETag is answered with
+a 304 Not Modified, before running the route (and its queries).
+"""
+from functools import partial, wraps
+from hashlib import blake2b
+
+from sanic.response import HTTPResponse
+
+from ora_backend.utils.versions import get_table_versions
+
+
+def compute_etag(*parts):
+    """Return a strong ETag of the parts, e.g. the URL and the version stamp."""
+    digest = blake2b(repr(parts).encode("utf-8"), digest_size=16).hexdigest()
+    return '"{}"'.format(digest)
+
+
+def etag_matches(if_none_match, etag):
+    """Whether the `If-None-Match` header has the ETag (with a weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().replace("W/", "", 1) == etag for tag in if_none_match.split(",")
+    )
+
+
+def table_versions(*tables):
+    """Return a `get_version` of `conditional_get`, from the versions of the tables."""
+
+    async def get_version(request, *args, **kwargs):
+        return await get_table_versions(*tables)
+
+    return get_version
+
+
+def conditional_get(func=None, get_version=None):
+    """
+    Answer the GET requests with a 304 if the client has the current response.
+
+    Kwargs:
+        get_version (coroutine function):
+            Called with the arguments of the route, it returns the version stamp
+            of the response, which changes whenever the response changes
+            (e.g. `table_versions(...)`). If None is returned,
+            the response is not tagged, e.g. for the pages still changing.
+
+    The ETag also covers the URL (with its query string) and the requester,
+    so this decorator goes under `validate_permission`.
+    """
+    if func is None:
+        return partial(conditional_get, get_version=get_version)
+
+    @wraps(func)
+    async def inner(request, *args, **kwargs):
+        if request.method != "GET":
+            return await func(request, *args, **kwargs)
+
+        version = await get_version(request, *args, **kwargs)
+        if version is None:
+            return await func(request, *args, **kwargs)
+
+        requester = kwargs.get("requester") or {}
+        etag = compute_etag(
+            request.path, request.query_string, requester.get("id"), version
+        )
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return HTTPResponse(status=304, headers=headers)
+
+        response = await func(request, *args, **kwargs)
+        if response.status == 200:
+            response.headers.update(headers)
+        return response
+
+    return inner
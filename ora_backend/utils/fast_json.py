@@ -0,0 +1,63 @@
+"""
+The JSON encoding of the HTTP responses, the Socket.IO packets and the cache.
+
+It uses the fastest installed library: `orjson`, then `ujson`,
+then the standard library.
+This module has `dumps()` and `loads()` compatible with the standard library's,
+so it can be given as the `json` module of `socketio.AsyncServer`.
+"""
+import json as _json
+
+from sanic.response import json as _json_response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+# The options of the standard library, which the faster libraries ignore
+_compact_separators = (",", ":")
+
+
+def _stdlib_dumps(obj, **kwargs):
+    kwargs.setdefault("separators", _compact_separators)
+    return _json.dumps(obj, **kwargs)
+
+
+if orjson is not None:
+    JSON_LIBRARY = "orjson"
+
+    def dumps(obj, **kwargs) -> str:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            # e.g. the integers larger than 64 bits
+            return _stdlib_dumps(obj, **kwargs)
+
+    loads = orjson.loads
+
+elif ujson is not None:
+    JSON_LIBRARY = "ujson"
+
+    def dumps(obj, **kwargs) -> str:
+        try:
+            return ujson.dumps(obj, ensure_ascii=False)
+        except (OverflowError, TypeError):
+            return _stdlib_dumps(obj, **kwargs)
+
+    loads = ujson.loads
+
+else:
+    JSON_LIBRARY = "json"
+    dumps = _stdlib_dumps
+    loads = _json.loads
+
+
+def json(body, status=200, headers=None, **kwargs):
+    """`sanic.response.json()`, encoded by `dumps()`."""
+    return _json_response(body, status=status, headers=headers, dumps=dumps, **kwargs)
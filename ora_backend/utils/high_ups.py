@@ -0,0 +1,52 @@
+from ora_backend import cache, db
+from ora_backend.constants import CACHE_HIGH_UPS, CACHE_HIGH_UPS_NAMESPACE, ROLES
+
+# The supervisors and admins, with whether they receive emails
+# (the staffs without a notification setting receive them by default)
+high_ups_query = db.text(
+    """
+    SELECT
+        "user".id,
+        "user".email,
+        "user".role_id,
+        "user".disabled,
+        BOOL_OR(COALESCE(staff_notification_setting.receive_emails, TRUE))
+    FROM "user"
+    LEFT OUTER JOIN staff_notification_setting
+        ON staff_notification_setting.staff_id = "user".id
+    WHERE "user".role_id < :agent_role_id
+    GROUP BY "user".internal_id
+    ORDER BY "user".internal_id;
+    """
+)
+
+HIGH_UP_FIELDS = ("id", "email", "role_id", "disabled", "receive_emails")
+
+# Bound how long a directory read concurrently with its invalidation stays cached
+HIGH_UPS_CACHE_TTL = 10 * 60  # Seconds
+
+
+async def get_high_ups():
+    """
+    Return the supervisors and admins, from the cache.
+
+    The cache is invalidated whenever a staff or a notification setting changes.
+    """
+    high_ups = await cache.get(CACHE_HIGH_UPS, namespace=CACHE_HIGH_UPS_NAMESPACE)
+    if high_ups is None:
+        data = (
+            await db.status(high_ups_query, {"agent_role_id": ROLES.inverse["agent"]})
+        )[1]
+        high_ups = [dict(zip(HIGH_UP_FIELDS, row)) for row in data]
+        await cache.set(
+            CACHE_HIGH_UPS,
+            high_ups,
+            ttl=HIGH_UPS_CACHE_TTL,
+            namespace=CACHE_HIGH_UPS_NAMESPACE,
+        )
+
+    return high_ups
+
+
+async def invalidate_high_ups():
+    await cache.delete(CACHE_HIGH_UPS, namespace=CACHE_HIGH_UPS_NAMESPACE)
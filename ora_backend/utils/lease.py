@@ -0,0 +1,69 @@
+from contextlib import asynccontextmanager
+from uuid import uuid4
+
+from ora_backend import cache
+
+# Take the lease if it is free, or extend it if it is already held by this holder
+ACQUIRE_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if holder == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if not holder then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class LeaseLock:
+    """
+    A lock in Redis held by one process at a time, for `lease` seconds.
+
+    The holder keeps the lock by acquiring it again before the lease expires,
+    and the other processes take it over once it expires.
+    """
+
+    def __init__(self, key, *, lease, namespace="leases"):
+        self.key = cache.build_key(key, namespace=namespace)
+        self.lease = lease
+        self.token = uuid4().hex
+
+    async def acquire(self) -> bool:
+        """Return whether this process holds the lock."""
+        acquired = await cache.raw(
+            "eval",
+            ACQUIRE_SCRIPT,
+            [self.key],
+            [self.token, int(self.lease * 1000)],
+        )
+        return bool(acquired)
+
+    async def release(self) -> bool:
+        released = await cache.raw("eval", RELEASE_SCRIPT, [self.key], [self.token])
+        return bool(released)
+
+    @asynccontextmanager
+    async def hold(self):
+        """
+        Yield whether this process holds the lock.
+
+        The lock is released if the block raises,
+        so that another process takes it over on its next run.
+        """
+        held = await self.acquire()
+        try:
+            yield held
+        except Exception:
+            if held:
+                await self.release()
+            raise
@@ -0,0 +1,92 @@
+from ora_backend import cache, db
+from ora_backend.constants import CACHE_UNREAD_NOTIFICATIONS
+
+# Only increment the counters already in the cache,
+# as the missing ones are counted from the db on their next read
+INCREMENT_EXISTING_COUNTERS_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 then
+        redis.call('INCRBY', key, ARGV[i])
+    end
+end
+return 0
+"""
+
+# The number of unread notifications of every staff who has read them before
+unread_notifications_counts_query = db.text(
+    """
+    SELECT
+        notification_staff_read.staff_id,
+        COUNT(notification_staff.internal_id)
+    FROM notification_staff_read
+    LEFT JOIN notification_staff
+        ON notification_staff.staff_id = notification_staff_read.staff_id
+        AND (
+            notification_staff_read.last_read_internal_id IS NULL
+            OR notification_staff.internal_id
+                > notification_staff_read.last_read_internal_id
+        )
+    GROUP BY notification_staff_read.staff_id;
+    """
+)
+
+
+async def get_unread_count(staff_id):
+    """Return the cached number of unread notifications of a staff, or None."""
+    return await cache.get(staff_id, namespace=CACHE_UNREAD_NOTIFICATIONS)
+
+
+async def get_unread_counts(staff_ids):
+    """Return the cached numbers of unread notifications of the staffs, if any."""
+    counts = await cache.multi_get(staff_ids, namespace=CACHE_UNREAD_NOTIFICATIONS)
+    return {
+        staff_id: count
+        for staff_id, count in zip(staff_ids, counts)
+        if count is not None
+    }
+
+
+async def set_unread_count(staff_id, count: int):
+    await cache.set(staff_id, count, namespace=CACHE_UNREAD_NOTIFICATIONS)
+
+
+async def set_unread_counts(counts: dict):
+    if counts:
+        await cache.multi_set(
+            list(counts.items()), namespace=CACHE_UNREAD_NOTIFICATIONS
+        )
+
+
+async def reset_unread_count(staff_id):
+    await set_unread_count(staff_id, 0)
+
+
+async def increment_unread_counts(staff_ids):
+    """Increment the cached counters of the staffs, once per occurrence."""
+    deltas = {}
+    for staff_id in staff_ids:
+        deltas[staff_id] = deltas.get(staff_id, 0) + 1
+    if not deltas:
+        return
+
+    await cache.raw(
+        "eval",
+        INCREMENT_EXISTING_COUNTERS_SCRIPT,
+        [
+            cache.build_key(staff_id, namespace=CACHE_UNREAD_NOTIFICATIONS)
+            for staff_id in deltas
+        ],
+        list(deltas.values()),
+    )
+
+
+async def reconcile_unread_counts():
+    """
+    Overwrite the cached counters with the numbers of unread notifications in the db,
+    to correct the increments lost in between a counter's read and its reset.
+
+    Return the number of reconciled counters.
+    """
+    counts = (await db.status(unread_notifications_counts_query))[1]
+    await set_unread_counts(dict(counts))
+    return len(counts)
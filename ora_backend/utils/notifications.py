@@ -1,12 +1,11 @@
-from ora_backend.constants import ROLES
-from ora_backend.models import User, NotificationStaff
+from ora_backend.models import NotificationStaff
+from ora_backend.utils.high_ups import get_high_ups
 
 
 async def send_notifications_to_all_high_ups(content: dict):
-    all_high_ups_users = await User.query.where(
-        User.role_id < ROLES.inverse["agent"]
-    ).gino.all()
+    """Return the created notifications."""
     notifications = [
-        {"staff_id": user.id, "content": content} for user in all_high_ups_users
+        {"staff_id": high_up["id"], "content": content}
+        for high_up in await get_high_ups()
     ]
-    await NotificationStaff.bulk_upsert(notifications)
+    return await NotificationStaff.bulk_upsert(notifications)
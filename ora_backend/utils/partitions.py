@@ -0,0 +1,167 @@
+from datetime import datetime, timezone
+from time import time
+
+from ora_backend import db
+from ora_backend.config.db import CHAT_MESSAGE_PARTITIONS_AHEAD
+
+# `chat_message` is partitioned by month, on `created_at` (in miliseconds)
+PARTITIONED_TABLE = "chat_message"
+DEFAULT_PARTITION = "chat_message_default"
+
+partition_exists_query = db.text("SELECT to_regclass(:name) IS NOT NULL;")
+
+# Serialize the changes of the partitions between the workers, until the commit
+lock_partitions_query = db.text(
+    "SELECT pg_advisory_xact_lock(hashtext('{}'));".format(PARTITIONED_TABLE)
+)
+
+create_default_partition_query = db.text(
+    "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT;".format(
+        DEFAULT_PARTITION, PARTITIONED_TABLE
+    )
+)
+
+default_partition_has_rows_query = db.text(
+    """
+    SELECT EXISTS (
+        SELECT 1
+        FROM {}
+        WHERE created_at >= :start AND created_at < :end
+    );
+    """.format(
+        DEFAULT_PARTITION
+    )
+)
+
+
+def get_month_start(timestamp: int) -> datetime:
+    """Return the start of the month (in UTC) of a timestamp in miliseconds."""
+    date = datetime.fromtimestamp(timestamp / 1000, tz=timezone.utc)
+    return date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month_start: datetime, months: int) -> datetime:
+    month_index = month_start.month - 1 + months
+    return month_start.replace(
+        year=month_start.year + month_index // 12, month=month_index % 12 + 1
+    )
+
+
+def to_timestamp(date: datetime) -> int:
+    return int(date.timestamp() * 1000)
+
+
+def get_partition_name(month_start: datetime) -> str:
+    return "{}_y{:04d}m{:02d}".format(
+        PARTITIONED_TABLE, month_start.year, month_start.month
+    )
+
+
+def get_partition_bounds(month_start: datetime):
+    """Return the `FROM` (inclusive) and `TO` (exclusive) bounds of a partition."""
+    return to_timestamp(month_start), to_timestamp(add_months(month_start, 1))
+
+
+def get_recent_messages_lower_bound(months: int) -> int:
+    """
+    Return the start of the month, `months` months ago (in miliseconds).
+
+    Use it as a lower bound on `chat_message.created_at`,
+    so that Postgres only scans the partitions of the recent months.
+    """
+    month_start = get_month_start(int(time() * 1000))
+    return to_timestamp(add_months(month_start, -months))
+
+
+async def create_chat_message_partition(month_start: datetime) -> bool:
+    """
+    Create the partition of `chat_message` for a month.
+
+    Return False if the partition already exists.
+    """
+    name = get_partition_name(month_start)
+    if await db.scalar(partition_exists_query, name=name):
+        return False
+
+    start, end = get_partition_bounds(month_start)
+    create_partition_query = db.text(
+        "CREATE TABLE IF NOT EXISTS {} PARTITION OF {} "
+        "FOR VALUES FROM ({}) TO ({});".format(name, PARTITIONED_TABLE, start, end)
+    )
+
+    async with db.transaction():
+        # Another worker may have created it in the meantime
+        await db.scalar(lock_partitions_query)
+        if await db.scalar(partition_exists_query, name=name):
+            return False
+
+        # The messages of a month without a partition are stored in the default one,
+        # which must not have any rows of the new partition's range
+        has_rows = await db.scalar(
+            default_partition_has_rows_query, start=start, end=end
+        )
+        if not has_rows:
+            await db.status(create_partition_query)
+            return True
+
+        # Move the rows to the new partition
+        await db.status(
+            db.text(
+                "ALTER TABLE {} DETACH PARTITION {};".format(
+                    PARTITIONED_TABLE, DEFAULT_PARTITION
+                )
+            )
+        )
+        await db.status(create_partition_query)
+        await db.status(
+            db.text(
+                """
+                WITH moved_rows AS (
+                    DELETE FROM {}
+                    WHERE created_at >= :start AND created_at < :end
+                    RETURNING *
+                )
+                INSERT INTO {} SELECT * FROM moved_rows;
+                """.format(
+                    DEFAULT_PARTITION, name
+                )
+            ),
+            start=start,
+            end=end,
+        )
+        await db.status(
+            db.text(
+                "ALTER TABLE {} ATTACH PARTITION {} DEFAULT;".format(
+                    PARTITIONED_TABLE, DEFAULT_PARTITION
+                )
+            )
+        )
+
+    return True
+
+
+async def create_chat_message_partitions(
+    *, since: int = None, months_ahead=CHAT_MESSAGE_PARTITIONS_AHEAD
+):
+    """
+    Create the missing partitions of `chat_message`,
+    from the month of `since` (default: the current month)
+    to `months_ahead` months after the current month.
+
+    Return the names of the created partitions.
+    """
+    async with db.transaction():
+        await db.scalar(lock_partitions_query)
+        await db.status(create_default_partition_query)
+
+    current_month = get_month_start(int(time() * 1000))
+    month_start = get_month_start(since) if since is not None else current_month
+    last_month = add_months(current_month, months_ahead)
+
+    created = []
+    while month_start <= last_month:
+        if await create_chat_message_partition(month_start):
+            created.append(get_partition_name(month_start))
+        month_start = add_months(month_start, 1)
+
+    return created
@@ -1,11 +1,16 @@
+from functools import lru_cache
+from time import time
 from typing import Tuple
 from itertools import chain
 
 from asyncpg.exceptions import UniqueViolationError
-from sqlalchemy import and_, desc, func
+from sqlalchemy import and_, bindparam, desc, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.util import LRUCache
 from collections.abc import Iterable
 from ora_backend import db
-from ora_backend.constants import DEFAULT_SEVERITY_LEVEL_OF_CHAT
+from ora_backend.config.db import COMPILED_CACHE_SIZE
+from ora_backend.constants import DEFAULT_SEVERITY_LEVEL_OF_CHAT, ROLES
 from ora_backend.exceptions import UniqueViolationError as DuplicatedError
 from ora_backend.schemas import (
     CHAT_MESSAGE_READ_SCHEMA,
@@ -15,7 +20,19 @@ from ora_backend.schemas import (
     BOOKMARK_VISITOR_READ_SCHEMA,
     CHAT_READ_SCHEMA,
 )
+from ora_backend.utils.archive import get_archived_message, get_archived_messages
 from ora_backend.utils.exceptions import raise_not_found_exception
+from ora_backend.utils.high_ups import get_high_ups
+from ora_backend.utils.notification_counters import (
+    get_unread_count,
+    get_unread_counts,
+    set_unread_count,
+    set_unread_counts,
+)
+from ora_backend.utils.partitions import get_recent_messages_lower_bound
+from ora_backend.utils.replica import read_all, read_status
+from ora_backend.utils.row_mapper import RowMapper
+from ora_backend.utils.statements import Statements
 from ora_backend.utils.transaction import in_transaction
 
 
@@ -63,6 +80,21 @@ bookmark_fields = [
 ]
 
 
+def get_field_alias(field: str):
+    """Return the alias of a selected field, e.g. "chat.id AS chat_id" -> "chat_id"."""
+    return field.split("AS")[1].strip()
+
+
+# Map the rows of the raw-SQL queries into dicts
+user_mapper = RowMapper((None, user_fields))
+visitor_mapper = RowMapper((None, visitor_fields))
+chat_and_visitor_mapper = RowMapper((None, chat_fields), (None, visitor_fields))
+message_mapper = RowMapper((None, message_fields), ("sender", user_fields, "sender"))
+
+# The message fields always selected, as the pagination links are built from them
+required_message_fields = {"id", "sequence_num"}
+
+
 def dict_to_filter_args(model, **kwargs):
     """
     Convert a dictionary to Gino/SQLAlchemy's conditions for filtering.
@@ -87,14 +119,103 @@ def dict_to_filter_args(model, **kwargs):
     return (getattr(model, k) == v for k, v in kwargs.items())
 
 
-async def get_one(model, **kwargs):
+# The queries built by `get_one` and `get_many`, keyed by their shapes
+# The values are passed as bind params, so the same query object is re-used
+# and its compiled SQL is cached
+_cached_queries = LRUCache(COMPILED_CACHE_SIZE)
+
+# The latest page of a chat's messages is first looked up
+# in the partitions of the current and previous months
+LATEST_MESSAGES_MONTHS = 1
+
+
+def get_filter_shape(**kwargs):
+    """Return the filtered columns, and whether their values are None."""
+    return tuple(sorted((key, value is None) for key, value in kwargs.items()))
+
+
+def filter_shape_to_args(model, filter_shape):
+    """
+    Similar to `dict_to_filter_args()`,
+    but the values are bind params named `eq_<column>`.
+    """
     return (
-        await model.query.where(and_(*dict_to_filter_args(model, **kwargs)))
-        .limit(1)
-        .gino.first()
+        getattr(model, key).is_(None)
+        if is_none
+        else getattr(model, key) == bindparam("eq_" + key)
+        for key, is_none in filter_shape
     )
 
 
+def get_filter_params(**kwargs):
+    return {"eq_" + key: value for key, value in kwargs.items() if value is not None}
+
+
+async def get_one(model, columns=None, **kwargs):
+    filter_shape = get_filter_shape(**kwargs)
+    columns = tuple(columns) if columns else None
+    cache_key = ("get_one", model, columns, filter_shape)
+    query = _cached_queries.get(cache_key)
+    if query is None:
+        # Get certain columns only, as a raw record
+        if columns:
+            query = db.select([*(getattr(model, column) for column in columns)])
+        else:
+            query = model.query
+        query = query.where(and_(*filter_shape_to_args(model, filter_shape))).limit(1)
+        _cached_queries[cache_key] = query
+
+    return await query.gino.first(**get_filter_params(**kwargs))
+
+
+def build_many_query(
+    model,
+    columns,
+    filter_shape,
+    before_last_internal_id,
+    in_column,
+    not_in_column,
+    order_by,
+    decrease,
+    return_model=True,
+):
+    # Get certain columns only
+    if columns:
+        query = db.select([*(getattr(model, column) for column in columns)])
+    else:
+        query = model.query
+
+    query = query.where(
+        and_(
+            *filter_shape_to_args(model, filter_shape),
+            model.internal_id < bindparam("last_internal_id")
+            if before_last_internal_id
+            else model.internal_id > bindparam("last_internal_id"),
+            getattr(model, in_column).in_(bindparam("in_values", expanding=True))
+            if in_column
+            else True,
+            getattr(model, not_in_column).notin_(
+                bindparam("not_in_values", expanding=True)
+            )
+            if not_in_column
+            else True,
+        )
+    )
+
+    query = (
+        query.order_by(
+            desc(getattr(model, order_by)) if decrease else getattr(model, order_by)
+        )
+        .limit(bindparam("limit", type_=db.Integer))
+        .offset(bindparam("offset", type_=db.Integer))
+    )
+
+    # Return the raw records, without loading them into the models
+    if not return_model:
+        query = query.execution_options(return_model=False)
+    return query
+
+
 async def get_many(
     model,
     columns=None,
@@ -107,47 +228,51 @@ async def get_many(
     order_by="internal_id",
     decrease=False,
     offset=0,
+    return_model=True,
     **kwargs,
 ):
     # Get the `internal_id` value from the starting row
     # And use it to query the next page of results
     last_internal_id = 0
     if after_id:
-        row_of_after_id = await model.query.where(model.id == after_id).gino.first()
+        row_of_after_id = await get_one(model, id=after_id)
         if not row_of_after_id:
             raise_not_found_exception(model, **kwargs)
 
         last_internal_id = row_of_after_id.internal_id
 
-    # Get certain columns only
-    if columns:
-        query = db.select([*(getattr(model, column) for column in columns)])
+    params = {
+        **get_filter_params(**kwargs),
+        "last_internal_id": last_internal_id,
+        "limit": limit,
+        "offset": offset,
+    }
+    if in_column and isinstance(in_values, Iterable):
+        params["in_values"] = list(in_values)
     else:
-        query = model.query
-
-    query = query.where(
-        and_(
-            *dict_to_filter_args(model, **kwargs),
-            model.internal_id < last_internal_id
-            if decrease and last_internal_id
-            else model.internal_id > last_internal_id,
-            getattr(model, in_column).in_(in_values)
-            if in_column and isinstance(in_values, Iterable)
-            else True,
-            getattr(model, not_in_column).notin_(not_in_values)
-            if not_in_column and isinstance(not_in_values, Iterable)
-            else True,
-        )
+        in_column = None
+    if not_in_column and isinstance(not_in_values, Iterable):
+        params["not_in_values"] = list(not_in_values)
+    else:
+        not_in_column = None
+
+    query_shape = (
+        model,
+        tuple(columns) if columns else None,
+        get_filter_shape(**kwargs),
+        bool(decrease and last_internal_id),
+        in_column,
+        not_in_column,
+        order_by,
+        decrease,
+        return_model,
     )
+    cache_key = ("get_many", *query_shape)
+    query = _cached_queries.get(cache_key)
+    if query is None:
+        query = _cached_queries[cache_key] = build_many_query(*query_shape)
 
-    return (
-        await query.order_by(
-            desc(getattr(model, order_by)) if decrease else getattr(model, order_by)
-        )
-        .limit(limit)
-        .offset(offset)
-        .gino.all()
-    )
+    return await query.gino.all(**params)
 
 
 async def get_flagged_chats_of_online_visitors(
@@ -189,23 +314,25 @@ async def get_flagged_chats_of_online_visitors(
         .gino.all()
     )
 
-    result = []
-    # Parse the message and sender
-    for row in data:
-        room = {}
-        index = 0
-        for key in chat_fields:
-            room[key] = row[index]
-            index += 1
-
-        visitor = {}
-        for key in visitor_fields:
-            visitor[key] = row[index]
-            index += 1
-
-        # result.append({"room": room, "user": visitor})
-        result.append({**room, **visitor})
-    return result
+    # Parse the chat and visitor
+    return chat_and_visitor_mapper(data)
+
+
+@lru_cache(maxsize=None)
+def get_message_projection(fields=None):
+    """
+    Return the message fields to select for the `fields` (a frozenset, or None for all),
+    whether their senders are joined, and the mapper of their rows.
+    """
+    if fields is None:
+        return tuple(message_fields), True, message_mapper
+
+    keys = tuple(
+        key for key in message_fields if key in fields or key in required_message_fields
+    )
+    if "sender" in fields:
+        return keys, True, RowMapper((None, keys), ("sender", user_fields, "sender"))
+    return keys, False, RowMapper((None, keys))
 
 
 async def get_messages(
@@ -217,62 +344,139 @@ async def get_messages(
     after_id=None,
     limit=15,
     exclude=True,
+    archive_model=None,
+    fields=None,
     **kwargs,
 ):
-    # Join the tables to extract the user's info
-    query = db.select(
-        [
-            *(getattr(model, key) for key in message_fields),
-            *(getattr(user, key) for key in user_fields),
-        ]
-    ).select_from(model.outerjoin(user, model.sender == user.id))
+    """
+    Return a page of the messages of a chat, ordered by `sequence_num`.
+
+    If `archive_model` is given, the page is completed with the archived messages
+    (refer to `ora_backend/utils/archive.py`), which are older than the live ones.
+
+    If `fields` are given, only their columns are selected (with the `id` and
+    `sequence_num`), and the senders are only joined if "sender" is one of them.
+    """
+    keys, with_sender, mapper = get_message_projection(
+        # Ignore the unknown fields, which would otherwise fill the cache
+        frozenset(fields).intersection(message_fields) if fields else None
+    )
+    columns = [getattr(model, key) for key in keys]
+    if with_sender:
+        # Join the tables to extract the user's info
+        query = db.select(
+            [*columns, *(getattr(user, key) for key in user_fields)]
+        ).select_from(model.outerjoin(user, model.sender == user.id))
+    else:
+        query = db.select(columns)
 
     # Get the `before_id` value from the starting row
     # And use it to query the next page of results
+    filters = [model.chat_id == chat_id, *dict_to_filter_args(model, **kwargs)]
+    archived_cursor = None
     if before_id or after_id:
         row_id = before_id or after_id
-        row_of_before_id = await model.query.where(model.id == row_id).gino.first()
-        if not row_of_before_id:
+        row_of_before_id = await get_one(model, id=row_id)
+        if not row_of_before_id and archive_model is not None:
+            archived_cursor = await get_archived_message(archive_model, chat_id, row_id)
+        if not row_of_before_id and not archived_cursor:
             raise_not_found_exception(model, **kwargs)
 
-        last_sequence_num = row_of_before_id.sequence_num
-        if after_id:
-            query = query.where(
-                and_(
-                    model.chat_id == chat_id,
-                    *dict_to_filter_args(model, **kwargs),
-                    model.sequence_num > last_sequence_num
-                    if exclude
-                    else model.sequence_num >= last_sequence_num,
+        if archived_cursor:
+            last_sequence_num = archived_cursor["sequence_num"]
+        else:
+            # The messages of a chat are created in the order of `sequence_num`,
+            # so bounding `created_at` lets Postgres skip the other monthly partitions
+            last_sequence_num = row_of_before_id.sequence_num
+            last_created_at = row_of_before_id.created_at
+            if after_id:
+                filters.extend(
+                    [
+                        model.sequence_num > last_sequence_num
+                        if exclude
+                        else model.sequence_num >= last_sequence_num,
+                        model.created_at >= last_created_at,
+                    ]
+                )
+            else:  # before_id
+                filters.extend(
+                    [
+                        model.sequence_num < last_sequence_num
+                        if exclude
+                        else model.sequence_num <= last_sequence_num,
+                        model.created_at <= last_created_at,
+                    ]
                 )
+
+    data = []
+    archived_messages = []
+    if archived_cursor:
+        # All the live messages are after the archived ones
+        if after_id:
+            archived_messages = await get_archived_messages(
+                archive_model,
+                chat_id,
+                limit=limit,
+                after=last_sequence_num,
+                inclusive=not exclude,
+                filters=kwargs,
             )
-        else:  # before_id
-            query = query.where(
-                and_(
-                    model.chat_id == chat_id,
-                    *dict_to_filter_args(model, **kwargs),
-                    model.sequence_num < last_sequence_num
-                    if exclude
-                    else model.sequence_num <= last_sequence_num,
+            if len(archived_messages) < limit:
+                data = (
+                    await query.where(and_(*filters))
+                    .order_by(model.sequence_num, model.created_at)
+                    .limit(limit - len(archived_messages))
+                    .gino.all()
                 )
+        else:  # before_id
+            archived_messages = await get_archived_messages(
+                archive_model,
+                chat_id,
+                limit=limit,
+                before=last_sequence_num,
+                inclusive=not exclude,
+                filters=kwargs,
             )
-    else:
-        query = query.where(
-            and_(model.chat_id == chat_id, *dict_to_filter_args(model, **kwargs))
-        )
-
-    if after_id:
-        data = (
-            await query.order_by(model.sequence_num, model.created_at)
-            .limit(limit)
-            .gino.all()
+    elif after_id:
+        query = query.where(and_(*filters)).order_by(
+            model.sequence_num, model.created_at
         )
+        data = await query.limit(limit).gino.all()
     else:
-        data = (
-            await query.order_by(desc(model.sequence_num), desc(model.created_at))
-            .limit(limit)
-            .gino.all()
-        )[::-1]
+        query = query.order_by(desc(model.sequence_num), desc(model.created_at))
+        if not before_id:
+            # Look for the latest messages in the recent partitions first
+            data = (
+                await query.where(
+                    and_(
+                        *filters,
+                        model.created_at
+                        >= get_recent_messages_lower_bound(LATEST_MESSAGES_MONTHS),
+                    )
+                )
+                .limit(limit)
+                .gino.all()
+            )
+        if len(data) < limit:
+            data = await query.where(and_(*filters)).limit(limit).gino.all()
+        data = data[::-1]
+
+        # Read through to the archive when paging past the oldest live message
+        if archive_model is not None and len(data) < limit:
+            if data:
+                before, inclusive = data[0][keys.index("sequence_num")], False
+            elif before_id:
+                before, inclusive = last_sequence_num, not exclude
+            else:
+                before, inclusive = None, False
+            archived_messages = await get_archived_messages(
+                archive_model,
+                chat_id,
+                limit=limit - len(data),
+                before=before,
+                inclusive=inclusive,
+                filters=kwargs,
+            )
     """
     result = await db.select([
         ChatMessage.sequence_num,
@@ -281,53 +485,56 @@ async def get_messages(
         User.full_name,
     ]).select_from(ChatMessage.join(User, ChatMessage.sender == User.id)).gino.all()
     """
-    result = []
+    if with_sender:
+        result = await parse_archived_messages(user, archived_messages)
+    else:
+        result = archived_messages
+    if fields:
+        # The archived messages have all the fields
+        result = [{key: message[key] for key in keys} for message in result]
+
     # Parse the message and sender
-    for row in data:
-        message = {}
-        sender = None
-        index = 0
-        for key in message_fields:
-            message[key] = row[index]
-            index += 1
+    result.extend(mapper(data))
+    return result
 
-        if message["sender"]:
-            sender = {}
-            for key in user_fields:
-                sender[key] = row[index]
-                index += 1
 
-        result.append({**message, "sender": sender})
+async def parse_archived_messages(user, messages: list):
+    """Add the senders' info to the archived messages, as in `get_messages`."""
+    sender_ids = {message["sender"] for message in messages if message["sender"]}
+    senders = {}
+    if sender_ids:
+        rows = await (
+            db.select([getattr(user, key) for key in user_fields])
+            .where(user.id.in_(sender_ids))
+            .gino.all()
+        )
+        senders = {sender["id"]: sender for sender in user_mapper(rows)}
+
+    result = []
+    for message in messages:
+        sender = None
+        if message["sender"]:
+            # The sender is not a staff (e.g. a visitor)
+            sender = senders.get(message["sender"], {key: None for key in user_fields})
+        result.append(
+            {**{key: message[key] for key in message_fields}, "sender": sender}
+        )
 
     return result
 
 
 async def get_supervisor_emails_to_send_emails():
-    data = (
-        await db.status(
-            db.text(
-                """
-                SELECT DISTINCT temp.email
-                FROM (
-                	SELECT
-                		"user".email as email,
-                		CASE WHEN staff_notification_setting.receive_emails IS NULL THEN TRUE
-                			ELSE staff_notification_setting.receive_emails
-                		END
-                	FROM "user"
-                	LEFT OUTER JOIN staff_notification_setting
-                		ON staff_notification_setting.staff_id = "user".id
-                	WHERE
-                		"user".role_id = 2
-                        AND "user".disabled = FALSE
-                ) temp
-                WHERE temp.receive_emails = TRUE;
-                """
-            )
-        )
-    )[1]
+    """Return the emails of the enabled supervisors who receive emails."""
+    emails = {}
+    for high_up in await get_high_ups():
+        if (
+            high_up["role_id"] == ROLES.inverse["supervisor"]
+            and not high_up["disabled"]
+            and high_up["receive_emails"]
+        ):
+            emails[high_up["email"]] = True
 
-    return [row[0] for row in data]
+    return list(emails)
 
 
 async def get_bookmarked_visitors(
@@ -337,9 +544,7 @@ async def get_bookmarked_visitors(
     # And use it to query the next page of results
     last_internal_id = None
     if after_id:
-        row_of_after_id = await bookmark_model.query.where(
-            bookmark_model.visitor_id == after_id
-        ).gino.first()
+        row_of_after_id = await get_one(bookmark_model, visitor_id=after_id)
         if not row_of_after_id:
             raise_not_found_exception(bookmark_model, visitor_id=after_id)
 
@@ -368,46 +573,15 @@ async def get_bookmarked_visitors(
         )
         .order_by(desc(bookmark_model.internal_id))
         .limit(limit)
-        .gino.all()
     )
-    data = await query
+    data = await read_all(query)
 
-    result = []
     # Parse the visitor
-    for row in data:
-        visitor_info = {}
-        for key, val in zip(visitor_fields, row):
-            visitor_info[key] = val
-
-        result.append(visitor_info)
-
-    return result
+    return visitor_mapper(data)
 
 
-async def get_self_subscribed_visitors(
-    visitor_model,
-    chat_model,
-    subscription_model,
-    staff_id,
-    *,
-    exclude_unhandled=False,
-    limit=15,
-    after_id=None,
-    **kwargs,
-):
-    # Get the `internal_id` value from the starting row
-    # And use it to query the next page of results
-    last_internal_id = None
-    if after_id:
-        row_of_after_id = await subscription_model.query.where(
-            subscription_model.visitor_id == after_id
-        ).gino.first()
-        if not row_of_after_id:
-            raise_not_found_exception(subscription_model, visitor_id=after_id)
-
-        last_internal_id = row_of_after_id.internal_id
-
-    sql_query = """
+def build_self_subscribed_visitors_sql(has_last_internal_id, exclude_unhandled):
+    return """
         SELECT {}
         FROM visitor
         JOIN chat
@@ -423,9 +597,7 @@ async def get_self_subscribed_visitors(
         LIMIT :limit
     """.format(
         ", ".join(chat_fields_with_table_name + visitor_fields_with_table_name),
-        "AND visitor.internal_id < :last_internal_id"
-        if last_internal_id is not None
-        else "",
+        "AND visitor.internal_id < :last_internal_id" if has_last_internal_id else "",
         """AND NOT EXISTS (
             SELECT 1
             FROM chat_unhandled
@@ -436,9 +608,43 @@ async def get_self_subscribed_visitors(
         else "",
     )
 
+
+self_subscribed_visitors_statements = Statements(
+    build_self_subscribed_visitors_sql,
+    has_last_internal_id=(False, True),
+    exclude_unhandled=(False, True),
+)
+
+
+async def get_self_subscribed_visitors(
+    visitor_model,
+    chat_model,
+    subscription_model,
+    staff_id,
+    *,
+    exclude_unhandled=False,
+    limit=15,
+    after_id=None,
+    **kwargs,
+):
+    # Get the `internal_id` value from the starting row
+    # And use it to query the next page of results
+    last_internal_id = None
+    if after_id:
+        row_of_after_id = await get_one(subscription_model, visitor_id=after_id)
+        if not row_of_after_id:
+            raise_not_found_exception(subscription_model, visitor_id=after_id)
+
+        last_internal_id = row_of_after_id.internal_id
+
+    sql_query = self_subscribed_visitors_statements.get(
+        has_last_internal_id=last_internal_id is not None,
+        exclude_unhandled=bool(exclude_unhandled),
+    )
+
     data = (
-        await db.status(
-            db.text(sql_query),
+        await read_status(
+            sql_query,
             {
                 "staff_id": staff_id,
                 "limit": limit,
@@ -447,34 +653,33 @@ async def get_self_subscribed_visitors(
         )
     )[1]
 
-    result = []
     # Parse the visitor
-    for row in data:
-        visitor_info = {}
-        for key, val in zip(chat_fields + visitor_fields, row):
-            visitor_info[key] = val
-
-        result.append(visitor_info)
+    return chat_and_visitor_mapper(data)
+
+
+async def get_one_ordered(model, order_by, decrease, **kwargs):
+    filter_shape = get_filter_shape(**kwargs)
+    cache_key = ("get_one_ordered", model, filter_shape, order_by, decrease)
+    query = _cached_queries.get(cache_key)
+    if query is None:
+        query = (
+            model.query.where(and_(*filter_shape_to_args(model, filter_shape)))
+            .order_by(
+                desc(getattr(model, order_by)) if decrease else getattr(model, order_by)
+            )
+            .limit(1)
+        )
+        _cached_queries[cache_key] = query
 
-    return result
+    return await query.gino.first(**get_filter_params(**kwargs))
 
 
 async def get_one_latest(model, order_by="internal_id", **kwargs):
-    return (
-        await model.query.where(and_(*dict_to_filter_args(model, **kwargs)))
-        .order_by(desc(getattr(model, order_by)))
-        .limit(1)
-        .gino.first()
-    )
+    return await get_one_ordered(model, order_by, True, **kwargs)
 
 
 async def get_one_oldest(model, order_by="internal_id", **kwargs):
-    return (
-        await model.query.where(and_(*dict_to_filter_args(model, **kwargs)))
-        .order_by(getattr(model, order_by))
-        .limit(1)
-        .gino.first()
-    )
+    return await get_one_ordered(model, order_by, False, **kwargs)
 
 
 async def get_many_with_count_and_group_by(
@@ -495,8 +700,8 @@ async def get_many_with_count_and_group_by(
     )
 
 
-async def get_subscribed_staffs_for_visitor(visitor_id, **kwargs):
-    sql_query = """
+subscribed_staffs_query = db.text(
+    """
         WITH subscribed_staffs AS (
             SELECT
                 DISTINCT staff_subscription_chat.staff_id
@@ -516,31 +721,18 @@ async def get_subscribed_staffs_for_visitor(visitor_id, **kwargs):
     """.format(
         ", ".join(user_fields_with_table_name)
     )
+)
 
-    data = (await db.status(db.text(sql_query), {"visitor_id": visitor_id}))[1]
-
-    result = []
-    # Parse the users
-    for row in data:
-        visitor_data = {key: value for key, value in zip(user_fields, row)}
-        result.append(visitor_data)
-
-    return result
 
+async def get_subscribed_staffs_for_visitor(visitor_id, **kwargs):
+    data = (await db.status(subscribed_staffs_query, {"visitor_id": visitor_id}))[1]
 
-async def get_handled_chats(model, *, limit=15, after_id=None, **kwargs):
-    """Return all the chats excluding the unhandled ones"""
-    # Get the `internal_id` value from the starting row
-    # And use it to query the next page of results
-    last_internal_id = -1
-    if after_id:
-        row_of_after_id = await model.query.where(model.id == after_id).gino.first()
-        if not row_of_after_id:
-            raise_not_found_exception(model, visitor_id=after_id)
+    # Parse the users
+    return user_mapper(data)
 
-        last_internal_id = row_of_after_id.internal_id
 
-    sql_query = """
+def build_handled_chats_sql(has_last_internal_id):
+    return """
         SELECT {}
         FROM visitor
         JOIN chat
@@ -557,45 +749,50 @@ async def get_handled_chats(model, *, limit=15, after_id=None, **kwargs):
         LIMIT :limit
     """.format(
         ", ".join(chat_fields_with_table_name + visitor_fields_with_table_name),
-        "AND visitor.internal_id < :last_internal_id" if last_internal_id >= 0 else "",
+        "AND visitor.internal_id < :last_internal_id" if has_last_internal_id else "",
     )
 
-    data = (
-        await db.status(
-            db.text(sql_query), {"last_internal_id": last_internal_id, "limit": limit}
-        )
-    )[1]
-
-    result = []
-    # Parse the users
-    for row in data:
-        visitor_data = {
-            key: value for key, value in zip(chat_fields + visitor_fields, row)
-        }
-        result.append(visitor_data)
 
-    return result
+handled_chats_statements = Statements(
+    build_handled_chats_sql, has_last_internal_id=(False, True)
+)
 
 
-async def get_staff_unhandled_visitors(
-    model, staff_id=None, *, limit=15, after_id=None, **kwargs
-):
+async def get_handled_chats(model, *, limit=15, after_id=None, **kwargs):
+    """Return all the chats excluding the unhandled ones"""
     # Get the `internal_id` value from the starting row
     # And use it to query the next page of results
-    last_internal_id = 0
+    last_internal_id = -1
     if after_id:
-        row_of_after_id = await model.query.where(
-            model.visitor_id == after_id
-        ).gino.first()
+        row_of_after_id = await get_one(model, id=after_id)
         if not row_of_after_id:
             raise_not_found_exception(model, visitor_id=after_id)
 
         last_internal_id = row_of_after_id.internal_id
 
-    # model_table_name = model.__tablename__
-    extra_fields = ["chat_unhandled.created_at AS unhandled_timestamp"]
-    if staff_id:
-        sql_query = """
+    sql_query = handled_chats_statements.get(has_last_internal_id=last_internal_id >= 0)
+
+    data = (
+        await read_status(
+            sql_query, {"last_internal_id": last_internal_id, "limit": limit}
+        )
+    )[1]
+
+    # Parse the users
+    return chat_and_visitor_mapper(data)
+
+
+unhandled_extra_fields = ["chat_unhandled.created_at AS unhandled_timestamp"]
+unhandled_visitor_mapper = RowMapper(
+    (None, chat_fields),
+    (None, visitor_fields),
+    (None, [get_field_alias(field) for field in unhandled_extra_fields]),
+)
+
+
+def build_staff_unhandled_visitors_sql(has_staff_id):
+    if has_staff_id:
+        return """
             WITH subscribed_visitors AS (
                 SELECT
                     DISTINCT staff_subscription_chat.visitor_id
@@ -623,13 +820,13 @@ async def get_staff_unhandled_visitors(
             ", ".join(
                 chat_fields_with_table_name
                 + visitor_fields_with_table_name
-                + extra_fields
+                + unhandled_extra_fields
             ),
             # model_table_name,
             # model_table_name,
         )
     else:
-        sql_query = """
+        return """
             SELECT {}
             FROM visitor
             JOIN chat_unhandled
@@ -644,56 +841,48 @@ async def get_staff_unhandled_visitors(
             ", ".join(
                 chat_fields_with_table_name
                 + visitor_fields_with_table_name
-                + extra_fields
+                + unhandled_extra_fields
             )
         )
 
-    data = (
-        await db.status(
-            db.text(sql_query),
-            {
-                "last_internal_id": last_internal_id,
-                "staff_id": staff_id,
-                "limit": limit,
-            },
-        )
-    )[1]
 
-    result = []
-    extra_fields = [item.split("AS")[1].strip() for item in extra_fields]
-    # Parse the users
-    for row in data:
-        visitor_data = {
-            key: value
-            for key, value in zip(chat_fields + visitor_fields + extra_fields, row)
-        }
-        result.append(visitor_data)
-
-    return result
+staff_unhandled_visitors_statements = Statements(
+    build_staff_unhandled_visitors_sql, has_staff_id=(False, True)
+)
 
 
-async def get_non_normal_visitors(
-    model, *, limit=15, after_id=None, extra_fields=None, **kwargs
+async def get_staff_unhandled_visitors(
+    model, staff_id=None, *, limit=15, after_id=None, **kwargs
 ):
-    extra_fields = extra_fields or []
-    # extra_fields_with_table_name = [
-    #     "{}.{}".format(model.__tablename__, field) for field in extra_fields
-    # ]
-
     # Get the `internal_id` value from the starting row
     # And use it to query the next page of results
     last_internal_id = 0
     if after_id:
-        row_of_after_id = await model.query.where(
-            model.visitor_id == after_id
-        ).gino.first()
+        row_of_after_id = await get_one(model, visitor_id=after_id)
         if not row_of_after_id:
             raise_not_found_exception(model, visitor_id=after_id)
 
         last_internal_id = row_of_after_id.internal_id
 
-    model_table_name = model.__tablename__
-    sql_query = """
+    sql_query = staff_unhandled_visitors_statements.get(has_staff_id=bool(staff_id))
+
+    data = (
+        await read_status(
+            sql_query,
+            {
+                "last_internal_id": last_internal_id,
+                "staff_id": staff_id,
+                "limit": limit,
+            },
+        )
+    )[1]
+
+    # Parse the users
+    return unhandled_visitor_mapper(data)
+
+
+def build_non_normal_visitors_sql(model_table_name, extra_fields):
+    return """
         SELECT {}
         FROM visitor
         JOIN {}
@@ -706,7 +895,11 @@ async def get_non_normal_visitors(
         LIMIT :limit
     """.format(
         ", ".join(
-            extra_fields + chat_fields_with_table_name + visitor_fields_with_table_name
+            [
+                *extra_fields,
+                *chat_fields_with_table_name,
+                *visitor_fields_with_table_name,
+            ]
         ),
         model_table_name,
         model_table_name,
@@ -714,56 +907,65 @@ async def get_non_normal_visitors(
         model_table_name,
     )
 
-    data = (
-        await db.status(
-            db.text(sql_query), {"last_internal_id": last_internal_id, "limit": limit}
-        )
-    )[1]
 
-    result = []
-    extra_fields = [item.split("AS")[1].strip() for item in extra_fields]
+# The variants are built on their first use, as the extra fields are given by the callers
+non_normal_visitors_statements = Statements(build_non_normal_visitors_sql)
 
-    # Parse the users
-    for row in data:
-        visitor_data = {
-            key: value
-            for key, value in zip(extra_fields + chat_fields + visitor_fields, row)
-        }
-        result.append(visitor_data)
 
-    return result
+@lru_cache(maxsize=None)
+def get_non_normal_visitor_mapper(extra_fields: tuple):
+    """Return the mapper of the rows of `get_non_normal_visitors()`."""
+    return RowMapper(
+        (None, [get_field_alias(field) for field in extra_fields]),
+        (None, chat_fields),
+        (None, visitor_fields),
+    )
 
 
-async def get_unhandled_visitors_with_no_replies(max_waiting_hours: int):
-    sql_query = """
-    SELECT {}
-        FROM visitor
-    JOIN chat_unhandled
-    	ON chat_unhandled.visitor_id = visitor.id
-    WHERE
-    	round(chat_unhandled.created_at::decimal / 1000) >
-        round(extract(epoch from now())) - :max_waiting_hours * 60 * 60
-    ;
-    """.format(
-        ", ".join(visitor_fields_with_table_name)
+async def get_non_normal_visitors(
+    model, *, limit=15, after_id=None, extra_fields=None, **kwargs
+):
+    extra_fields = extra_fields or []
+    # extra_fields_with_table_name = [
+    #     "{}.{}".format(model.__tablename__, field) for field in extra_fields
+    # ]
+
+    # Get the `internal_id` value from the starting row
+    # And use it to query the next page of results
+    last_internal_id = 0
+    if after_id:
+        row_of_after_id = await get_one(model, visitor_id=after_id)
+        if not row_of_after_id:
+            raise_not_found_exception(model, visitor_id=after_id)
+
+        last_internal_id = row_of_after_id.internal_id
+
+    sql_query = non_normal_visitors_statements.get(
+        model_table_name=model.__tablename__, extra_fields=tuple(extra_fields)
     )
 
     data = (
-        await db.status(db.text(sql_query), {"max_waiting_hours": max_waiting_hours})
+        await read_status(
+            sql_query, {"last_internal_id": last_internal_id, "limit": limit}
+        )
     )[1]
 
-    result = []
-    # Parse the visitors
-    for row in data:
-        visitor_data = {key: value for key, value in zip(visitor_fields, row)}
-        result.append(visitor_data)
+    # Parse the users
+    return get_non_normal_visitor_mapper(tuple(extra_fields))(data)
 
-    return result
 
+def get_unhandled_cutoff(max_waiting_hours: int, now: int = None) -> int:
+    """
+    Return the time (in miliseconds)
+    before which the unhandled chats have waited for more than `max_waiting_hours`.
+    """
+    if now is None:
+        now = int(time() * 1000)
+    return now - max_waiting_hours * 60 * 60 * 1000
 
-async def get_visitors_with_no_assigned_staffs():
 
-    sql_query = """
+visitors_with_no_assigned_staffs_query = db.text(
+    """
     WITH visitors_with_assigned_staffs AS (
         SELECT
             DISTINCT staff_subscription_chat.visitor_id
@@ -781,65 +983,45 @@ async def get_visitors_with_no_assigned_staffs():
     """.format(
         ", ".join(visitor_fields_with_table_name)
     )
+)
 
-    data = (await db.status(db.text(sql_query)))[1]
 
-    result = []
-    # Parse the visitors
-    for row in data:
-        visitor_data = {key: value for key, value in zip(visitor_fields, row)}
-        result.append(visitor_data)
+async def get_visitors_with_no_assigned_staffs():
+    data = (await db.status(visitors_with_no_assigned_staffs_query))[1]
 
-    return result
+    # Parse the visitors
+    return visitor_mapper(data)
 
 
-async def get_top_unread_visitors(visitor_model, chat_model, staff_id, *, limit=15):
+def build_top_unread_visitors_sql(visitor_table, chat_table):
     # Add the visitor's table name as a suffix of the fields
     _visitor_fields_without_id = (
-        "{}.{} AS {}_{}".format(
-            visitor_model.__tablename__, field, visitor_model.__tablename__, field
-        )
+        "{}.{} AS {}_{}".format(visitor_table, field, visitor_table, field)
         for field in visitor_fields
         if field.lower() != "id"
     )
     _visitor_fields_without_id_alias = (
-        "{}_{}".format(visitor_model.__tablename__, field)
+        "{}_{}".format(visitor_table, field)
         for field in visitor_fields
         if field.lower() != "id"
     )
     _chat_fields = (
-        "{}.{} AS {}_{}".format(
-            chat_model.__tablename__, field, chat_model.__tablename__, field
-        )
+        "{}.{} AS {}_{}".format(chat_table, field, chat_table, field)
         for field in chat_fields
     )
-    _chat_fields_alias = (
-        "{}_{}".format(chat_model.__tablename__, field) for field in chat_fields
-    )
+    _chat_fields_alias = ("{}_{}".format(chat_table, field) for field in chat_fields)
 
     returned_fields = ", ".join(chain(_visitor_fields_without_id, _chat_fields))
     returned_alias_fields = ", ".join(
         chain(_visitor_fields_without_id_alias, _chat_fields_alias)
     )
-    sql_query = """
+    return """
         WITH seen_chats AS (
             SELECT
                 distinct chat_message_seen.chat_id
             FROM chat_message_seen
             WHERE
                 chat_message_seen.staff_id = :staff_id
-        ), most_recent_messages AS (
-            SELECT DISTINCT t.chat_id, chat_message.id as chat_msg_id
-            FROM (
-                SELECT
-                        chat.id as chat_id,
-                        MAX(chat_message.sequence_num) as max_sequence_num
-                    FROM chat
-                    JOIN chat_message on chat.id = chat_message.chat_id
-                    GROUP BY chat.id
-            ) t
-            JOIN chat_message ON chat_message.chat_id = t.chat_id
-            WHERE t.max_sequence_num = chat_message.sequence_num
         )
         SELECT temp.visitor_visitor_id, {}
         FROM (
@@ -849,10 +1031,26 @@ async def get_top_unread_visitors(visitor_model, chat_model, staff_id, *, limit=
             LEFT OUTER JOIN chat_message_seen ON chat_message_seen.chat_id = chat.id
             WHERE
                 chat.id NOT IN (SELECT * FROM seen_chats)
-                OR chat_message_seen.last_seen_msg_id NOT IN (
-                    SELECT most_recent_messages.chat_msg_id
-                    FROM most_recent_messages
-                    WHERE most_recent_messages.chat_id = chat_message_seen.chat_id
+                -- The last seen message is not one of the most recent messages
+                -- of the chat. The newer messages are created after it,
+                -- so that only the partitions of `chat_message` since then are scanned
+                OR chat_message_seen.last_seen_msg_id IS NOT NULL
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM chat_message AS last_seen_message
+                    WHERE
+                        last_seen_message.id = chat_message_seen.last_seen_msg_id
+                        AND last_seen_message.chat_id = chat.id
+                        AND NOT EXISTS (
+                            SELECT 1
+                            FROM chat_message
+                            WHERE
+                                chat_message.chat_id = chat.id
+                                AND chat_message.sequence_num
+                                    > last_seen_message.sequence_num
+                                AND chat_message.created_at
+                                    >= last_seen_message.created_at
+                        )
                 )
                 AND chat_message_seen.staff_id = :staff_id
                 AND EXISTS (
@@ -867,90 +1065,134 @@ async def get_top_unread_visitors(visitor_model, chat_model, staff_id, *, limit=
         returned_alias_fields, returned_fields
     )
 
-    data = (
-        await db.status(db.text(sql_query), {"staff_id": staff_id, "limit": limit})
-    )[1]
 
-    result = []
+top_unread_visitors_statements = Statements(build_top_unread_visitors_sql)
+top_unread_visitor_mapper = RowMapper(
+    ("user", ["id"] + [field for field in visitor_fields if field.lower() != "id"]),
+    ("room", chat_fields),
+)
+
+
+async def get_top_unread_visitors(visitor_model, chat_model, staff_id, *, limit=15):
+    """
+    Return the visitors whose chats have unread messages for the staff,
+    or that the staff has never seen.
+    """
+    sql_query = top_unread_visitors_statements.get(
+        visitor_table=visitor_model.__tablename__, chat_table=chat_model.__tablename__
+    )
+    data = (await read_status(sql_query, {"staff_id": staff_id, "limit": limit}))[1]
+
     # Parse the visitors and chats
-    _visitor_fields_without_id = [field for field in visitor_fields if field != "id"]
-    for row in data:
-        visitor = {"id": row[0]}
-        index = 1
-        for key in _visitor_fields_without_id:
-            visitor[key] = row[index]
-            index += 1
-
-        chat_info = {}
-        for key in chat_fields:
-            chat_info[key] = row[index]
-            index += 1
-
-        result.append({"user": visitor, "room": chat_info})
-    return result
+    return top_unread_visitor_mapper(data)
+
+
+chat_activity_upsert_query = db.text(
+    """
+    INSERT INTO chat_activity (organisation_id, visitor_id, last_staff_msg_at)
+    SELECT "user".organisation_id, chat.visitor_id, :created_at
+    FROM "user", chat
+    WHERE "user".id = :staff_id AND chat.id = :chat_id
+    ON CONFLICT (organisation_id, visitor_id) DO UPDATE
+    SET last_staff_msg_at = GREATEST(
+        chat_activity.last_staff_msg_at, EXCLUDED.last_staff_msg_at
+    );
+    """
+)
+
+
+chat_activity_rebuild_query = db.text(
+    """
+    INSERT INTO chat_activity (organisation_id, visitor_id, last_staff_msg_at)
+    SELECT "user".organisation_id, chat.visitor_id, MAX(chat_message.created_at)
+    FROM chat_message
+    JOIN "user" ON "user".id = chat_message.sender
+    JOIN chat ON chat.id = chat_message.chat_id
+    GROUP BY "user".organisation_id, chat.visitor_id
+    ON CONFLICT (organisation_id, visitor_id) DO UPDATE
+    SET last_staff_msg_at = GREATEST(
+        chat_activity.last_staff_msg_at, EXCLUDED.last_staff_msg_at
+    );
+    """
+)
+
+
+async def rebuild_chat_activity():
+    """
+    Fill `chat_activity` from all the staffs' messages,
+    e.g. after loading messages without `ChatMessage.add()`.
+
+    Return the number of upserted rows.
+    """
+    status = await db.status(chat_activity_rebuild_query)
+    return int(status[0].split()[-1])
+
+
+async def update_chat_activity(chat_id, staff_id, created_at):
+    """Record a message of a staff, for `get_visitors_with_most_recent_chats()`."""
+    await db.status(
+        chat_activity_upsert_query,
+        {"chat_id": chat_id, "staff_id": staff_id, "created_at": created_at},
+    )
 
 
 async def get_visitors_with_most_recent_chats(
-    chat_model,
-    chat_message,
+    chat_activity,
     visitor,
-    staff,
     requester: dict,
     *,
+    after_id=None,
     page=0,
     limit=15,
-    **kwargs,
 ):
-    """Return the visitors with the most recent chats to your organisation."""
-
-    # Join the tables to get the staffs
-    query = db.select(
-        [
-            # *(getattr(visitor, key) for key in visitor_fields),
-            visitor.id,
-            func.max(chat_message.created_at).label("max_created_at"),
-        ]
-    ).select_from(
-        staff.join(chat_message, chat_message.sender == staff.id)
-        .join(chat_model, chat_model.id == chat_message.chat_id)
-        .join(visitor, chat_model.visitor_id == visitor.id)
-    )
-
-    query = query.where(
-        and_(
-            staff.organisation_id == requester["organisation_id"],
-            *dict_to_filter_args(staff, **kwargs),
+    """
+    Return the visitors with the most recent chats to your organisation.
+
+    The visitors are ordered by the last message of the organisation's staffs,
+    maintained in `chat_activity` by `update_chat_activity()`.
+    Only the visitors with messages of the organisation's staffs are listed.
+
+    Kwargs:
+        after_id (str):
+            The returned result will start from the visitor
+            with id == after_id (exclusive).
+            Raise NotFound if the visitor is not listed,
+            e.g. if no staff of the organisation has sent a message to them.
+    """
+    organisation_id = requester["organisation_id"]
+    query = (
+        db.select([*(getattr(visitor, key) for key in visitor_fields)])
+        .select_from(
+            chat_activity.join(visitor, chat_activity.visitor_id == visitor.id)
         )
-    ).group_by(visitor.id)
-
-    # Execute the query
-    visitor_alias = visitor.alias("alias_visitor")
-    temp = query.alias("alias_visitor")
-    data = (
-        await db.select([*(getattr(visitor, key) for key in visitor_fields)])
-        .select_from(visitor.join(temp, visitor_alias.id == visitor.id))
-        .order_by(desc("max_created_at"))
+        .where(chat_activity.organisation_id == organisation_id)
+        .order_by(desc(chat_activity.last_staff_msg_at), desc(chat_activity.visitor_id))
         .limit(limit)
-        .offset(page * limit)
-        .gino.all()
     )
 
-    result = []
-    # Parse the visitors
-    for row in data:
-        visitor_data = {key: value for key, value in zip(visitor_fields, row)}
-        result.append(visitor_data)
+    if after_id:
+        # Keyset pagination, on the index of the ordering
+        row_of_after_id = await get_one(
+            chat_activity, organisation_id=organisation_id, visitor_id=after_id
+        )
+        if not row_of_after_id:
+            raise_not_found_exception(visitor, id=after_id)
 
-    return result
+        query = query.where(
+            tuple_(chat_activity.last_staff_msg_at, chat_activity.visitor_id)
+            < tuple_(row_of_after_id.last_staff_msg_at, row_of_after_id.visitor_id)
+        )
+    elif page:
+        query = query.offset(page * limit)
 
+    data = await read_all(query)
 
-async def get_number_of_unread_notifications_for_staff(
-    staff_id, noti_read_model, noti_model
-):
-    noti_read = await noti_read_model.get_or_create(staff_id=staff_id, serialized=False)
-    last_read_internal_id = noti_read.last_read_internal_id
+    # Parse the visitors
+    return visitor_mapper(data)
 
-    sql_query = """
+
+def build_unread_notifications_count_sql(has_last_read_internal_id):
+    return """
     SELECT COUNT(*)
     FROM notification_staff
     WHERE
@@ -959,20 +1201,93 @@ async def get_number_of_unread_notifications_for_staff(
     ;
     """.format(
         "AND notification_staff.internal_id > :last_read_internal_id"
-        if last_read_internal_id is not None
+        if has_last_read_internal_id
         else ""
     )
 
+
+unread_notifications_count_statements = Statements(
+    build_unread_notifications_count_sql, has_last_read_internal_id=(False, True)
+)
+
+
+async def get_number_of_unread_notifications_for_staff(
+    staff_id, noti_read_model, noti_model
+):
+    # The counter is maintained in the cache, once counted from the db
+    count = await get_unread_count(staff_id)
+    if count is not None:
+        return count
+
+    noti_read = await noti_read_model.get_or_create(staff_id=staff_id, serialized=False)
+    last_read_internal_id = noti_read.last_read_internal_id
+
+    sql_query = unread_notifications_count_statements.get(
+        has_last_read_internal_id=last_read_internal_id is not None
+    )
+
     data = (
-        await db.status(
-            db.text(sql_query),
+        await read_status(
+            sql_query,
             {"staff_id": staff_id, "last_read_internal_id": last_read_internal_id},
         )
     )[1]
-    return data[0][0]
+    count = data[0][0]
+    await set_unread_count(staff_id, count)
+    return count
     # return latest_notification.internal_id - noti_read.last_read_internal_id
 
 
+unread_notifications_counts_of_staffs_query = db.text(
+    """
+    SELECT
+        notification_staff_read.staff_id,
+        COUNT(notification_staff.internal_id)
+    FROM notification_staff_read
+    LEFT JOIN notification_staff
+        ON notification_staff.staff_id = notification_staff_read.staff_id
+        AND (
+            notification_staff_read.last_read_internal_id IS NULL
+            OR notification_staff.internal_id
+                > notification_staff_read.last_read_internal_id
+        )
+    WHERE notification_staff_read.staff_id IN :staff_ids
+    GROUP BY notification_staff_read.staff_id;
+    """
+).bindparams(bindparam("staff_ids", expanding=True))
+
+
+async def get_numbers_of_unread_notifications_for_staffs(
+    staff_ids, noti_read_model, noti_model
+):
+    """
+    Return the number of unread notifications of each staff,
+    with the counters missing from the cache counted from the db in one query.
+    """
+    staff_ids = list(set(staff_ids))
+    counts = await get_unread_counts(staff_ids)
+    missing_staff_ids = [staff_id for staff_id in staff_ids if staff_id not in counts]
+    if not missing_staff_ids:
+        return counts
+
+    await insert(noti_read_model.__table__).values(
+        [
+            {**get_python_defaults(noti_read_model), "staff_id": staff_id}
+            for staff_id in missing_staff_ids
+        ]
+    ).on_conflict_do_nothing().gino.status()
+
+    data = (
+        await read_status(
+            unread_notifications_counts_of_staffs_query,
+            {"staff_ids": missing_staff_ids},
+        )
+    )[1]
+    missing_counts = dict(data)
+    await set_unread_counts(missing_counts)
+    return {**counts, **missing_counts}
+
+
 @in_transaction
 async def create_one(model, **kwargs):
     try:
@@ -981,6 +1296,92 @@ async def create_one(model, **kwargs):
         raise DuplicatedError(err.as_dict())
 
 
+def get_python_defaults(model, kind="default", exclude=()):
+    """
+    Return the Python-side `default` or `onupdate` values of the model's columns.
+
+    SQLAlchemy doesn't apply them to an `INSERT` inside a CTE,
+    nor to `ON CONFLICT DO UPDATE`.
+    """
+    values = {}
+    for column in model.__table__.columns:
+        default = getattr(column, kind)
+        if default is None or column.name in exclude:
+            continue
+        if default.is_callable:
+            values[column.name] = default.arg(None)
+        elif default.is_scalar:
+            values[column.name] = default.arg
+    return values
+
+
+async def insert_if_not_exists(model, **kwargs):
+    """
+    Insert a row, or return None if it conflicts with an existing row.
+
+    Unlike catching the unique violation, it doesn't abort the current transaction.
+    """
+    return (
+        await insert(model.__table__)
+        .values({**get_python_defaults(model), **kwargs})
+        .on_conflict_do_nothing()
+        .returning(*model.__table__.columns)
+        .gino.load(model)
+        .first()
+    )
+
+
+async def upsert_one(model, conflict_columns, values: dict, update_values=None):
+    """
+    Insert a row, or get/update the existing row in a single statement,
+    using `INSERT ... ON CONFLICT ... RETURNING`.
+
+    Args:
+        conflict_columns (list):
+            The columns of an unique index of the model,
+            which identify the existing row. Their values must be in `values`.
+
+        values (dict):
+            The values of the inserted row.
+
+        update_values (dict):
+            The values updated on the existing row.
+            If empty, the existing row is returned as it is.
+
+    Return the inserted or existing row, as a model's instance.
+    """
+    table = model.__table__
+    query = insert(table).values(**get_python_defaults(model, exclude=values), **values)
+
+    if update_values:
+        query = query.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={**get_python_defaults(model, "onupdate"), **update_values},
+        ).returning(*table.columns)
+        return await query.gino.load(model).first()
+
+    # Don't rewrite the existing row (as `DO UPDATE` would),
+    # but select it in the same statement if nothing is inserted
+    inserted = (
+        query.on_conflict_do_nothing(index_elements=conflict_columns)
+        .returning(*table.columns)
+        .cte("inserted")
+    )
+    existing = db.select([table]).where(
+        and_(*(table.c[column] == values[column] for column in conflict_columns))
+    )
+    row = await (
+        db.select([inserted]).union_all(existing).limit(1).gino.load(model).first()
+    )
+    if row is None:
+        # The conflicting row is inserted by a concurrent transaction,
+        # which wasn't committed when the statement started
+        row = await get_one(
+            model, **{column: values[column] for column in conflict_columns}
+        )
+    return row
+
+
 @in_transaction
 async def update_one(row, **kwargs):
     if not kwargs:
@@ -992,9 +1393,11 @@ async def update_one(row, **kwargs):
 
 @in_transaction
 async def update_many(model, get_kwargs, update_kwargs):
-    status: Tuple[str, list] = await model.update.values(**update_kwargs).where(
-        and_(*and_(*dict_to_filter_args(model, **get_kwargs)))
-    ).gino.status()
+    status: Tuple[str, list] = (
+        await model.update.values(**update_kwargs)
+        .where(and_(*and_(*dict_to_filter_args(model, **get_kwargs))))
+        .gino.status()
+    )
     return status[0]
 
 
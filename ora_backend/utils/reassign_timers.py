@@ -0,0 +1,66 @@
+from aioredis.commands import SortedSetCommandsMixin
+
+from ora_backend import cache
+
+# The unhandled chats, in a sorted set of the visitors' ids
+# scored by the time (in miliseconds) since when their chats have been unhandled.
+# A chat is due to be reassigned once it has waited for `hours_to_auto_reassign`,
+# so that changing the setting applies to the chats already waiting
+REASSIGN_TIMERS = "reassign_timers"
+
+# Pop the chats unhandled since before the cutoff
+POP_DUE_TIMERS_SCRIPT = """
+local items = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #items > 0 then
+    redis.call('ZREM', KEYS[1], unpack(items))
+end
+return items
+"""
+
+
+def _get_key():
+    return cache.build_key(REASSIGN_TIMERS, namespace="tasks")
+
+
+async def start_reassign_timers(timers: dict, *, only_new=False):
+    """
+    Start the reassign timers of the chats.
+
+    Args:
+        timers (dict):
+            The time (in miliseconds) since when each visitor's chat is unhandled.
+
+        only_new (bool):
+            Whether to keep the timers already started.
+    """
+    if not timers:
+        return
+
+    scores_and_members = []
+    for visitor_id, unhandled_at in timers.items():
+        scores_and_members += [unhandled_at, visitor_id]
+    await cache.raw(
+        "zadd",
+        _get_key(),
+        *scores_and_members,
+        exist=SortedSetCommandsMixin.ZSET_IF_NOT_EXIST if only_new else None
+    )
+
+
+async def start_reassign_timer(visitor_id, unhandled_at: int):
+    await start_reassign_timers({visitor_id: unhandled_at})
+
+
+async def stop_reassign_timer(visitor_id):
+    await cache.raw("zrem", _get_key(), visitor_id)
+
+
+async def pop_due_reassign_timers(cutoff: int, limit: int):
+    """
+    Stop and return the timers of at most `limit` chats,
+    which have been unhandled since before `cutoff` (in miliseconds).
+    """
+    visitor_ids = await cache.raw(
+        "eval", POP_DUE_TIMERS_SCRIPT, [_get_key()], [cutoff, limit]
+    )
+    return [visitor_id.decode("utf-8") for visitor_id in visitor_ids]
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+
+from gino import create_engine
+from sanic.log import logger
+
+from ora_backend import db
+from ora_backend.config.db import DB_REPLICA_LAG_CHECK_INTERVAL, DB_REPLICA_MAX_LAG
+
+# The replica is considered caught up if it has replayed all the received WAL,
+# as `pg_last_xact_replay_timestamp()` keeps increasing while the primary is idle
+REPLICA_LAG_QUERY = db.text(
+    """
+    SELECT
+        CASE
+            WHEN NOT pg_is_in_recovery() THEN 0
+            WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE COALESCE(
+                EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+            )
+        END;
+    """
+)
+
+_use_primary = ContextVar("use_primary", default=False)
+
+
+class ReplicaRouter:
+    """
+    Route the read-only queries to a replica,
+    if one is configured and it is not lagging behind the primary.
+
+    Otherwise, the queries are sent to the primary (`db.bind`).
+    """
+
+    def __init__(
+        self, max_lag=DB_REPLICA_MAX_LAG, check_interval=DB_REPLICA_LAG_CHECK_INTERVAL
+    ):
+        self.engine = None
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag = None
+        self._checked_at = None
+
+    async def connect(self, url: str, **kwargs):
+        self.engine = await create_engine(url, **kwargs)
+        self._checked_at = None
+
+    async def close(self):
+        if self.engine is not None:
+            engine, self.engine = self.engine, None
+            await engine.close()
+
+    async def check_lag(self):
+        """Return the replica's lag (in seconds), or None if it is unreachable."""
+        try:
+            lag = await self.engine.scalar(REPLICA_LAG_QUERY)
+        except Exception as exc:
+            logger.warning("The DB replica is unreachable: %r", exc)
+            return None
+        return float(lag)
+
+    async def is_usable(self):
+        now = monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            # Mark it first, so that concurrent calls don't check it again
+            self._checked_at = now
+            self.lag = await self.check_lag()
+
+        return self.lag is not None and self.lag <= self.max_lag
+
+    async def get_read_bind(self):
+        if self.engine is None or _use_primary.get():
+            return db.bind
+
+        if await self.is_usable():
+            return self.engine
+        return db.bind
+
+    async def run(self, method: str, query, *args, **kwargs):
+        """
+        Run a read-only query with the bind's `method` (e.g. "all", "status").
+
+        If it fails on the replica, it is run again on the primary,
+        and the replica is not used until its lag is checked again.
+        """
+        bind = await self.get_read_bind()
+        if bind is not db.bind:
+            try:
+                return await getattr(bind, method)(query, *args, **kwargs)
+            except Exception as exc:
+                logger.warning("The query failed on the DB replica: %r", exc)
+                self.lag = None
+                self._checked_at = monotonic()
+
+        return await getattr(db.bind, method)(query, *args, **kwargs)
+
+
+replica = ReplicaRouter()
+
+
+async def get_read_bind():
+    """
+    Return the engine to run a read-only query on.
+
+    Use it for queries which could tolerate a few seconds of replication lag.
+    """
+    return await replica.get_read_bind()
+
+
+async def read_all(query, *args, **kwargs):
+    """Similar to `db.all()`, but on the engine of `get_read_bind()`."""
+    return await replica.run("all", query, *args, **kwargs)
+
+
+async def read_status(query, *args, **kwargs):
+    """Similar to `db.status()`, but on the engine of `get_read_bind()`."""
+    return await replica.run("status", query, *args, **kwargs)
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Send all the read-only queries inside this block to the primary,
+    for the paths which need to read their own writes.
+
+    Example:
+        await update_something()
+        with read_from_primary():
+            visitors = await get_self_subscribed_visitors(...)
+    """
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
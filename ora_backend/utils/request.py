@@ -9,6 +9,18 @@ def req_args_to_dict(args: dict):
     return {key: val[-1] for key, val in args.items()}
 
 
+def parse_fields(value):
+    """
+    Parse the comma-separated fields of the `fields` query param, e.g. "id,created_at".
+
+    Return None if no fields are given, to return all the fields.
+    """
+    if not value:
+        return None
+    fields = (field.strip() for field in value.split(","))
+    return tuple(dict.fromkeys(field for field in fields if field)) or None
+
+
 def unpack_request(func=None):
     if func is None:
         return partial(unpack_request)
@@ -25,6 +37,8 @@ def unpack_request(func=None):
             for key in list(req_args.keys())
             if key in QUERY_PARAM_READ_SCHEMA
         }
+        # The fields to return, whose columns are the only ones selected
+        fields = parse_fields(req_args.pop("fields", None))
 
         req_body = request.json or {}
         return await func(
@@ -32,6 +46,7 @@ def unpack_request(func=None):
             req_args=req_args,
             req_body=req_body,
             query_params=query_params,
+            fields=fields,
             *args,
             **kwargs
         )
@@ -0,0 +1,82 @@
+from operator import itemgetter
+
+
+def _get_values_getter(indexes):
+    """Return a function returning the tuple of a row's values at the `indexes`."""
+    indexes = tuple(indexes)
+    if not indexes:
+        return lambda row: ()
+    if len(indexes) == 1:
+        index = indexes[0]
+        return lambda row: (row[index],)
+    return itemgetter(*indexes)
+
+
+class RowMapper:
+    """
+    Map the rows of a raw-SQL query into dicts, following a shape declared once.
+
+    The shape is a sequence of groups of consecutive columns,
+    each a tuple of `(name, keys)` or `(name, keys, required_key)`:
+    - `name` is the key of the group's nested dict,
+      or None to merge the group into the returned dict.
+    - `keys` are the keys of the group's columns, in order.
+    - `required_key`: the nested dict is None if this key of the returned dict is empty.
+
+    The getters of the groups are compiled once, when the mapper is created.
+
+    Example:
+        mapper = RowMapper((None, ["id", "content"]), ("sender", ["id"], "sender"))
+        mapper(rows)  # [{"id": ..., "content": ..., "sender": {"id": ...}}, ...]
+    """
+
+    def __init__(self, *groups):
+        self.groups = groups
+        self.map_row = self._compile(groups)
+
+    def __call__(self, rows):
+        map_row = self.map_row
+        return [map_row(row) for row in rows]
+
+    @staticmethod
+    def _compile(groups):
+        offset = 0
+        merged_keys = []
+        merged_indexes = []
+        nested_groups = []
+        for name, keys, *required_key in groups:
+            indexes = range(offset, offset + len(keys))
+            offset += len(keys)
+            if name is None:
+                merged_keys.extend(keys)
+                merged_indexes.extend(indexes)
+            else:
+                nested_groups.append(
+                    (
+                        name,
+                        tuple(keys),
+                        _get_values_getter(indexes),
+                        required_key[0] if required_key else None,
+                    )
+                )
+
+        merged_keys = tuple(merged_keys)
+        if merged_indexes == list(range(len(merged_keys))):
+            # The merged groups are the first columns, which `zip` picks in order
+            get_merged_values = lambda row: row
+        else:
+            get_merged_values = _get_values_getter(merged_indexes)
+
+        if not nested_groups:
+            return lambda row: dict(zip(merged_keys, get_merged_values(row)))
+
+        def map_row(row):
+            result = dict(zip(merged_keys, get_merged_values(row)))
+            for name, keys, get_values, required_key in nested_groups:
+                if required_key is not None and not result.get(required_key):
+                    result[name] = None
+                else:
+                    result[name] = dict(zip(keys, get_values(row)))
+            return result
+
+        return map_row
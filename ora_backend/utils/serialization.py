@@ -1,29 +1,127 @@
+from functools import lru_cache
+from operator import itemgetter
+
 from cerberus import Validator
 
 # from ora_backend.utils.validation import schemas
 from ora_backend.schemas import schemas
 
 
+@lru_cache(maxsize=None)
+def get_visible_keys(model_name, keys: tuple, fields=None, allow_readonly=False):
+    """
+    Return the (position, key) of the keys to serialize, once per model and fields.
+
+    Args:
+        keys (tuple):
+            The keys of the row's values, in order.
+
+        fields (frozenset):
+            The keys to keep. If None, all the keys are kept.
+
+        allow_readonly (bool):
+            Whether the properties with readonly=True in the schema are kept.
+    """
+    _schema = schemas.get(model_name + "_read", {})
+    return tuple(
+        (index, key)
+        for index, key in enumerate(keys)
+        if (fields is None or key in fields)
+        # Hide all properties with readonly=True
+        and (allow_readonly or not _schema.get(key, {}).get("readonly", False))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_row_serializer(model_name, keys: tuple, fields=None, allow_readonly=False):
+    """
+    Return a function turning a row into a dict, compiled once per model and fields.
+
+    The function accepts any row indexed by the positions of `keys`,
+    like an asyncpg Record or a tuple.
+    """
+    visible_keys = get_visible_keys(model_name, keys, fields, allow_readonly)
+    if not visible_keys:
+        return lambda row: {}
+    if len(visible_keys) == 1:
+        ((index, name),) = visible_keys
+        return lambda row: {name: row[index]}
+
+    names = tuple(key for _, key in visible_keys)
+    getter = itemgetter(*(index for index, _ in visible_keys))
+    return lambda row: dict(zip(names, getter(row)))
+
+
+@lru_cache(maxsize=None)
+def get_model_keys(model):
+    """Return the attribute names of the model's columns, as in `model.to_dict()`."""
+    return tuple(
+        model._column_name_map.invert_get(column.name)
+        for column in model.__table__.columns
+    )
+
+
+@lru_cache(maxsize=None)
+def get_projected_keys(model, fields=None, allow_readonly=False):
+    """
+    Return the keys of the model's columns to select for the `fields`,
+    or None to select all the columns.
+
+    The `id` is always selected, as the pagination links are built from it.
+    """
+    if fields is None:
+        return None
+
+    keys = get_model_keys(model)
+    visible_keys = {
+        key
+        for _, key in get_visible_keys(
+            model.__tablename__, keys, fields, allow_readonly
+        )
+    }
+    return tuple(key for key in keys if key in visible_keys or key == "id")
+
+
+def get_projection(model, fields=None, allow_readonly=False):
+    """Similar to `get_projected_keys()`, for the `fields` of a request."""
+    if fields:
+        # Ignore the unknown fields, which would otherwise fill the caches
+        fields = frozenset(fields).intersection(get_model_keys(model)) or {"id"}
+    return get_projected_keys(model, _normalize_fields(fields), allow_readonly)
+
+
+def _normalize_fields(fields):
+    # No fields means all the fields
+    return frozenset(fields) if fields else None
+
+
 def serialize_row(row, fields=None, allow_readonly=False):
     if not row:
         return {}
 
-    model_name = row.__tablename__
-    _dict = row.to_dict()
-    _schema = schemas.get(model_name + "_read", {})
-    if not fields:
-        fields = set(_dict.keys())
+    model = type(row)
+    keys = get_model_keys(model)
+    visible_keys = get_visible_keys(
+        model.__tablename__, keys, _normalize_fields(fields), allow_readonly
+    )
+    values = row.__values__
+    return {key: values.get(key) for _, key in visible_keys}
 
-    # Remove internal_id
-    # _dict.pop("internal_id", None)
 
-    # Hide all properties with readonly=True
-    return {
-        key: val
-        for key, val in _dict.items()
-        if key in fields
-        and (allow_readonly or not _schema.get(key, {}).get("readonly", False))
-    }
+def serialize_records(model, records, fields=None, allow_readonly=False):
+    """
+    Serialize the raw records of a model's query (without loading them into models).
+    """
+    if not records:
+        return []
+
+    serializer = get_row_serializer(
+        model.__tablename__,
+        tuple(records[0].keys()),
+        _normalize_fields(fields),
+        allow_readonly,
+    )
+    return [serializer(record) for record in records]
 
 
 def serialize_to_dict(payload, **kwargs):
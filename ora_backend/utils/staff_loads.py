@@ -0,0 +1,250 @@
+from time import time
+
+from ora_backend import cache, db
+from ora_backend.constants import ROLES
+
+# The number of chats subscribed by each volunteer, in a sorted set,
+# the same for the online volunteers only,
+# and the time (in seconds) until which each volunteer is online
+VOLUNTEER_LOADS = "volunteer_loads"
+ONLINE_VOLUNTEER_LOADS = "online_volunteer_loads"
+ONLINE_VOLUNTEERS = "online_volunteer_expiries"
+
+# The online volunteers of a worker stay online for that long after its last heartbeat,
+# so that they are set offline if the worker stops without disconnecting them
+ONLINE_VOLUNTEER_TTL = 150  # Seconds
+
+# The online volunteers of this worker
+_online_volunteer_ids = set()
+
+# Pick the least loaded online volunteer of each chat, other than its excluded ones,
+# or the least loaded offline one if none is online.
+# If ARGV[1] is "1", the excluded volunteers are picked if there are no others.
+# The volunteers online until before ARGV[2] are set offline first.
+# The next ARGV are, for each chat, the number of its excluded volunteers
+# followed by their ids.
+# The volunteers' loads are incremented in the same step,
+# so that the concurrent assignments pick different volunteers.
+# If a chat has no volunteer, none is picked for the whole batch
+PICK_VOLUNTEERS_SCRIPT = """
+local fallback = ARGV[1] == '1'
+
+for _, staff_id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[2])) do
+    redis.call('ZREM', KEYS[3], staff_id)
+    redis.call('ZREM', KEYS[2], staff_id)
+end
+
+-- Return the least loaded volunteer of the sorted set,
+-- who is neither excluded nor, if `offline`, online.
+-- The volunteers before it are all excluded, so it is among the first `limit` ones
+local function least_loaded(key, excluded, limit, offline)
+    local staff_ids = redis.call('ZRANGEBYSCORE', key, '-inf', '+inf', 'LIMIT', 0, limit)
+    for _, staff_id in ipairs(staff_ids) do
+        if not excluded[staff_id]
+            and not (offline and redis.call('ZSCORE', KEYS[2], staff_id)) then
+            return staff_id
+        end
+    end
+    return nil
+end
+
+local function change_load(staff_id, delta)
+    redis.call('ZINCRBY', KEYS[1], delta, staff_id)
+    if redis.call('ZSCORE', KEYS[2], staff_id) then
+        redis.call('ZINCRBY', KEYS[2], delta, staff_id)
+    end
+end
+
+local picked = {}
+local i = 3
+while i <= #ARGV do
+    local excluded = {}
+    local count = tonumber(ARGV[i])
+    for j = i + 1, i + count do
+        excluded[ARGV[j]] = true
+    end
+    i = i + count + 1
+
+    -- An online volunteer, or an offline one if all the online ones are excluded
+    local staff_id = least_loaded(KEYS[2], excluded, count + 1, false)
+        or least_loaded(KEYS[1], excluded, count + 1, true)
+    -- If all the volunteers are excluded, an online one or an offline one
+    if not staff_id and fallback then
+        staff_id = least_loaded(KEYS[2], {}, 1, false)
+            or least_loaded(KEYS[1], {}, 1, false)
+    end
+    if not staff_id then
+        for _, picked_staff_id in ipairs(picked) do
+            change_load(picked_staff_id, -1)
+        end
+        return {}
+    end
+    change_load(staff_id, 1)
+    picked[#picked + 1] = staff_id
+end
+return picked
+"""
+
+# Only change the loads of the volunteers, as the other staffs aren't assigned chats
+CHANGE_LOADS_SCRIPT = """
+for i = 2, #ARGV do
+    for _, key in ipairs(KEYS) do
+        if redis.call('ZSCORE', key, ARGV[i]) then
+            local load = redis.call('ZINCRBY', key, ARGV[1], ARGV[i])
+            if tonumber(load) < 0 then
+                redis.call('ZADD', key, 0, ARGV[i])
+            end
+        end
+    end
+end
+return 0
+"""
+
+# Keep the volunteers online until ARGV[1], with their loads among the online ones
+SET_ONLINE_SCRIPT = """
+for i = 2, #ARGV do
+    redis.call('ZADD', KEYS[3], ARGV[1], ARGV[i])
+    local load = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if load then
+        redis.call('ZADD', KEYS[2], load, ARGV[i])
+    end
+end
+return 0
+"""
+
+volunteer_loads_query = db.text(
+    """
+    SELECT "user".id, COUNT(staff_subscription_chat.internal_id)
+    FROM "user"
+    LEFT OUTER JOIN staff_subscription_chat
+        ON staff_subscription_chat.staff_id = "user".id
+    WHERE
+        "user".role_id = :agent_role_id
+        AND "user".disabled = FALSE
+    GROUP BY "user".id;
+    """
+)
+
+
+def _get_key(name):
+    return cache.build_key(name, namespace="staffs")
+
+
+def _get_keys():
+    return [
+        _get_key(VOLUNTEER_LOADS),
+        _get_key(ONLINE_VOLUNTEER_LOADS),
+        _get_key(ONLINE_VOLUNTEERS),
+    ]
+
+
+async def reset_volunteer_loads():
+    """Count the chats of the enabled volunteers in the db."""
+    loads = (
+        await db.status(
+            volunteer_loads_query, {"agent_role_id": ROLES.inverse["agent"]}
+        )
+    )[1]
+    key, online_key, expiries_key = _get_keys()
+    if not loads:
+        await cache.raw("delete", key, online_key)
+        return
+
+    # Replace the loads at once
+    scores_and_members = []
+    for staff_id, load in loads:
+        scores_and_members += [load, staff_id]
+    temp_key = key + "_new"
+    await cache.raw("delete", temp_key)
+    await cache.raw("zadd", temp_key, *scores_and_members)
+    await cache.raw("rename", temp_key, key)
+
+    # Copy the loads of the online volunteers
+    await cache.raw(
+        "zinterstore", online_key, (key, 1), (expiries_key, 0), with_weights=True
+    )
+
+
+async def change_volunteer_loads(staff_ids, delta: int):
+    """Change the load of the volunteers by `delta`, once per occurrence."""
+    if staff_ids:
+        await cache.raw(
+            "eval",
+            CHANGE_LOADS_SCRIPT,
+            _get_keys()[:2],
+            [delta, *staff_ids],
+        )
+
+
+async def set_volunteer_online(staff_id, is_online: bool):
+    if is_online:
+        _online_volunteer_ids.add(staff_id)
+        await keep_volunteers_online([staff_id])
+    else:
+        _online_volunteer_ids.discard(staff_id)
+        keys = _get_keys()
+        await cache.raw("zrem", keys[1], staff_id)
+        await cache.raw("zrem", keys[2], staff_id)
+
+
+async def keep_volunteers_online(staff_ids=None):
+    """
+    Keep the volunteers online for `ONLINE_VOLUNTEER_TTL` more seconds.
+
+    Args:
+        staff_ids (list):
+            The ids of the volunteers. Default to the online volunteers of this worker.
+    """
+    if staff_ids is None:
+        staff_ids = list(_online_volunteer_ids)
+    if staff_ids:
+        await cache.raw(
+            "eval",
+            SET_ONLINE_SCRIPT,
+            _get_keys(),
+            [time() + ONLINE_VOLUNTEER_TTL, *staff_ids],
+        )
+
+
+async def pick_volunteers(exclude_staff_ids_of_chats, *, fallback=False):
+    """
+    Return the ids of the least loaded volunteers of the chats, preferably online ones,
+    picked in one step with their loads incremented for the chats assigned to them.
+
+    Args:
+        exclude_staff_ids_of_chats (list):
+            The ids of the volunteers not to pick, for each chat.
+
+    Kwargs:
+        fallback (bool):
+            Pick the excluded volunteers of a chat if there are no others.
+
+    Return an empty list if a chat has no volunteers (other than the excluded ones).
+    """
+    if not exclude_staff_ids_of_chats:
+        return []
+
+    keys = _get_keys()
+    args = [int(fallback), time()]
+    for exclude_staff_ids in exclude_staff_ids_of_chats:
+        exclude_staff_ids = list(exclude_staff_ids)
+        args += [len(exclude_staff_ids), *exclude_staff_ids]
+
+    staff_ids = await cache.raw("eval", PICK_VOLUNTEERS_SCRIPT, keys, args)
+    if not staff_ids and not await cache.raw("exists", keys[0]):
+        # The loads are counted from the db if they are missing from the cache
+        await reset_volunteer_loads()
+        staff_ids = await cache.raw("eval", PICK_VOLUNTEERS_SCRIPT, keys, args)
+
+    return [staff_id.decode("utf-8") for staff_id in staff_ids]
+
+
+async def pick_volunteer(exclude_staff_ids=()):
+    """
+    Return the id of the least loaded volunteer, preferably an online one,
+    with its load incremented for the chat assigned to it.
+
+    Return None if there are no volunteers other than the excluded ones.
+    """
+    staff_ids = await pick_volunteers([exclude_staff_ids])
+    return staff_ids[0] if staff_ids else None
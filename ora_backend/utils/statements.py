@@ -0,0 +1,69 @@
+from itertools import product
+
+from sqlalchemy.util import LRUCache
+
+from ora_backend import db
+from ora_backend.config.db import COMPILED_CACHE_SIZE
+
+
+class Statements:
+    """
+    The `db.text()` variants of a raw SQL query, built once.
+
+    Each returned `TextClause` is the same object for the same options,
+    so its compilation is cached by SQLAlchemy (refer to `enable_compiled_cache()`),
+    and its SQL string is the same, so asyncpg reuses its prepared statement.
+
+    Args:
+        build (function):
+            Return the SQL string of a variant, given the options as kwargs.
+
+        **options:
+            The possible values of each option.
+            All the combinations are built at import.
+            If there are no options, the variants are built on their first use.
+
+    Example:
+        statements = Statements(
+            lambda exclude_unhandled: "SELECT ..." + ("AND ..." if exclude_unhandled else ""),
+            exclude_unhandled=(False, True),
+        )
+        await db.status(statements.get(exclude_unhandled=True), params)
+    """
+
+    def __init__(self, build, **options):
+        self._build = build
+        self._names = sorted(options)
+        self._variants = {}
+        # Without options, the variants are built on their first use
+        if options:
+            for values in product(*(options[name] for name in self._names)):
+                self.get(**dict(zip(self._names, values)))
+
+    def get(self, **options):
+        """
+        Return the variant of the given options.
+
+        A variant not built at import (e.g. built from a list of fields)
+        is built on its first use.
+        """
+        key = tuple(sorted(options.items()))
+        statement = self._variants.get(key)
+        if statement is None:
+            statement = self._variants[key] = db.text(self._build(**options))
+        return statement
+
+
+def create_compiled_cache():
+    return LRUCache(COMPILED_CACHE_SIZE)
+
+
+def enable_compiled_cache(engine):
+    """
+    Cache the compiled SQL of the statements executed by the engine,
+    keyed by the statements' objects.
+
+    Only the statements re-used between calls benefit from it, i.e.
+    the variants of `Statements` and the cached queries of `get_one`/`get_many`.
+    """
+    engine.update_execution_options(compiled_cache=create_compiled_cache())
@@ -1,7 +1,92 @@
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from functools import wraps
+from inspect import isawaitable
 
 from ora_backend import db
 
+_current_unit_of_work = ContextVar("unit_of_work", default=None)
+
+
+class UnitOfWork:
+    """The actions to run once an operation is committed, or rolled back."""
+
+    def __init__(self):
+        self.callbacks = []
+        self.rollback_callbacks = []
+
+    def after_commit(self, func, *args, **kwargs):
+        self.callbacks.append((func, args, kwargs))
+
+    def after_rollback(self, func, *args, **kwargs):
+        self.rollback_callbacks.append((func, args, kwargs))
+
+    async def run_callbacks(self, rolled_back=False):
+        for func, args, kwargs in (
+            self.rollback_callbacks if rolled_back else self.callbacks
+        ):
+            result = func(*args, **kwargs)
+            if isawaitable(result):
+                await result
+
+
+@asynccontextmanager
+async def unit_of_work():
+    """
+    Run the db operations of an operation in one connection and transaction.
+
+    The nested units of work and the functions decorated with `in_transaction`
+    join the current one, and the actions passed to `after_commit`
+    run in order once it is committed (or are dropped if it is rolled back).
+    The actions passed to `after_rollback` only run if it is rolled back.
+    """
+    current = _current_unit_of_work.get()
+    if current is not None:
+        yield current
+        return
+
+    current = UnitOfWork()
+    token = _current_unit_of_work.set(current)
+    rolled_back = True
+    try:
+        async with db.transaction():
+            yield current
+        rolled_back = False
+    finally:
+        _current_unit_of_work.reset(token)
+        if rolled_back:
+            await current.run_callbacks(rolled_back=True)
+
+    await current.run_callbacks()
+
+
+async def after_commit(func, *args, **kwargs):
+    """
+    Run `func` once the current unit of work is committed,
+    or right away outside of a unit of work.
+    """
+    current = _current_unit_of_work.get()
+    if current is not None:
+        current.after_commit(func, *args, **kwargs)
+        return None
+
+    result = func(*args, **kwargs)
+    if isawaitable(result):
+        result = await result
+    return result
+
+
+async def after_rollback(func, *args, **kwargs):
+    """
+    Run `func` if the current unit of work is rolled back,
+    e.g. to undo the changes made outside of the db.
+
+    Outside of a unit of work, there is nothing to roll back.
+    """
+    current = _current_unit_of_work.get()
+    if current is not None:
+        current.after_rollback(func, *args, **kwargs)
+
 
 def in_transaction(func=None):
     """
@@ -12,6 +97,10 @@ def in_transaction(func=None):
 
     @wraps(func)
     async def inner(*args, **kwargs):
+        # Join the current unit of work, which commits the changes at its end
+        if _current_unit_of_work.get() is not None:
+            return await func(*args, **kwargs)
+
         # TO-DO: Implement a retry mechanism with exponential backoff
         # if necessary
         async with db.transaction():
@@ -1,5 +1,4 @@
 from functools import partial, wraps
-from cerberus import Validator
 from sanic.exceptions import Forbidden, Unauthorized
 from sanic_jwt_extended.decorators import (
     get_jwt_data_in_request_header,
@@ -13,11 +12,19 @@ from ora_backend.models import User, Visitor
 from ora_backend.schemas import schemas
 from ora_backend.utils.auth import get_token_requester_from_request
 from ora_backend.utils.exceptions import raise_permission_exception
+from ora_backend.utils.validators import get_fast_validator, get_validator
 
 
 def validate_against_schema(document, schema_name, update=False):
-    _validator = Validator()
-    if not _validator.validate(document, schemas[schema_name], update=update):
+    # Most documents are valid, and are checked without Cerberus if the schema is simple
+    fast_validator = get_fast_validator(schema_name)
+    if fast_validator is not None:
+        validated_document = fast_validator(document, update=update)
+        if validated_document is not None:
+            return validated_document
+
+    _validator = get_validator(schema_name)
+    if not _validator.validate(document, update=update):
         raise SchemaValidationError(_validator.errors)
 
     return _validator.document
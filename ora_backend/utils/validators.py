@@ -0,0 +1,127 @@
+from functools import lru_cache
+from threading import local
+
+from cerberus import Validator
+
+from ora_backend.schemas import schemas
+
+# The types checked by the fast validators, with their exact Python types
+FAST_TYPES = {"string": str, "integer": int, "boolean": bool, "dict": dict}
+
+# The rules the fast validators are able to check
+FAST_RULES = {
+    "type",
+    "coerce",
+    "required",
+    "nullable",
+    "empty",
+    "min",
+    "max",
+    "minlength",
+    "maxlength",
+    "readonly",
+}
+
+_local = local()
+
+
+def get_validator(schema_name):
+    """
+    Return the Cerberus validator of a schema, built once per thread.
+
+    A validator holds the state of its last validation,
+    so it is never shared between threads. Within a thread, `validate()`
+    is synchronous, so the tasks can't interleave while reading its result.
+    """
+    validators = getattr(_local, "validators", None)
+    if validators is None:
+        validators = _local.validators = {}
+
+    validator = validators.get(schema_name)
+    if validator is None:
+        validator = validators[schema_name] = Validator(schemas[schema_name])
+    return validator
+
+
+def _compile_field_check(rules: dict):
+    """
+    Return a function returning the (coerced) value of a field if it is valid,
+    or raising ValueError.
+    """
+    if rules.get("readonly"):
+
+        def check_readonly(value):
+            raise ValueError("The field is read-only")
+
+        return check_readonly
+
+    coerce = rules.get("coerce")
+    expected_type = FAST_TYPES.get(rules.get("type"))
+    disallow_empty = rules.get("empty") is False
+    minimum, maximum = rules.get("min"), rules.get("max")
+    minlength, maxlength = rules.get("minlength"), rules.get("maxlength")
+
+    def check_field(value):
+        # The null values are left to Cerberus, as for their coercion
+        if value is None:
+            raise ValueError("The field is null")
+        if coerce is not None:
+            value = coerce(value)
+        if expected_type is not None and type(value) is not expected_type:
+            raise ValueError("The field has a wrong type")
+        if disallow_empty and not value and hasattr(value, "__len__"):
+            raise ValueError("The field is empty")
+        if minimum is not None and value < minimum:
+            raise ValueError("The field is below its minimum")
+        if maximum is not None and value > maximum:
+            raise ValueError("The field is above its maximum")
+        if minlength is not None and len(value) < minlength:
+            raise ValueError("The field is too short")
+        if maxlength is not None and len(value) > maxlength:
+            raise ValueError("The field is too long")
+        return value
+
+    return check_field
+
+
+def _is_simple_rules(rules: dict):
+    return (
+        set(rules) <= FAST_RULES
+        and (rules.get("type") is None or rules["type"] in FAST_TYPES)
+        and (rules.get("coerce") is None or callable(rules["coerce"]))
+    )
+
+
+@lru_cache(maxsize=None)
+def get_fast_validator(schema_name):
+    """
+    Return a function validating a document with plain Python checks,
+    or None if the schema has rules other than the simple ones (`FAST_RULES`).
+
+    The function returns the validated document,
+    or None if the document might be invalid, to be validated by Cerberus instead
+    (which returns the errors in its own format).
+    """
+    schema = schemas[schema_name]
+    if not all(_is_simple_rules(rules) for rules in schema.values()):
+        return None
+
+    checks = {field: _compile_field_check(rules) for field, rules in schema.items()}
+    required_fields = frozenset(
+        field for field, rules in schema.items() if rules.get("required")
+    )
+
+    def validate(document, update=False):
+        if not update and not required_fields <= document.keys():
+            return None
+
+        validated = {}
+        try:
+            for field, value in document.items():
+                validated[field] = checks[field](value)
+        except Exception:
+            # Unknown fields, failed coercions or invalid values
+            return None
+        return validated
+
+    return validate
@@ -0,0 +1,59 @@
+"""
+The versions of the tables, which change whenever one of their rows changes.
+
+They are counters in Redis, bumped once the changes are committed,
+and are used as cheap version stamps of the responses (Refer to `utils/etag.py`).
+
+A missing counter (e.g. after Redis is flushed) starts at the current time
+in milliseconds, so that it never goes back to a version seen before.
+"""
+from time import time
+
+from ora_backend import cache
+from ora_backend.constants import CACHE_VERSIONS
+
+# Start the missing counters, and return the versions
+GET_VERSIONS_SCRIPT = """
+local versions = {}
+for i, key in ipairs(KEYS) do
+    local version = redis.call('GET', key)
+    if not version then
+        version = ARGV[1]
+        redis.call('SET', key, version)
+    end
+    versions[i] = version
+end
+return versions
+"""
+
+BUMP_VERSION_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('INCR', KEYS[1])
+end
+redis.call('SET', KEYS[1], ARGV[1])
+return 0
+"""
+
+
+def _get_initial_version():
+    return int(time() * 1000)
+
+
+async def get_table_versions(*tables):
+    """Return the versions of the tables, as a string."""
+    versions = await cache.raw(
+        "eval",
+        GET_VERSIONS_SCRIPT,
+        [cache.build_key(table, namespace=CACHE_VERSIONS) for table in tables],
+        [_get_initial_version()],
+    )
+    return ".".join(version.decode("utf-8") for version in versions)
+
+
+async def bump_table_version(table):
+    await cache.raw(
+        "eval",
+        BUMP_VERSION_SCRIPT,
+        [cache.build_key(table, namespace=CACHE_VERSIONS)],
+        [_get_initial_version()],
+    )
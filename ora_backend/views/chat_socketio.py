@@ -1,3 +1,4 @@
+import asyncio
 from os import environ as _environ
 from pprint import pprint
 
@@ -30,17 +31,23 @@ from ora_backend.models import (
     ChatFlagged,
     Setting,
     NotificationStaff,
+    NotificationStaffRead,
 )
 from ora_backend.utils.auth import get_token_requester
 from ora_backend.utils.query import (
-    get_one_latest,
     get_flagged_chats_of_online_visitors,
     get_many,
+    get_numbers_of_unread_notifications_for_staffs,
     get_subscribed_staffs_for_visitor,
 )
-from ora_backend.utils.assign import auto_assign_staff_to_chat
+from ora_backend.utils import fast_json
+from ora_backend.utils.assign import auto_assign_staff_to_chat, get_staffs_by_id
+from ora_backend.utils.exceptions import raise_not_found_exception
 from ora_backend.utils.notifications import send_notifications_to_all_high_ups
+from ora_backend.utils.replica import read_from_primary
 from ora_backend.utils.settings import get_settings_from_cache
+from ora_backend.utils.staff_loads import set_volunteer_online
+from ora_backend.utils.transaction import after_commit, unit_of_work
 from ora_backend.utils.permissions import role_is_authorized
 from ora_backend.utils.query import get_supervisor_emails_to_send_emails
 from ora_backend.worker.tasks import (
@@ -65,10 +72,14 @@ if mode == "production":
         cors_credentials=True,
         ping_timeout=30,  # in seconds
         ping_interval=15,
+        json=fast_json,
     )
 elif mode == "testing":
     sio = socketio.AsyncServer(
-        async_mode="sanic", cors_allowed_origins=[], cors_credentials=True
+        async_mode="sanic",
+        cors_allowed_origins=[],
+        cors_credentials=True,
+        json=fast_json,
     )
 else:
     sio = socketio.AsyncServer(
@@ -77,6 +88,7 @@ else:
         cors_credentials=True,
         logger=True,
         engineio_logger=True,
+        json=fast_json,
     )
 sio.attach(app)
 
@@ -136,12 +148,7 @@ async def get_or_create_visitor_session(
     if not visitor:
         visitor = await Visitor.get(id=visitor_id)
 
-    latest_chat_msg = await get_one_latest(
-        ChatMessage, chat_id=chat_room["id"], order_by="sequence_num"
-    )
-    sequence_num = 0
-    if latest_chat_msg:
-        sequence_num = latest_chat_msg.sequence_num
+    sequence_num = await ChatMessage.get_latest_sequence_num(chat_room["id"])
 
     subscribed_staffs = await get_subscribed_staffs_for_visitor(visitor_id)
     staffs = {staff["id"]: staff for staff in subscribed_staffs}
@@ -183,6 +190,49 @@ async def get_or_create_visitor_session(
     return data
 
 
+async def emit_new_notifications(notifications, onl_users=None):
+    """Push the new notifications to the online staffs, with their unread counts."""
+    if onl_users is None:
+        onl_users = await cache.get(ONLINE_USERS_PREFIX, {})
+
+    # Only the online staffs are notified
+    notifications = [
+        notification
+        for notification in notifications
+        if notification["staff_id"] in onl_users
+    ]
+    if not notifications:
+        return
+
+    # Count the unread notifications once per staff.
+    # The new notifications may not be on the replica yet
+    with read_from_primary():
+        nums_of_unread = await get_numbers_of_unread_notifications_for_staffs(
+            [notification["staff_id"] for notification in notifications],
+            NotificationStaffRead,
+            NotificationStaff,
+        )
+
+    await asyncio.gather(
+        *(
+            sio.emit(
+                "notification_new",
+                {
+                    "notification": notification,
+                    "num_of_unread": nums_of_unread[notification["staff_id"]],
+                },
+                room=onl_users[notification["staff_id"]]["sid"],
+            )
+            for notification in notifications
+        )
+    )
+
+
+async def notify_staff(staff_id, content: dict, *, onl_users=None):
+    notification = await NotificationStaff.add(staff_id=staff_id, content=content)
+    await after_commit(emit_new_notifications, [notification], onl_users)
+
+
 async def add_staff_to_chat_if_possible(
     staff_id, visitor_id, visitor_info, *, send_notification=True
 ):
@@ -204,66 +254,74 @@ async def add_staff_to_chat_if_possible(
     online_users_room = ONLINE_USERS_PREFIX
     onl_users = await cache.get(online_users_room, {})
 
-    if staff_id not in current_staffs:
-        staff = await User.get(id=staff_id)
+    # Commit the changes at once, before letting the staffs know
+    # and updating the chat room
+    async with unit_of_work():
+        if staff_id not in current_staffs:
+            staff = await User.get(id=staff_id)
 
-        visitor_info["room"].setdefault("staffs", {})[staff["id"]] = staff
-        await StaffSubscriptionChat.add_if_not_exists(
-            staff_id=staff_id, visitor_id=visitor_id
-        )
-
-        # If the added staff is online, add him to the chat room
-        if staff_id in onl_users:
-            new_staff_sid = onl_users[staff_id]["sid"]
-            sio.enter_room(new_staff_sid, room)
-            await sio.emit(
-                "staff_goes_online",
-                data={"staff": staff},
-                room=room,
-                skip_sid=new_staff_sid,
-            )
-        else:
-            # Send an email if the user is offline
-            send_email_for_new_assigned_chat.apply_async(
-                ([staff["email"]], visitor_info["user"]),
-                expires=60 * 5,  # seconds
-                retry_policy={"interval_start": 10},
+            room_staffs = visitor_info["room"].setdefault("staffs", {})
+            await StaffSubscriptionChat.add_if_not_exists(
+                staff_id=staff_id, visitor_id=visitor_id
             )
+            await after_commit(room_staffs.update, {staff["id"]: staff})
 
-        # Let everyone in the chat know a staff has been added
-        try:
-            unhandled_info = await ChatUnhandled.get(
-                visitor_id=visitor_info["user"]["id"]
-            )
-        except NotFound:
-            unhandled_info = None
+            # If the added staff is online, add him to the chat room
+            if staff_id in onl_users:
+                new_staff_sid = onl_users[staff_id]["sid"]
+                await after_commit(sio.enter_room, new_staff_sid, room)
+                await after_commit(
+                    sio.emit,
+                    "staff_goes_online",
+                    data={"staff": staff},
+                    room=room,
+                    skip_sid=new_staff_sid,
+                )
+            else:
+                # Send an email if the user is offline
+                await after_commit(
+                    send_email_for_new_assigned_chat.apply_async,
+                    ([staff["email"]], visitor_info["user"]),
+                    expires=60 * 5,  # seconds
+                    retry_policy={"interval_start": 10},
+                )
 
-        await sio.emit(
-            "staff_being_added_to_chat",
-            {
-                "staff": staff,
-                "visitor": {
-                    **visitor_info["room"],
-                    **visitor_info["user"],
-                    "unhandled_timestamp": unhandled_info["created_at"]
-                    if unhandled_info
-                    else 0,
-                },
-            },
-            room=room,
-        )
+            # Let everyone in the chat know a staff has been added
+            try:
+                unhandled_info = await ChatUnhandled.get(
+                    visitor_id=visitor_info["user"]["id"]
+                )
+            except NotFound:
+                unhandled_info = None
 
-        if send_notification:
-            # Send a notification to staff
-            await NotificationStaff.add(
-                staff_id=staff_id,
-                content={
-                    "content": "You have been assigned to talk to {}".format(
-                        visitor_info["user"]["name"]
-                    )
+            await after_commit(
+                sio.emit,
+                "staff_being_added_to_chat",
+                {
+                    "staff": staff,
+                    "visitor": {
+                        **visitor_info["room"],
+                        **visitor_info["user"],
+                        "unhandled_timestamp": unhandled_info["created_at"]
+                        if unhandled_info
+                        else 0,
+                    },
                 },
+                room=room,
             )
 
+            if send_notification:
+                # Send a notification to staff
+                await notify_staff(
+                    staff_id,
+                    {
+                        "content": "You have been assigned to talk to {}".format(
+                            visitor_info["user"]["name"]
+                        )
+                    },
+                    onl_users=onl_users,
+                )
+
     return True, None, visitor_info
 
 
@@ -271,20 +329,33 @@ async def remove_staff_from_chat_if_possible(staff_id, visitor_id, visitor_info)
     room = visitor_info["room"]["id"]
     staff = await User.get(id=staff_id)
 
-    visitor_info["room"].setdefault("staffs", {}).pop(staff["id"], None)
-    await StaffSubscriptionChat.remove_if_exists(
-        staff_id=staff_id, visitor_id=visitor_id
-    )
+    # Commit the changes at once, before letting the staffs know
+    # and updating the chat room
+    async with unit_of_work():
+        room_staffs = visitor_info["room"].setdefault("staffs", {})
+        await StaffSubscriptionChat.remove_if_exists(
+            staff_id=staff_id, visitor_id=visitor_id
+        )
+        await after_commit(room_staffs.pop, staff["id"], None)
 
-    # Let everyone in the chat know a staff has been removed
-    await sio.emit(
-        "staff_being_removed_from_chat",
-        {"staff": staff, "visitor": {**visitor_info["room"], **visitor_info["user"]}},
-        room=room,
-    )
+        # Let everyone in the chat know a staff has been removed
+        await after_commit(
+            sio.emit,
+            "staff_being_removed_from_chat",
+            {
+                "staff": staff,
+                "visitor": {**visitor_info["room"], **visitor_info["user"]},
+            },
+            room=room,
+        )
     return True, None, visitor_info
 
 
+async def emit_concurrently(emits):
+    """Send the emits, given as (args, kwargs) of `sio.emit`, at once."""
+    await asyncio.gather(*(sio.emit(*args, **kwargs) for args, kwargs in emits))
+
+
 async def update_staffs_in_chat_if_possible(
     requester, new_staff_ids, visitor_id, visitor_info
 ):
@@ -310,111 +381,147 @@ async def update_staffs_in_chat_if_possible(
             False,
         )
 
+    removed_staff_ids = cur_staff_ids - new_staff_ids
+    added_staff_ids = new_staff_ids - cur_staff_ids
+
+    # Fetch all the added staffs at once
+    added_staffs = {}
+    unhandled_info = None
+    if added_staff_ids:
+        added_staffs = await get_staffs_by_id(added_staff_ids)
+        for staff_id in added_staff_ids - added_staffs.keys():
+            raise_not_found_exception(User, id=staff_id)
+
+        try:
+            unhandled_info = await ChatUnhandled.get(
+                visitor_id=visitor_info["user"]["id"]
+            )
+        except NotFound:
+            unhandled_info = None
+
     # Get the online staffs
     online_users_room = ONLINE_USERS_PREFIX
     onl_users = await cache.get(online_users_room, {})
 
-    # Remove the old staffs
-    for cur_staff_id in cur_staff_ids:
-        if cur_staff_id not in new_staff_ids:
-            await StaffSubscriptionChat.remove_if_exists(
-                staff_id=cur_staff_id, visitor_id=visitor_id
-            )
+    emits = []
+    notifications = []
+    room_staffs = visitor_info["room"].setdefault("staffs", {})
 
+    # Commit the changes at once, before updating the chat room
+    # and letting the staffs know
+    async with unit_of_work():
+        # Remove the old staffs
+        for cur_staff_id in removed_staff_ids:
             # Remove the staff from socketio room
-            removed_staff = (
-                visitor_info["room"].setdefault("staffs", {}).pop(cur_staff_id, None)
-            )
-            if removed_staff and removed_staff["id"] in onl_users:
-                sio.leave_room(onl_users[removed_staff["id"]]["sid"], room)
+            # (The cached room may miss the staff, unlike the staffs from the db)
+            await after_commit(room_staffs.pop, cur_staff_id, None)
+            if cur_staff_id in onl_users:
+                await after_commit(sio.leave_room, onl_users[cur_staff_id]["sid"], room)
             else:
                 # Send an email if the user is offline
-                send_email_for_being_removed_from_chat.apply_async(
-                    ([removed_staff["email"]], visitor_info["user"]),
+                await after_commit(
+                    send_email_for_being_removed_from_chat.apply_async,
+                    ([current_staffs[cur_staff_id]["email"]], visitor_info["user"]),
                     expires=60 * 5,  # seconds
                     retry_policy={"interval_start": 10},
                 )
 
-            if cur_staff_id in current_staffs:
-                await sio.emit(
-                    "staff_being_removed_from_chat",
+            emits.append(
+                (
+                    ("staff_being_removed_from_chat",),
                     {
-                        "staff": current_staffs[cur_staff_id],
-                        "visitor": {**visitor_info["room"], **visitor_info["user"]},
+                        "data": {
+                            "staff": current_staffs[cur_staff_id],
+                            "visitor": {**visitor_info["room"], **visitor_info["user"]},
+                        },
+                        "room": room,
                     },
-                    room=room,
                 )
+            )
 
             # Send a notification to the staff
-            await NotificationStaff.add(
-                staff_id=cur_staff_id,
-                content={
-                    "content": "You have been removed from the chat with {}, by {}".format(
-                        visitor_info["user"]["name"], requester["full_name"]
-                    )
-                },
+            notifications.append(
+                {
+                    "staff_id": cur_staff_id,
+                    "content": {
+                        "content": "You have been removed from the chat with {}, by {}".format(
+                            visitor_info["user"]["name"], requester["full_name"]
+                        )
+                    },
+                }
             )
 
-    # Subscribe new staffs
-    for new_staff_id in new_staff_ids:
-        if new_staff_id not in current_staffs:
-            staff = await User.get(id=new_staff_id)
-
-            visitor_info["room"].setdefault("staffs", {})[staff["id"]] = staff
-            await StaffSubscriptionChat.add_if_not_exists(
-                staff_id=new_staff_id, visitor_id=visitor_id
-            )
+        # Subscribe new staffs
+        for new_staff_id in added_staff_ids:
+            staff = added_staffs[new_staff_id]
+            await after_commit(room_staffs.update, {new_staff_id: staff})
 
             # If the added staff is online, add him to the chat room
             if new_staff_id in onl_users:
                 new_staff_sid = onl_users[new_staff_id]["sid"]
-                sio.enter_room(new_staff_sid, room)
-                await sio.emit(
-                    "staff_goes_online",
-                    data={"staff": staff},
-                    room=room,
-                    skip_sid=new_staff_sid,
+                await after_commit(sio.enter_room, new_staff_sid, room)
+                emits.append(
+                    (
+                        ("staff_goes_online",),
+                        {
+                            "data": {"staff": staff},
+                            "room": room,
+                            "skip_sid": new_staff_sid,
+                        },
+                    )
                 )
             else:
                 # Send an email if the user is offline
-                send_email_for_new_assigned_chat.apply_async(
+                await after_commit(
+                    send_email_for_new_assigned_chat.apply_async,
                     ([staff["email"]], visitor_info["user"]),
                     expires=60 * 5,  # seconds
                     retry_policy={"interval_start": 10},
                 )
 
             # Let everyone in the chat know a staff has been added
-            try:
-                unhandled_info = await ChatUnhandled.get(
-                    visitor_id=visitor_info["user"]["id"]
-                )
-            except NotFound:
-                unhandled_info = 0
-            await sio.emit(
-                "staff_being_added_to_chat",
-                {
-                    "staff": staff,
-                    "visitor": {
-                        **visitor_info["room"],
-                        **visitor_info["user"],
-                        "unhandled_timestamp": unhandled_info["created_at"]
-                        if unhandled_info
-                        else 0,
+            emits.append(
+                (
+                    ("staff_being_added_to_chat",),
+                    {
+                        "data": {
+                            "staff": staff,
+                            "visitor": {
+                                **visitor_info["room"],
+                                **visitor_info["user"],
+                                "unhandled_timestamp": unhandled_info["created_at"]
+                                if unhandled_info
+                                else 0,
+                            },
+                        },
+                        "room": room,
                     },
-                },
-                room=room,
+                )
             )
 
             # Send a notification to staff
-            await NotificationStaff.add(
-                staff_id=new_staff_id,
-                content={
-                    "content": "You have been assigned to talk to {}, by {}".format(
-                        visitor_info["user"]["name"], requester["full_name"]
-                    )
-                },
+            notifications.append(
+                {
+                    "staff_id": new_staff_id,
+                    "content": {
+                        "content": "You have been assigned to talk to {}, by {}".format(
+                            visitor_info["user"]["name"], requester["full_name"]
+                        )
+                    },
+                }
             )
 
+        await StaffSubscriptionChat.remove_many_from_visitor(
+            visitor_id, list(removed_staff_ids)
+        )
+        await StaffSubscriptionChat.add_many_to_visitor(
+            visitor_id, list(added_staff_ids)
+        )
+        notifications = await NotificationStaff.bulk_upsert(notifications)
+
+        await after_commit(emit_concurrently, emits)
+        await after_commit(emit_new_notifications, notifications, onl_users)
+
     return True, None, visitor_info, True
 
 
@@ -439,6 +546,8 @@ async def connect(sid, environ: dict):
         onl_users = await cache.get(online_users_room, {})
         onl_users[user["id"]] = {**user, "sid": sid}
         await cache.set(online_users_room, onl_users)
+        if user["role_id"] == ROLES.inverse["agent"]:
+            await set_volunteer_online(user["id"], True)
         sio.enter_room(sid, org_id)
 
         # Update online user for other staffs
@@ -797,9 +906,9 @@ async def add_staff_to_chat(sid, data):
         return status, None
 
     # Send a notification to staff
-    await NotificationStaff.add(
-        staff_id=staff_id,
-        content={
+    await notify_staff(
+        staff_id,
+        {
             "content": "You have been assigned to talk to {}, by {}".format(
                 new_visitor_info["user"]["name"], user["full_name"]
             )
@@ -838,9 +947,9 @@ async def remove_staff_from_chat(sid, data):
         return status, None
 
     # Send a notification to staff
-    await NotificationStaff.add(
-        staff_id=staff_id,
-        content={
+    await notify_staff(
+        staff_id,
+        {
             "content": "You have been removed from the chat with {}, by {}".format(
                 new_visitor_info["user"]["name"], user["full_name"]
             )
@@ -1186,13 +1295,14 @@ async def change_chat_priority(sid, data):
         await ChatFlagged.add_if_not_exists(
             visitor_id=visitor_info["user"]["id"], flag_message=flag_message
         )
-        await send_notifications_to_all_high_ups(
+        notifications = await send_notifications_to_all_high_ups(
             {
                 "content": "{} has flagged a chat of visitor {}".format(
                     user["full_name"], visitor_info["user"]["name"]
                 )
             }
         )
+        await emit_new_notifications(notifications)
         receivers = await get_supervisor_emails_to_send_emails()
         send_email_for_flagged_chat.apply_async(
             (receivers, visitor_info["user"]),
@@ -1526,6 +1636,8 @@ async def disconnect(sid):
         if user["id"] in onl_users:
             onl_users.pop(user["id"], None)
             await cache.set(online_users_room, onl_users)
+        if user["role_id"] == ROLES.inverse["agent"]:
+            await set_volunteer_online(user["id"], False)
 
         org_room = session["org_room"]
         monitor_room = session["monitor_room"]
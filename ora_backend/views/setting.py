@@ -1,10 +1,11 @@
 from sanic.exceptions import Forbidden
-from sanic.response import json
 
 from ora_backend import cache
 from ora_backend.constants import ROLES, CACHE_SETTINGS
 from ora_backend.models import Setting
 from ora_backend.views.urls import setting_blueprint as blueprint
+from ora_backend.utils.etag import conditional_get, table_versions
+from ora_backend.utils.fast_json import json
 from ora_backend.utils.request import unpack_request
 from ora_backend.utils.settings import get_latest_settings
 from ora_backend.utils.validation import validate_request, validate_permission
@@ -33,6 +34,7 @@ async def change_global_settings(
 
 @blueprint.route("/", methods=["GET", "PUT", "PATCH"])
 @unpack_request
+@conditional_get(get_version=table_versions(Setting.__tablename__))
 async def get_settings(request, *, req_args=None, req_body=None, **kwargs):
     call_funcs = {
         "GET": get_all_settings,
@@ -1,4 +1,3 @@
-from sanic.response import json
 from sanic.exceptions import Forbidden
 
 from ora_backend.constants import ROLES
@@ -9,24 +8,27 @@ from ora_backend.models import (
     NotificationStaffRead,
     StaffSubscriptionChat,
 )
-from ora_backend.utils.assign import (
-    reset_all_volunteers_in_cache,
-    auto_assign_staff_to_chat,
-)
+from ora_backend.utils.assign import auto_assign_staff_to_chat
+from ora_backend.utils.etag import conditional_get, table_versions
 from ora_backend.utils.exceptions import (
     raise_role_authorization_exception,
     raise_permission_exception,
 )
+from ora_backend.utils.fast_json import json
 from ora_backend.utils.links import generate_pagination_links
+from ora_backend.utils.notification_counters import reset_unread_count
 from ora_backend.utils.query import (
     get_number_of_unread_notifications_for_staff,
     get_visitors_with_no_assigned_staffs,
     get_one_latest,
     delete_many,
 )
+from ora_backend.utils.replica import read_from_primary
 from ora_backend.utils.request import unpack_request
 from ora_backend.utils.settings import get_latest_settings
+from ora_backend.utils.staff_loads import reset_volunteer_loads
 from ora_backend.utils.validation import validate_request, validate_permission
+from ora_backend.utils.versions import bump_table_version
 from ora_backend.worker.tasks import (
     send_email_to_new_staff,
     send_email_to_staff_on_role_promoted,
@@ -38,14 +40,22 @@ from ora_backend.worker.tasks import (
 
 @validate_request(schema="user_read", skip_body=True)
 async def user_retrieve(
-    req, *, req_args, req_body, requester=None, many=True, query_params, **kwargs
+    req,
+    *,
+    req_args,
+    req_body,
+    requester=None,
+    many=True,
+    query_params,
+    fields=None,
+    **kwargs,
 ):
     # The requester can only get the users from his org
     if "organisation_id" not in requester:
         raise_permission_exception()
     req_args["organisation_id"] = requester["organisation_id"]
 
-    data = await User.get(**req_args, many=many, **query_params)
+    data = await User.get(**req_args, many=many, fields=fields, **query_params)
     if many:
         return {"data": data, "links": generate_pagination_links(req.url, data)}
     return {"data": data}
@@ -67,6 +77,9 @@ async def user_create(req, *, req_args, req_body, requester, **kwargs):
     req_body["organisation_id"] = requester["organisation_id"]
 
     user = await User.add(**req_body)
+    if user["role_id"] == ROLES.inverse["agent"]:
+        # Update the volunteers to assign
+        await reset_volunteer_loads()
 
     # Send email
     send_email_to_new_staff.apply_async(
@@ -101,14 +114,16 @@ async def user_update(req, *, req_args, req_body, requester, **kwargs):
     # When a staff is disabled:
     # - Remove him from all subscriptions
     # - If he is the only staff in a chat => re-assign
-    if "disabled" in req_body:
-        # Update the list of volunteers to assign
-        await reset_all_volunteers_in_cache()
+    if "disabled" in req_body or "role_id" in req_body:
+        # Update the volunteers to assign
+        await reset_volunteer_loads()
 
+    if "disabled" in req_body:
         is_disabled = req_body.get("disabled", False)
         if is_disabled:
             # Remove all subscriptions
             await delete_many(StaffSubscriptionChat, staff_id=user_id)
+            await bump_table_version(StaffSubscriptionChat.__tablename__)
 
             send_email_to_staff_on_disabled.apply_async(
                 ([new_user["email"]], requester),
@@ -165,7 +180,13 @@ async def user_delete(req, *, req_args, req_body, requester, **kwargs):
 @unpack_request
 @validate_permission
 async def user_route(
-    request, *, req_args=None, req_body=None, query_params=None, requester=None
+    request,
+    *,
+    req_args=None,
+    req_body=None,
+    query_params=None,
+    fields=None,
+    requester=None,
 ):
     """Only supervisor and admin could see and create users."""
     call_funcs = {"GET": user_retrieve, "POST": user_create}
@@ -174,6 +195,7 @@ async def user_route(
         req_args=req_args,
         req_body=req_body,
         query_params=query_params,
+        fields=fields,
         requester=requester,
     )
     return json(response)
@@ -182,8 +204,16 @@ async def user_route(
 @blueprint.route("/<user_id>", methods=["GET", "PUT", "PATCH"])
 @unpack_request
 @validate_permission
+@conditional_get(get_version=table_versions(User.__tablename__))
 async def user_route_single(
-    request, user_id, *, req_args=None, req_body=None, requester, query_params
+    request,
+    user_id,
+    *,
+    req_args=None,
+    req_body=None,
+    requester,
+    query_params,
+    fields=None,
 ):
     user_id = user_id.strip()
 
@@ -200,20 +230,25 @@ async def user_route_single(
         req_body=req_body,
         many=False,
         query_params=query_params,
+        fields=fields,
         requester=requester,
     )
     return json(response)
 
 
 @validate_request(schema="notification_staff_read", skip_body=True)
-async def noti_staff_retrieve(request, *, req_args=None, query_params=None, **kwargs):
+async def noti_staff_retrieve(
+    request, *, req_args=None, query_params=None, fields=None, **kwargs
+):
     notifs = await NotificationStaff.get(
-        **req_args, **query_params, many=True, decrease=True
+        **req_args, **query_params, many=True, decrease=True, fields=fields
     )
     staff_id = req_args["staff_id"]
-    number_of_unread_notis = await get_number_of_unread_notifications_for_staff(
-        staff_id, NotificationStaffRead, NotificationStaff
-    )
+    # Counted along the notifications just read from the primary
+    with read_from_primary():
+        number_of_unread_notis = await get_number_of_unread_notifications_for_staff(
+            staff_id, NotificationStaffRead, NotificationStaff
+        )
     return {
         "data": notifs,
         "num_of_unread": number_of_unread_notis,
@@ -232,6 +267,7 @@ async def noti_staff_refresh(request, *, req_args=None, query_params=None, **kwa
             else None
         },
     )
+    await reset_unread_count(staff_id)
     return {"data": None}
 
 
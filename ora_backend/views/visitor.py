@@ -1,4 +1,3 @@
-from sanic.response import json
 from sanic.exceptions import Forbidden, NotFound, InvalidUsage
 
 from ora_backend.constants import ROLES
@@ -6,16 +5,19 @@ from ora_backend.views.urls import visitor_blueprint as blueprint
 from ora_backend.models import (
     Visitor,
     Chat,
+    ChatActivity,
     ChatMessage,
-    User,
     ChatMessageSeen,
     BookmarkVisitor,
     ChatUnhandled,
     ChatFlagged,
     StaffSubscriptionChat,
+    User,
 )
 from ora_backend.schemas import to_boolean
-from ora_backend.utils.links import generate_pagination_links, generate_next_page_link
+from ora_backend.utils.etag import conditional_get, table_versions
+from ora_backend.utils.fast_json import json
+from ora_backend.utils.links import generate_pagination_links
 from ora_backend.utils.query import (
     get_visitors_with_most_recent_chats,
     get_bookmarked_visitors,
@@ -25,6 +27,7 @@ from ora_backend.utils.query import (
     get_staff_unhandled_visitors,
     get_self_subscribed_visitors,
     get_handled_chats,
+    get_one,
 )
 from ora_backend.utils.request import unpack_request
 from ora_backend.utils.validation import (
@@ -32,13 +35,14 @@ from ora_backend.utils.validation import (
     validate_permission,
     validate_against_schema,
 )
+from ora_backend.utils.versions import get_table_versions
 from ora_backend.worker.tasks import send_email_to_new_visitor
 
 
 @validate_permission
 @validate_request(schema="visitor_read", skip_body=True)
-async def visitor_retrieve(req, *, req_args, req_body, **kwargs):
-    return {"data": await Visitor.get(**req_args)}
+async def visitor_retrieve(req, *, req_args, req_body, fields=None, **kwargs):
+    return {"data": await Visitor.get(**req_args, fields=fields)}
 
 
 # @validate_request(schema="user_write")
@@ -103,7 +107,7 @@ async def get_unread_visitors(request, *, req_args, req_body, requester, **kwarg
 
 
 @validate_permission
-async def visitor_get_many(request, *, req_args, query_params, **kwargs):
+async def visitor_get_many(request, *, req_args, query_params, fields=None, **kwargs):
     query_params = query_params or {}
     exclude_unhandled = req_args.pop("exclude_unhandled", "false")
     exclude_unhandled = exclude_unhandled.lower() in {"1", "true"}
@@ -112,7 +116,7 @@ async def visitor_get_many(request, *, req_args, query_params, **kwargs):
         visitors = await get_handled_chats(Visitor, **query_params)
     else:
         visitors = await Visitor.get(
-            many=True, decrease=True, **req_args, **query_params
+            many=True, decrease=True, fields=fields, **req_args, **query_params
         )
     return {"data": visitors, "links": generate_pagination_links(request.url, visitors)}
 
@@ -155,6 +159,9 @@ async def visitor_route_single(
 @blueprint.route("/<visitor_id>/subscribed_staffs", methods=["GET"])
 @unpack_request
 @validate_permission
+@conditional_get(
+    get_version=table_versions(StaffSubscriptionChat.__tablename__, User.__tablename__)
+)
 async def get_subscribed_staffs_for_visitor_route(
     request, visitor_id, *, requester=None, req_args=None, query_params=None, **kwargs
 ):
@@ -251,11 +258,47 @@ async def get_subscribed_staffs_for_visitor_route(
     )
 
 
+async def get_messages_version(
+    request, visitor_id, *, req_args=None, query_params=None, **kwargs
+):
+    """
+    Return the version stamp of a page of messages, or None if it is still changing
+    (i.e. the pages after a message and from the unread ones).
+    """
+    req_args = req_args or {}
+    query_params = query_params or {}
+    if to_boolean(req_args.get("starts_from_unread", False)) or (
+        req_args.get("after_id") or query_params.get("after_id")
+    ):
+        return None
+
+    # The messages are never modified, but their senders are
+    senders_version = await get_table_versions(User.__tablename__)
+    if req_args.get("before_id"):
+        # The messages before a message are all written
+        return senders_version
+
+    # The latest page changes with every new message
+    chat = await get_one(Chat, visitor_id=visitor_id.strip())
+    if not chat:
+        return None
+    latest_sequence_num = await ChatMessage.get_latest_sequence_num(chat.id)
+    return "{}.{}".format(senders_version, latest_sequence_num)
+
+
 @blueprint.route("/<visitor_id>/messages", methods=["GET"])
 @unpack_request
 @validate_permission
+@conditional_get(get_version=get_messages_version)
 async def get_chat_messages_of_visitor(
-    request, visitor_id, *, requester, req_args=None, query_params=None, **kwargs
+    request,
+    visitor_id,
+    *,
+    requester,
+    req_args=None,
+    query_params=None,
+    fields=None,
+    **kwargs,
 ):
     visitor_id = visitor_id.strip()
     req_args = req_args or {}
@@ -319,6 +362,7 @@ async def get_chat_messages_of_visitor(
             before_id=before_id,
             after_id=after_id,
             exclude=exclude,
+            fields=fields,
         )
 
     prev_link = generate_pagination_links(
@@ -405,12 +449,12 @@ async def most_recent_visitors(
         {**req_args, **query_params}, "query_params_get_visitors"
     )
     visitors = await get_visitors_with_most_recent_chats(
-        Chat, ChatMessage, Visitor, User, requester, **params
+        ChatActivity, Visitor, requester, **params
     )
 
-    next_page_link = generate_next_page_link(
-        request.url, cur_page=params.get("page", 0)
-    )
+    next_page_link = generate_pagination_links(
+        request.url, visitors, exclude={"page"}
+    ).get("next")
     return json({"data": visitors, "links": {"next": next_page_link or {}}})
 
 
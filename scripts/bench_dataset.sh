@@ -0,0 +1,12 @@
+#!/bin/bash
+
+set -e
+export MODE=development
+export PYTHONPATH=.
+
+source .env
+
+# Load a large synthetic dataset into the `dev` PostgreSQL container
+# All the given arguments are passed to the generator, e.g.
+# ./scripts/bench_dataset.sh --visitors 100000 --messages 5000000 --staffs 500
+pipenv run python -m benchmarks.dataset "$@"
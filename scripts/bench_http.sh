@@ -0,0 +1,13 @@
+#!/bin/bash
+
+set -e
+export MODE=development
+export PYTHONPATH=.
+
+source .env
+
+# Requires the `dev` instance (./scripts/dev.sh) to be running,
+# with the rate limiter disabled, i.e. `SANIC_RATELIMIT_ENABLED=0`
+# All the given arguments are passed to the benchmark, e.g.
+# ./scripts/bench_http.sh --requests 500 --concurrency 20 --update-baseline
+pipenv run python -m benchmarks.http_endpoints "$@"
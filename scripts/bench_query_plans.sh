@@ -0,0 +1,12 @@
+#!/bin/bash
+
+set -e
+export MODE=development
+export PYTHONPATH=.
+
+source .env
+
+# Requires the `dev` PostgreSQL container, seeded by ./scripts/bench_dataset.sh
+# All the given arguments are passed to the check, e.g.
+# ./scripts/bench_query_plans.sh --update-snapshots
+pipenv run python -m benchmarks.query_plans "$@"
@@ -0,0 +1,12 @@
+#!/bin/bash
+
+set -e
+export MODE=development
+export PYTHONPATH=.
+
+source .env
+
+# Requires the `dev` instance (./scripts/dev.sh) to be running
+# All the given arguments are passed to the load generator, e.g.
+# ./scripts/bench_socket.sh --visitors 50 --staffs 10 --output bench_output.txt
+pipenv run python -m benchmarks.socket_load "$@"